@@ -3,9 +3,10 @@ from requests.exceptions import Timeout, RequestException
 import json
 from urllib.parse import unquote
 import os
+import time
 import boto3
 from datetime import datetime
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 
 # 全局配置变量
@@ -67,6 +68,9 @@ def create_dynamodb_record(file_name):
     """
     在 DynamoDB 中创建或更新文件处理记录
     
+    使用一次条件写入完成，记录状态为"处理成功"或其他服务器持有未过期的处理租约时不修改记录，
+    避免S3事件重试或重复上传时并发的两次调用都提交处理
+    
     Args:
         file_name (str): 文件名，作为唯一键
     
@@ -76,83 +80,83 @@ def create_dynamodb_record(file_name):
     current_time = datetime.now().isoformat()
     
     try:
-        # 查询是否已存在相同 file_name 的记录
-        response = table.query(
-            KeyConditionExpression=Key('file_name').eq(file_name)
+        table.update_item(
+            Key={
+                'file_name': file_name
+            },
+            UpdateExpression='SET created_at = if_not_exists(created_at, :updated_at), '
+                             'updated_at = :updated_at, #status = :status',
+            ConditionExpression=(
+                (Attr('status').not_exists() | Attr('status').ne('处理成功')) &
+                (Attr('lease_expires_at').not_exists() | Attr('lease_expires_at').lt(int(time.time())))
+            ),
+            ExpressionAttributeNames={
+                '#status': 'status'
+            },
+            ExpressionAttributeValues={
+                ':updated_at': current_time,
+                ':status': '上传成功'
+            }
         )
-        if response['Items']:
-            # 如果记录已存在，检查状态
-            existing_record = response['Items'][0]
-            existing_status = existing_record.get('status', '')
-            
-            # 如果状态为"处理成功"，则不做任何处理
-            if existing_status == '处理成功':
-                print(f"记录 {file_name} 已存在且状态为'处理成功'，跳过处理")
-                return True, '处理成功'
-            
-            # 如果记录已存在但状态不是"处理成功"，则更新
-            table.update_item(
-                Key={
-                    'file_name': file_name
-                },
-                UpdateExpression='SET updated_at = :updated_at, #status = :status',
-                ExpressionAttributeNames={
-                    '#status': 'status'
-                },
-                ExpressionAttributeValues={
-                    ':updated_at': current_time,
-                    ':status': '上传成功'
-                }
-            )
-            print(f"已更新 DynamoDB 记录: {file_name}")
-            return True, '上传成功'
-        else:
-            # 如果记录不存在，则创建新记录
-            table.put_item(
-                Item={
-                    'file_name': file_name,
-                    'created_at': current_time,
-                    'updated_at': current_time,
-                    'status': '上传成功'
-                }
-            )
-            print(f"已创建 DynamoDB 记录: {file_name}")
-            return True, '上传成功'
+        print(f"已创建/更新 DynamoDB 记录: {file_name}")
+        return True, '上传成功'
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"创建/更新 DynamoDB 记录失败: {str(e)}")
+            return False, ''
+        # 条件不满足：记录已处理成功，或正在由某个服务器处理
+        existing_status = table.get_item(Key={'file_name': file_name}).get('Item', {}).get('status', '')
+        if existing_status == '处理成功':
+            print(f"记录 {file_name} 已存在且状态为'处理成功'，跳过处理")
+            return True, '处理成功'
+        print(f"记录 {file_name} 正在处理中，跳过重复提交")
+        return True, '处理中'
     except Exception as e:
         print(f"创建/更新 DynamoDB 记录失败: {str(e)}")
-        return False
+        return False, ''
 
-def update_dynamodb_record(file_name, status):
+def update_dynamodb_record(file_name, status, expected_status=None):
     """
     更新 DynamoDB 中的文件处理记录状态
     
     Args:
         file_name (str): 文件名，作为唯一键
         status (str): 新的处理状态
+        expected_status (str): 记录的当前状态，提供时只在状态一致时更新，
+            避免覆盖后端服务已写入的处理状态
     """
     current_time = datetime.now().isoformat()
     
+    update_args = {
+        'Key': {
+            'file_name': file_name
+        },
+        'UpdateExpression': 'SET updated_at = :updated_at, #status = :status',
+        'ExpressionAttributeNames': {
+            '#status': 'status'
+        },
+        'ExpressionAttributeValues': {
+            ':updated_at': current_time,
+            ':status': status
+        }
+    }
+    if expected_status is not None:
+        update_args['ConditionExpression'] = Attr('status').eq(expected_status)
+    
     try:
-        table.update_item(
-            Key={
-                'file_name': file_name
-            },
-            UpdateExpression='SET updated_at = :updated_at, #status = :status',
-            ExpressionAttributeNames={
-                '#status': 'status'
-            },
-            ExpressionAttributeValues={
-                ':updated_at': current_time,
-                ':status': status
-            }
-        )
+        table.update_item(**update_args)
         print(f"已更新 DynamoDB 记录 {file_name} 的状态为: {status}")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            print(f"DynamoDB 记录 {file_name} 的状态已由后端服务更新，不再修改为: {status}")
+        else:
+            print(f"更新 DynamoDB 记录失败: {str(e)}")
     except Exception as e:
         print(f"更新 DynamoDB 记录失败: {str(e)}")
 
-def process_pdf_with_timeout(url, params, timeout=10):
+def submit_pdf_job(url, params, timeout=10):
     """
-    发送POST请求处理PDF文件，设置超时时间
+    向后端服务提交PDF处理任务，后端接受任务后立即返回202及任务ID
     
     Args:
         url (str): API端点URL
@@ -160,22 +164,35 @@ def process_pdf_with_timeout(url, params, timeout=10):
         timeout (int): 超时时间（秒）
     
     Returns:
-        dict: 响应结果
+        dict: 响应结果，提交成功时包含job_id
     """
     try:
         # 发送POST请求，设置超时时间
         response = requests.post(
             url,
             json=params,
-            timeout=timeout  # 设置超时时间为10秒
+            timeout=timeout
         )
+        
+        # 其他服务器正在处理同一文件
+        if response.status_code == 409:
+            print("文件正在处理中，跳过重复提交")
+            return {"error": "duplicate", "message": "File is already being processed"}
+        
+        # 后端任务队列已满
+        if response.status_code == 429:
+            print("后端任务队列已满，稍后重试")
+            return {"error": "queue_full", "message": "Job queue is full"}
+        
         response.raise_for_status()
-        return response.json()
+        result = response.json()
+        print(f"文档处理已提交，任务ID: {result.get('job_id')}")
+        return result
     
     except Timeout:
         # 处理超时异常
-        print(f"文档处理已提交，等待后端服务处理")
-        return {"sueecss": "文档处理提交成功", "message": f"文档处理已提交，等待后端服务处理"}
+        print(f"提交文档处理任务超时")
+        return {"error": "timeout", "message": f"Request timed out after {timeout} seconds"}
     
     except RequestException as e:
         # 处理其他请求异常
@@ -234,6 +251,13 @@ def lambda_handler(event, context):
             'statusCode': 200,
             'body': {"message": "文件已处理成功，跳过处理"}
         }
+    
+    # 其他服务器持有该文件的处理租约，不重复提交
+    if record_status == '处理中':
+        return {
+            'statusCode': 200,
+            'body': {"message": "文件正在处理中，跳过重复提交"}
+        }
 
     # 请求参数，使用全局变量
     request_params = {
@@ -246,18 +270,30 @@ def lambda_handler(event, context):
     }
     
     # 发送请求，使用全局API_URL
-    result = process_pdf_with_timeout(API_URL, request_params)
+    result = submit_pdf_job(API_URL, request_params)
+    
+    # 后端繁忙时抛出异常，由Lambda异步调用的重试机制稍后重新提交
+    if result.get("error") == "queue_full":
+        raise RuntimeError(f"后端任务队列已满，文件 {file_name} 等待重试")
+    
+    # 后端在入队前发现重复请求，不修改记录状态
+    if result.get("error") == "duplicate":
+        return {
+            'statusCode': 200,
+            'body': {"message": "文件正在处理中，跳过重复提交"}
+        }
     
-    # 处理响应结果
+    # 处理响应结果，只在记录仍为提交前的状态时更新：后端接受任务后由服务写入处理状态，
+    # 复用已有输出等快速完成的任务可能已写入处理成功，不能被覆盖
     if "error" in result:
         print(f"处理失败: {result['message']}")
         # 如果处理失败，更新记录状态
         if record_created:
-            update_dynamodb_record(file_name, '提交转换失败')
+            update_dynamodb_record(file_name, '提交转换失败', expected_status=record_status)
     else:
         # 如果处理成功，更新记录状态
-        if record_created and "sueecss" in result:
-            update_dynamodb_record(file_name, '转换处理中')
+        if record_created and "job_id" in result:
+            update_dynamodb_record(file_name, '转换处理中', expected_status=record_status)
     
     # 由于代码被注释，返回一个默认响应
     return {
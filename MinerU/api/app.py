@@ -5,8 +5,15 @@ Flask应用模块，提供HTTP API接口
 import os
 import logging
 from flask import Flask, request, jsonify
-from services.pdf_service import process_pdf_file
-from services.markdown_service import process_markdown_file
+from services.job_service import get_job_manager
+from services.job_manager import JOB_AWAITING_CREDENTIALS, CREDENTIAL_PARAMS
+from services.pdf_service import get_parse_pool, get_md_file_path
+from services.artifact_service import get_artifact_renderer, cleanup_local_artifacts
+from aws.bedrock_utils import get_bedrock_metrics
+from image.understanding_cache import get_understanding_cache
+from utils.memory_utils import get_memory_budget
+from utils.fair_executor import get_s3_executor, get_bedrock_executor
+from aws.lease_utils import new_lease_owner, acquire_file_lease, release_file_lease, get_lease_keeper
 from utils.logging_utils import configure_logging
 
 # 配置日志
@@ -15,6 +22,28 @@ logger = configure_logging()
 # 创建Flask应用
 app = Flask(__name__)
 
+def submit_job(job_type, params):
+    """
+    提交异步任务并生成API响应
+    
+    Args:
+        job_type: 任务类型
+        params: 任务参数
+        
+    Returns:
+        已接受时返回202及任务ID，排队任务已满时返回429
+    """
+    job_id = get_job_manager().submit(job_type, params)
+    if job_id is None:
+        logger.warning(f"任务队列已满，拒绝 {job_type} 任务")
+        response = jsonify({'status': 'rejected', 'error': 'Job queue is full'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    
+    response = jsonify({'status': 'queued', 'job_id': job_id})
+    response.headers['Location'] = f"/jobs/{job_id}"
+    return response, 202
+
 @app.route('/process_pdf', methods=['POST'])
 def process_pdf():
     """
@@ -29,7 +58,8 @@ def process_pdf():
         endpoint_url: S3端点URL
         
     返回:
-        处理结果的JSON响应
+        202及任务ID的JSON响应，通过 GET /jobs/<job_id> 查询处理状态；任务队列已满时返回429；
+        其他服务器正在处理同一文件时返回409
     """
     try:
         # 获取请求参数
@@ -46,13 +76,24 @@ def process_pdf():
             logger.error("缺少必要参数")
             return jsonify({'error': 'Missing required parameters'}), 400
         
-        # 处理PDF文件
-        result = process_pdf_file(bucket_name, key, out_put, ak, sk, endpoint_url)
+        # 获取文件的处理租约，排队期间由心跳线程续约，重复请求在入队前直接拒绝
+        lease_owner = new_lease_owner()
+        if not acquire_file_lease(key, lease_owner):
+            return jsonify({'status': 'rejected', 'error': 'File is already being processed'}), 409
         
-        if result:
-            return jsonify({'status': 'success'})
-        else:
-            return jsonify({'status': 'failed', 'error': 'PDF processing failed'}), 500
+        # 提交PDF处理任务
+        response, status = submit_job('pdf', {
+            'bucket_name': bucket_name,
+            'key': key,
+            'out_put': out_put,
+            'ak': ak,
+            'sk': sk,
+            'endpoint_url': endpoint_url,
+            'lease_owner': lease_owner
+        })
+        if status != 202:
+            release_file_lease(key, lease_owner)
+        return response, status
 
     except Exception as e:
         logger.error(f"处理PDF时发生错误: {str(e)}")
@@ -68,7 +109,7 @@ def process_markdown():
         key: Markdown文件的S3对象键
         
     返回:
-        处理结果的JSON响应
+        202及任务ID的JSON响应，通过 GET /jobs/<job_id> 查询处理状态；任务队列已满时返回429
     """
     try:
         # 获取请求参数
@@ -81,22 +122,128 @@ def process_markdown():
             logger.error("缺少必要参数")
             return jsonify({'error': 'Missing required parameters'}), 400
         
-        # 处理Markdown文件
-        result = process_markdown_file(bucket_name, key)
-        
-        if result:
-            return jsonify({'status': 'success'})
-        else:
-            return jsonify({'status': 'failed', 'error': 'Markdown processing failed'}), 500
+        # 提交Markdown处理任务
+        return submit_job('markdown', {'bucket_name': bucket_name, 'key': key})
 
     except Exception as e:
         logger.error(f"处理Markdown时发生错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    查询异步任务状态的API接口
+    
+    返回:
+        包含任务状态（queued/running/succeeded/failed/awaiting_credentials）、当前阶段、图片分析进度和各阶段耗时的JSON响应
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """
+    为服务重启后等待凭证的任务重新提供凭证的API接口
+    
+    请求参数:
+        ak: AWS访问密钥
+        sk: AWS秘密访问密钥
+        
+    返回:
+        202及任务ID的JSON响应；任务不存在时返回404，任务不在等待凭证状态时返回409，凭证不完整时返回400
+    """
+    try:
+        data = request.json or {}
+        job_manager = get_job_manager()
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if job['status'] != JOB_AWAITING_CREDENTIALS:
+            return jsonify({'error': 'Job is not awaiting credentials'}), 409
+        if not job_manager.resume(job_id, {name: data.get(name) for name in CREDENTIAL_PARAMS}):
+            return jsonify({'error': 'Missing required parameters'}), 400
+        
+        response = jsonify({'status': 'queued', 'job_id': job_id})
+        response.headers['Location'] = f"/jobs/{job_id}"
+        return response, 202
+    
+    except Exception as e:
+        logger.error(f"恢复任务时发生错误: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/debug_artifacts', methods=['POST'])
+def debug_artifacts():
+    """
+    按需生成PDF解析调试文件的API接口，根据保存的中间结果在后台渲染并上传S3
+    
+    请求参数:
+        bucket_name: S3桶名
+        key: PDF文件的S3对象键
+        out_put: 解析时使用的输出目录名
+        kinds: 调试文件类型列表（layout/span），可选
+        
+    返回:
+        202及渲染完成后调试文件的S3对象键列表；渲染队列已满时返回429
+    """
+    try:
+        # 获取请求参数
+        data = request.json
+        bucket_name = data.get('bucket_name')
+        key = data.get('key')
+        out_put = data.get('out_put')
+        
+        # 参数验证
+        if not all([bucket_name, key, out_put]):
+            logger.error("缺少必要参数")
+            return jsonify({'error': 'Missing required parameters'}), 400
+        
+        artifact_keys = get_artifact_renderer().submit(bucket_name, key, get_md_file_path(key, out_put), data.get('kinds'))
+        if artifact_keys is None:
+            response = jsonify({'status': 'rejected', 'error': 'Artifact queue is full'})
+            response.headers['Retry-After'] = '30'
+            return response, 429
+        
+        return jsonify({'status': 'queued', 'artifacts': [f"s3://{bucket_name}/{artifact_key}" for artifact_key in artifact_keys]}), 202
+
+    except Exception as e:
+        logger.error(f"提交调试文件渲染时发生错误: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    获取服务运行指标的API接口
+    
+    返回:
+        包含Bedrock并发上限、限流率、任务队列深度、共享线程池利用率、文件处理租约、解析进程利用率、内存预算占用、图片理解缓存命中率等指标的JSON响应
+    """
+    cache = get_understanding_cache()
+    parse_pool = get_parse_pool()
+    lease_keeper = get_lease_keeper()
+    return jsonify({
+        'bedrock': get_bedrock_metrics(),
+        'jobs': get_job_manager().metrics(),
+        'parse_pool': parse_pool.metrics() if parse_pool else None,
+        'debug_artifacts': get_artifact_renderer().metrics(),
+        'memory': get_memory_budget().stats(),
+        'leases': lease_keeper.metrics() if lease_keeper else None,
+        's3_executor': get_s3_executor().metrics(),
+        'bedrock_executor': get_bedrock_executor().metrics(),
+        'understanding_cache': cache.stats() if cache else None
+    })
+
 def run_app():
     """启动Flask应用"""
     # 从环境变量获取端口，默认为5000
     port = int(os.environ.get('PORT', 5000))
+    
+    # 删除旧版本在本地输出目录中累积的调试文件
+    cleanup_local_artifacts()
+    
+    # 预先启动解析进程并加载模型，避免首个请求等待模型初始化
+    get_parse_pool()
     app.run(host='0.0.0.0', port=port)
 
 if __name__ == '__main__':
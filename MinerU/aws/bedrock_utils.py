@@ -7,10 +7,15 @@ import logging
 import re
 import time
 import random
-import gc
+import threading
+import sqlite3
+from collections import deque, namedtuple
 from botocore.exceptions import ClientError
 from clients import get_bedrock_client
-from config import AWS_CONFIG, API_CONFIG, PROMPTS
+from s3_utils import parse_s3_url, get_object_size
+from image.processor import download_and_convert_image
+from utils.memory_utils import get_memory_budget
+from config import AWS_CONFIG, API_CONFIG, PROMPTS, BEDROCK_CONCURRENCY_CONFIG, BEDROCK_RATE_LIMIT_CONFIG, BATCH_CONFIG
 
 logger = logging.getLogger(__name__)
 
@@ -22,75 +27,790 @@ class RetryableAPIError(BedrockAPIError):
     """可重试的API错误"""
     pass
 
+class TruncatedResponseError(BedrockAPIError):
+    """响应因达到maxTokens上限被截断"""
+    
+    def __init__(self, partial_result):
+        super().__init__("响应因达到maxTokens上限被截断")
+        self.partial_result = partial_result
+
+class S3ImageSourceRejectedError(BedrockAPIError):
+    """Bedrock拒绝读取请求中以s3Location引用的图片（跨账号桶、桶策略未授权Bedrock或区域不一致等）"""
+    pass
+
+class AdaptiveConcurrencyLimiter:
+    """
+    基于AIMD（加性增、乘性减）的自适应并发限制器
+    
+    每个成功且延迟正常的请求使并发上限增加 INCREASE_STEP/limit（约每轮增加一个并发），
+    遇到限流时并发上限乘以 DECREASE_FACTOR；延迟超过阈值时保持上限不再增加。
+    """
+    
+    def __init__(self, initial_limit, min_limit, max_limit, increase_step=1.0,
+                 decrease_factor=0.5, latency_threshold=None, window_size=100):
+        """
+        初始化并发限制器
+        
+        Args:
+            initial_limit: 初始并发上限
+            min_limit: 并发上限的最小值
+            max_limit: 并发上限的最大值
+            increase_step: 每轮加性增长的步长
+            decrease_factor: 限流时的乘性衰减系数
+            latency_threshold: 延迟阈值（秒），超过时不再增加并发，None表示不按延迟调节
+            window_size: 统计限流率的滑动窗口大小
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._outcomes = deque(maxlen=window_size)
+        self._latencies = deque(maxlen=window_size)
+        self._total_requests = 0
+        self._total_throttles = 0
+        self._condition = threading.Condition()
+    
+    @property
+    def limit(self):
+        """当前并发上限（整数）"""
+        return max(int(self._limit), self.min_limit)
+    
+    def acquire(self):
+        """获取一个并发槽位，达到上限时阻塞等待"""
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+    
+    def release(self, throttled=False, latency=None):
+        """
+        释放并发槽位，并根据请求结果调整并发上限
+        
+        Args:
+            throttled: 请求是否被限流
+            latency: 请求耗时（秒）
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._total_requests += 1
+            self._outcomes.append(1 if throttled else 0)
+            
+            if throttled:
+                self._total_throttles += 1
+                now = time.monotonic()
+                # 同一轮内的并发请求同时被限流时只衰减一次
+                window = self._average_latency() or 1.0
+                if now - self._last_decrease >= window:
+                    self._limit = max(self._limit * self.decrease_factor, float(self.min_limit))
+                    self._last_decrease = now
+                    logger.info(f"Bedrock限流，并发上限降至 {self.limit}")
+            else:
+                if latency is not None:
+                    self._latencies.append(latency)
+                if self.latency_threshold is None or latency is None or latency <= self.latency_threshold:
+                    self._limit = min(self._limit + self.increase_step / max(self._limit, 1.0), float(self.max_limit))
+            
+            self._condition.notify_all()
+    
+    def _average_latency(self):
+        """最近请求的平均延迟（秒），调用方需持有锁"""
+        if not self._latencies:
+            return None
+        return sum(self._latencies) / len(self._latencies)
+    
+    def metrics(self):
+        """
+        获取限制器指标
+        
+        Returns:
+            包含当前并发上限、在途请求数、限流率和平均延迟的字典
+        """
+        with self._condition:
+            throttle_rate = sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'throttle_rate': throttle_rate,
+                'avg_latency': self._average_latency(),
+                'total_requests': self._total_requests,
+                'total_throttles': self._total_throttles
+            }
+
+def _refill_bucket(tokens, updated_at, capacity, rate, now):
+    """按经过的时间补充令牌桶，返回补充后的令牌数"""
+    return min(capacity, tokens + rate * max(now - updated_at, 0.0))
+
+class _MemoryBucketStore:
+    """进程内令牌桶状态存储"""
+    
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def try_consume(self, requests, now):
+        """
+        尝试同时从多个令牌桶中扣除令牌
+        
+        Args:
+            requests: 字典 {桶名: (容量, 每秒补充速率, 扣除数量)}
+            now: 当前时间戳
+            
+        Returns:
+            扣除成功返回0，否则返回需要等待的秒数
+        """
+        with self._lock:
+            levels = {}
+            for name, (capacity, rate, _) in requests.items():
+                tokens, updated_at = self._buckets.get(name, (capacity, now))
+                levels[name] = _refill_bucket(tokens, updated_at, capacity, rate, now)
+            
+            wait_time = max(
+                (amount - levels[name]) / rate
+                for name, (_, rate, amount) in requests.items()
+            )
+            if wait_time > 0:
+                return wait_time
+            
+            for name, (_, _, amount) in requests.items():
+                self._buckets[name] = (levels[name] - amount, now)
+            return 0
+    
+    def adjust(self, name, capacity, rate, delta, now):
+        """
+        调整令牌桶中的令牌数（正数归还，负数追加扣除）
+        
+        Args:
+            name: 桶名
+            capacity: 桶容量
+            rate: 每秒补充速率
+            delta: 调整数量
+            now: 当前时间戳
+        """
+        with self._lock:
+            tokens, updated_at = self._buckets.get(name, (capacity, now))
+            tokens = _refill_bucket(tokens, updated_at, capacity, rate, now)
+            self._buckets[name] = (min(max(tokens + delta, -capacity), capacity), now)
+
+class _SQLiteBucketStore:
+    """基于本地SQLite文件的令牌桶状态存储，供同一主机上的多个Gunicorn worker共享配额"""
+    
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+    
+    def _load(self, conn, name, capacity, rate, now):
+        row = conn.execute(
+            "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return capacity
+        return _refill_bucket(row[0], row[1], capacity, rate, now)
+    
+    def _store(self, conn, name, tokens, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+            (name, tokens, now)
+        )
+    
+    def try_consume(self, requests, now):
+        """参见 _MemoryBucketStore.try_consume，通过IMMEDIATE事务保证跨进程原子性"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = {
+                name: self._load(conn, name, capacity, rate, now)
+                for name, (capacity, rate, _) in requests.items()
+            }
+            wait_time = max(
+                (amount - levels[name]) / rate
+                for name, (_, rate, amount) in requests.items()
+            )
+            if wait_time <= 0:
+                for name, (_, _, amount) in requests.items():
+                    self._store(conn, name, levels[name] - amount, now)
+            conn.execute("COMMIT")
+            return max(wait_time, 0)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def adjust(self, name, capacity, rate, delta, now):
+        """参见 _MemoryBucketStore.adjust"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens = self._load(conn, name, capacity, rate, now)
+            self._store(conn, name, min(max(tokens + delta, -capacity), capacity), now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+class TokenBucketRateLimiter:
+    """
+    Bedrock请求速率限制器，同时维护每分钟请求数（RPM）和每分钟令牌数（TPM）两个令牌桶
+    
+    调用前按估算令牌数扣除，调用后根据响应中的实际用量多退少补；
+    配额为0的桶不做限制。
+    """
+    
+    def __init__(self, requests_per_minute, tokens_per_minute, burst_seconds=10, state_path=None):
+        """
+        初始化速率限制器
+        
+        Args:
+            requests_per_minute: 每分钟请求数配额，0表示不限制
+            tokens_per_minute: 每分钟令牌数配额，0表示不限制
+            burst_seconds: 桶容量对应的秒数，决定允许的突发量
+            state_path: SQLite状态文件路径，为None时仅在进程内共享
+        """
+        self.buckets = {}
+        if requests_per_minute > 0:
+            rate = requests_per_minute / 60.0
+            self.buckets['requests'] = (max(rate * burst_seconds, 1.0), rate)
+        if tokens_per_minute > 0:
+            rate = tokens_per_minute / 60.0
+            self.buckets['tokens'] = (max(rate * burst_seconds, 1.0), rate)
+        self._store = _SQLiteBucketStore(state_path) if state_path else _MemoryBucketStore()
+        self._waited_seconds = 0.0
+        self._stats_lock = threading.Lock()
+    
+    @property
+    def enabled(self):
+        """是否配置了任何配额"""
+        return bool(self.buckets)
+    
+    def acquire(self, estimated_tokens):
+        """
+        阻塞等待直到请求数和令牌数配额均可用
+        
+        Args:
+            estimated_tokens: 本次请求的估算令牌数
+        """
+        if not self.enabled:
+            return
+        
+        amounts = {'requests': 1, 'tokens': estimated_tokens}
+        requests = {
+            name: (capacity, rate, min(amounts[name], capacity))
+            for name, (capacity, rate) in self.buckets.items()
+        }
+        while True:
+            wait_time = self._store.try_consume(requests, time.time())
+            if wait_time <= 0:
+                return
+            # 加入随机抖动，避免多个等待者同时醒来
+            sleep_time = wait_time + random.uniform(0, 0.1 * wait_time)
+            with self._stats_lock:
+                self._waited_seconds += sleep_time
+            time.sleep(sleep_time)
+    
+    def settle(self, estimated_tokens, actual_tokens):
+        """
+        根据实际令牌用量修正令牌桶
+        
+        Args:
+            estimated_tokens: 调用前扣除的估算令牌数
+            actual_tokens: 响应中返回的实际令牌数
+        """
+        if 'tokens' not in self.buckets or actual_tokens is None:
+            return
+        capacity, rate = self.buckets['tokens']
+        delta = min(estimated_tokens, capacity) - actual_tokens
+        if delta:
+            self._store.adjust('tokens', capacity, rate, delta, time.time())
+    
+    def metrics(self):
+        """获取限流等待的累计时间"""
+        with self._stats_lock:
+            return {'enabled': self.enabled, 'waited_seconds': self._waited_seconds}
+
+def estimate_input_tokens(text_chars, image_count):
+    """
+    估算输入令牌数
+    
+    Args:
+        text_chars: 文本字符数
+        image_count: 图片数量
+        
+    Returns:
+        估算的输入令牌数
+    """
+    input_tokens = text_chars / BEDROCK_RATE_LIMIT_CONFIG['CHARS_PER_TOKEN']
+    input_tokens += image_count * BEDROCK_RATE_LIMIT_CONFIG['TOKENS_PER_IMAGE']
+    return int(input_tokens)
+
+def estimate_request_tokens(messages, system, inference_config):
+    """
+    估算一次Converse请求消耗的令牌数（输入文本 + 图片 + 最大输出）
+    
+    Args:
+        messages: 消息列表
+        system: 系统提示
+        inference_config: 推理配置
+        
+    Returns:
+        估算的令牌数
+    """
+    text_chars = sum(len(block.get('text', '')) for block in system)
+    image_count = 0
+    for message in messages:
+        for block in message['content']:
+            if 'text' in block:
+                text_chars += len(block['text'])
+            elif 'image' in block:
+                image_count += 1
+    
+    return estimate_input_tokens(text_chars, image_count) + inference_config.get('maxTokens', 0)
+
+# 进程内共享的Bedrock速率限制器，配置状态文件后可跨worker进程共享
+_bedrock_rate_limiter = TokenBucketRateLimiter(
+    requests_per_minute=BEDROCK_RATE_LIMIT_CONFIG['REQUESTS_PER_MINUTE'],
+    tokens_per_minute=BEDROCK_RATE_LIMIT_CONFIG['TOKENS_PER_MINUTE'],
+    burst_seconds=BEDROCK_RATE_LIMIT_CONFIG['BURST_SECONDS'],
+    state_path=BEDROCK_RATE_LIMIT_CONFIG['STATE_PATH']
+)
+
+# 进程内共享的Bedrock并发限制器
+_bedrock_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=BEDROCK_CONCURRENCY_CONFIG['INITIAL'],
+    min_limit=BEDROCK_CONCURRENCY_CONFIG['MIN'],
+    max_limit=BEDROCK_CONCURRENCY_CONFIG['MAX'],
+    increase_step=BEDROCK_CONCURRENCY_CONFIG['INCREASE_STEP'],
+    decrease_factor=BEDROCK_CONCURRENCY_CONFIG['DECREASE_FACTOR'],
+    latency_threshold=BEDROCK_CONCURRENCY_CONFIG['LATENCY_THRESHOLD']
+)
+
+def get_bedrock_metrics():
+    """
+    获取Bedrock调用的并发控制指标
+    
+    Returns:
+        指标字典
+    """
+    metrics = _bedrock_limiter.metrics()
+    metrics['rate_limit'] = _bedrock_rate_limiter.metrics()
+    return metrics
+
+def _is_throttling_error(error_code, error_message):
+    """判断错误是否为限流信号"""
+    throttling_markers = ['throttl', 'toomanyrequests', 'too many requests', 'limit exceeded', 'limitexceeded']
+    text = f"{error_code} {error_message}".lower()
+    return any(marker in text for marker in throttling_markers)
+
+def _converse(messages, system, inference_config):
+    """
+    在速率限制和自适应并发限制下调用Bedrock Converse接口
+    
+    Args:
+        messages: 消息列表
+        system: 系统提示
+        inference_config: 推理配置
+        
+    Returns:
+        Converse接口响应
+    """
+    estimated_tokens = estimate_request_tokens(messages, system, inference_config)
+    _bedrock_rate_limiter.acquire(estimated_tokens)
+    
+    _bedrock_limiter.acquire()
+    start_time = time.monotonic()
+    throttled = False
+    try:
+        response = get_bedrock_client().converse(
+            modelId=AWS_CONFIG['BEDROCK_MODEL_ID'],
+            messages=messages,
+            system=system,
+            inferenceConfig=inference_config
+        )
+        _bedrock_rate_limiter.settle(estimated_tokens, response.get('usage', {}).get('totalTokens'))
+        return response
+    except ClientError as e:
+        throttled = _is_throttling_error(e.response.get('Error', {}).get('Code', ''), str(e))
+        raise
+    except Exception as e:
+        throttled = _is_throttling_error('', str(e))
+        raise
+    finally:
+        _bedrock_limiter.release(throttled, time.monotonic() - start_time)
+
+class S3ImageSource(namedtuple('S3ImageSource', ['uri', 'format'])):
+    """以S3位置引用的图片，Bedrock直接从S3读取，无需下载图片数据"""
+    __slots__ = ()
+
+# 支持在Converse请求中以s3Location引用图片的模型
+_S3_IMAGE_SOURCE_MODELS = ('amazon.nova',)
+
+# 请求包含s3Location图片时，表示Bedrock无法读取该位置的错误码
+_S3_IMAGE_SOURCE_REJECTION_CODES = ('ValidationException', 'AccessDeniedException')
+
+# Bedrock拒绝读取s3Location后置位，本进程后续请求改为发送图片数据
+_s3_image_source_disabled = threading.Event()
+
+# Converse接口支持的图片格式（文件扩展名 -> format字段）
+_IMAGE_FORMATS_BY_EXTENSION = {
+    'png': 'png',
+    'jpg': 'jpeg',
+    'jpeg': 'jpeg',
+    'gif': 'gif',
+    'webp': 'webp'
+}
+
+def supports_s3_image_source(model_id=None):
+    """
+    判断模型是否支持以S3位置引用图片
+    
+    Args:
+        model_id: 模型ID，默认为配置中的模型
+        
+    Returns:
+        bool: 是否支持；Bedrock在运行中拒绝过s3Location引用时返回False
+    """
+    if _s3_image_source_disabled.is_set():
+        return False
+    model_id = model_id or AWS_CONFIG['BEDROCK_MODEL_ID']
+    return any(marker in model_id for marker in _S3_IMAGE_SOURCE_MODELS)
+
+def get_s3_image_source(bucket, key, model_id=None):
+    """
+    为S3中的图片构建S3位置引用
+    
+    Args:
+        bucket: S3桶名
+        key: S3对象键
+        model_id: 模型ID，默认为配置中的模型
+        
+    Returns:
+        S3ImageSource；模型或图片格式不支持时返回None，调用方应回退到下载图片数据
+    """
+    if not supports_s3_image_source(model_id):
+        return None
+    extension = key.rsplit('.', 1)[-1].lower() if '.' in key else ''
+    image_format = _IMAGE_FORMATS_BY_EXTENSION.get(extension)
+    if image_format is None:
+        return None
+    return S3ImageSource(f"s3://{bucket}/{key}", image_format)
+
+def _build_image_block(image):
+    """
+    构建Converse请求中的图片内容块
+    
+    Args:
+        image: S3ImageSource、(图片数据, 图片格式)元组或PNG图片数据
+        
+    Returns:
+        图片内容块字典
+    """
+    if isinstance(image, S3ImageSource):
+        return {"image": {"format": image.format, "source": {"s3Location": {"uri": image.uri}}}}
+    if isinstance(image, tuple):
+        image_bytes, image_format = image
+    else:
+        image_bytes, image_format = image, "png"
+    return {"image": {"format": image_format, "source": {"bytes": image_bytes}}}
+
+def _has_s3_image_source(messages):
+    """判断请求消息中是否包含以s3Location引用的图片"""
+    return any(
+        'image' in block and 's3Location' in block['image']['source']
+        for message in messages
+        for block in message['content']
+    )
+
+def _download_s3_image_sources(sections, memory_lease):
+    """
+    将段落中以S3位置引用的图片下载并准备为(图片数据, 图片格式)，与直接下载图片的路径一样按需缩放和转换格式，
+    并在内存预算中预留图片数据；下载或转换失败的图片从请求中移除
+    
+    Args:
+        sections: 段落列表，每个元素为(上下文文本, [(图片标签, 图片)])
+        memory_lease: 内存预算的租约，持有下载图片数据的预留，由调用方在分析完成后归还
+        
+    Returns:
+        图片均为图片数据的段落列表
+    """
+    byte_sections = []
+    for context_text, labeled_images in sections:
+        byte_images = []
+        for label, image in labeled_images:
+            if isinstance(image, S3ImageSource):
+                bucket, key = parse_s3_url(image.uri)
+                # 按图片原始大小预留内存，准备完成后调整为待发送图片数据的大小
+                reserved_bytes = get_object_size(bucket, key)
+                memory_lease.reserve(reserved_bytes)
+                try:
+                    prepared = download_and_convert_image(bucket, key)
+                    if not prepared:
+                        logger.error(f"无法下载或转换图片 {image.uri}，跳过该图片")
+                        continue
+                    image_bytes, image_format, _ = prepared
+                    memory_lease.resize(reserved_bytes, len(image_bytes))
+                    reserved_bytes = 0
+                    image = (image_bytes, image_format)
+                finally:
+                    memory_lease.release(reserved_bytes)
+            byte_images.append((label, image))
+        if byte_images:
+            byte_sections.append((context_text, byte_images))
+    return byte_sections
+
+def build_image_analysis_request(sections):
+    """
+    构建图片分析的Converse请求
+    
+    Args:
+        sections: 段落列表，每个元素为(上下文文本, [(图片标签, 图片)])
+        
+    Returns:
+        (messages, system, 有效图片数量)
+    """
+    # 构建用户消息
+    if len(sections) == 1:
+        context_block = f"上下文内容：\n{sections[0][0]}"
+    else:
+        context_block = "上下文内容（每张图片的上下文为其所在段落）：\n" + "\n\n".join(
+            f"[段落{i}]\n{context_text}" for i, (context_text, _) in enumerate(sections, 1)
+        )
+    user_content = [{
+        "text": f"{context_block}\n\n{PROMPTS['IMAGE_UNDERSTANDING']}"
+    }]
+    
+    # 添加图片到用户消息
+    valid_images = 0
+    for _, labeled_images in sections:
+        for img_index, image in labeled_images:
+            try:
+                image_block = _build_image_block(image)
+            except Exception as img_e:
+                logger.error(f"添加图片 {img_index} 到请求时出错: {str(img_e)}")
+                continue
+            user_content.append({"text": img_index})
+            user_content.append(image_block)
+            valid_images += 1
+    
+    messages = [
+        {"role": "user", "content": user_content},
+        {"role": "assistant", "content": [{"text": "{"}]}
+    ]
+    system = [{"text": PROMPTS['IMAGE_SYSTEM']}]
+    
+    return messages, system, valid_images
+
 def analyze_image_with_bedrock(image_base64_list, context_text):
     """
     使用Bedrock Converse接口分析多张图片，支持自动重试
     
     Args:
-        image_base64_list: Base64编码的图片数据列表
+        image_base64_list: 图片列表，每个元素为S3ImageSource、(图片数据, 图片格式)元组或PNG图片数据，
+            第N个元素对应上下文中的[imageN]，为空的元素将被跳过
         context_text: 上下文文本
         
     Returns:
         图片分析结果，JSON格式；遇到错误或重试超过上限时返回空字符串
     """
+    labeled_images = [
+        (f'image{i}', image)
+        for i, image in enumerate(image_base64_list, 1)
+        if image
+    ]
+    return analyze_image_sections_with_bedrock([(context_text, labeled_images)])
+
+def analyze_image_sections_with_bedrock(sections):
+    """
+    在一次Converse调用中分析来自多个段落的图片，每张图片保留其所在段落的上下文
+    
+    Args:
+        sections: 段落列表，每个元素为(上下文文本, [(图片标签, 图片)])，
+            图片为S3ImageSource、(图片数据, 图片格式)元组或PNG图片数据，图片标签在整个调用内唯一且与上下文中的[标签]一致
+        
+    Returns:
+        以图片标签为键的分析结果，JSON格式；遇到错误或重试超过上限时返回空字符串
+    """
     try:
-        # 构建用户消息
-        user_content = [{
-            "text": f"上下文内容：\n{context_text}\n\n{PROMPTS['IMAGE_UNDERSTANDING']}"
-        }]
-        
-        # 添加图片到用户消息
-        valid_images = 0
-        for i, base64_image in enumerate(image_base64_list, 1):
-            if not base64_image:
-                continue
-                
-            img_index = f'image{i}'
-            user_content.append({"text": img_index})
-            
-            try:
-                user_content.append({
-                    "image": {
-                        "format": "png",
-                        "source": {"bytes": base64_image}
-                    }
-                })
-                valid_images += 1
-            except Exception as img_e:
-                logger.error(f"添加图片 {img_index} 到请求时出错: {str(img_e)}")
+        messages, system, valid_images = build_image_analysis_request(sections)
         
         # 如果没有有效的图片，返回空字符串
         if valid_images == 0:
             logger.warning("没有有效的图片可以处理")
             return ""
         
-        # 构建完整请求
-        messages = [
-            {"role": "user", "content": user_content},
-            {"role": "assistant", "content": [{"text": "{"}]}
-        ]
-        
-        system = [{"text": PROMPTS['IMAGE_SYSTEM']}]
-        
+        # 输出令牌预算随图片数量增加
         inference_config = {
-            "maxTokens": API_CONFIG['MAX_TOKENS'],
+            "maxTokens": get_output_token_budget(valid_images),
             "temperature": API_CONFIG['TEMPERATURE'],
             "topP": API_CONFIG['TOP_P']
         }
         
-        return _call_bedrock_with_retry(
-            messages=messages,
-            system=system,
-            inference_config=inference_config
-        )
+        truncated = None
+        rejected = None
+        try:
+            return _call_bedrock_with_retry(
+                messages=messages,
+                system=system,
+                inference_config=inference_config
+            )
+        except TruncatedResponseError as e:
+            truncated = e
+        except S3ImageSourceRejectedError as e:
+            rejected = e
+        finally:
+            # 释放本次请求的图片数据后再发起后续调用
+            del messages
+        
+        if truncated is not None:
+            return _recover_truncated_analysis(sections, truncated.partial_result)
+        
+        # 本进程后续请求不再使用s3Location，本批次下载图片数据后重新请求
+        if not _s3_image_source_disabled.is_set():
+            logger.warning(f"Bedrock无法读取s3Location引用的图片，改为发送图片数据: {str(rejected)}")
+            _s3_image_source_disabled.set()
+        memory_lease = get_memory_budget().lease()
+        try:
+            byte_sections = _download_s3_image_sources(sections, memory_lease)
+            if not byte_sections:
+                return ""
+            return analyze_image_sections_with_bedrock(byte_sections)
+        finally:
+            memory_lease.close()
         
     except Exception as e:
         logger.error(f"图片分析过程中发生未预期错误: {str(e)}")
         return ""
+
+def parse_partial_json_object(text):
+    """
+    从被截断的JSON对象文本中解析出已完整输出的键值对
+    
+    Args:
+        text: 以'{'开头、可能在任意位置被截断的JSON对象文本
         
-    finally:
-        # 显式调用垃圾回收
-        gc.collect()
+    Returns:
+        已完整解析的键值对字典
+    """
+    decoder = json.JSONDecoder()
+    result = {}
+    pos = text.find('{') + 1
+    if pos == 0:
+        return result
+    
+    length = len(text)
+    while pos < length:
+        # 跳过空白和分隔符
+        while pos < length and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= length or text[pos] == '}':
+            break
+        try:
+            key, pos = decoder.raw_decode(text, pos)
+            while pos < length and text[pos] in ' \t\r\n':
+                pos += 1
+            if pos >= length or text[pos] != ':':
+                break
+            pos += 1
+            while pos < length and text[pos] in ' \t\r\n':
+                pos += 1
+            value, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        # 值之后必须跟随分隔符或结束符，否则可能是被截断的数字等
+        rest = text[pos:].lstrip()
+        if not rest or rest[0] not in ',}':
+            break
+        result[key] = value
+    
+    return result
+
+def get_output_token_budget(image_count):
+    """
+    按图片数量计算输出令牌预算
+    
+    Args:
+        image_count: 本次调用的图片数量
+        
+    Returns:
+        maxTokens取值，介于MAX_TOKENS与MAX_OUTPUT_TOKENS之间
+    """
+    scaled = image_count * BATCH_CONFIG['OUTPUT_TOKENS_PER_IMAGE']
+    return min(API_CONFIG['MAX_OUTPUT_TOKENS'], max(API_CONFIG['MAX_TOKENS'], scaled))
+
+def _split_sections(sections):
+    """
+    将段落中的图片平均拆分为两组，保持每张图片与其段落上下文的对应关系
+    
+    Args:
+        sections: 段落列表，每个元素为(上下文文本, [(图片标签, 图片)])
+        
+    Returns:
+        (前半部分段落列表, 后半部分段落列表)
+    """
+    flat = [(context_text, labeled) for context_text, labeled_images in sections for labeled in labeled_images]
+    middle = len(flat) // 2
+    
+    def regroup(items):
+        grouped = []
+        for context_text, labeled in items:
+            if grouped and grouped[-1][0] is context_text:
+                grouped[-1][1].append(labeled)
+            else:
+                grouped.append((context_text, [labeled]))
+        return grouped
+    
+    return regroup(flat[:middle]), regroup(flat[middle:])
+
+def _recover_truncated_analysis(sections, partial_result):
+    """
+    处理被截断的分析结果：保留已完整的图片条目，只为缺失的图片发起更小的后续调用
+    
+    Args:
+        sections: 原始请求的段落列表
+        partial_result: 已从截断响应中解析出的条目
+        
+    Returns:
+        合并后的分析结果
+    """
+    result = dict(partial_result)
+    missing_sections = [
+        (context_text, [labeled for labeled in labeled_images if labeled[0] not in result])
+        for context_text, labeled_images in sections
+    ]
+    missing_sections = [section for section in missing_sections if section[1]]
+    missing_count = sum(len(labeled_images) for _, labeled_images in missing_sections)
+    total_count = sum(len(labeled_images) for _, labeled_images in sections)
+    
+    if missing_count == 0:
+        return result
+    
+    if missing_count < total_count:
+        # 已恢复部分图片，剩余图片数量更少，重新请求剩余部分
+        logger.info(f"响应被截断，已恢复 {total_count - missing_count} 张图片的结果，重新请求剩余 {missing_count} 张")
+        follow_up_results = [analyze_image_sections_with_bedrock(missing_sections)]
+    elif total_count > 1:
+        # 没有任何完整条目，拆分为两次更小的调用
+        logger.info(f"响应被截断且没有完整条目，拆分 {total_count} 张图片为两次调用")
+        follow_up_results = [analyze_image_sections_with_bedrock(half) for half in _split_sections(missing_sections)]
+    else:
+        logger.warning("单张图片的分析响应被截断，放弃该图片")
+        return result
+    
+    for follow_up in follow_up_results:
+        if isinstance(follow_up, dict):
+            result.update(follow_up)
+    return result
 
 def _call_bedrock_with_retry(messages, system, inference_config):
     """
@@ -103,6 +823,10 @@ def _call_bedrock_with_retry(messages, system, inference_config):
         
     Returns:
         API响应结果，遇到错误或重试超过上限时返回空字符串
+        
+    Raises:
+        TruncatedResponseError: 响应因达到maxTokens上限被截断，异常中携带已完整解析的条目
+        S3ImageSourceRejectedError: 请求包含s3Location图片且Bedrock拒绝读取，调用方应改为发送图片数据
     """
     # 可重试的错误类型
     retryable_errors = [
@@ -117,17 +841,16 @@ def _call_bedrock_with_retry(messages, system, inference_config):
     
     while retry_count <= API_CONFIG['MAX_RETRIES']:
         try:
-            # 调用Bedrock API
-            response = get_bedrock_client().converse(
-                modelId=AWS_CONFIG['BEDROCK_MODEL_ID'],
-                messages=messages,
-                system=system,
-                inferenceConfig=inference_config
-            )
+            # 在自适应并发限制下调用Bedrock API，退避等待期间不占用并发槽位
+            response = _converse(messages, system, inference_config)
             
             # 解析响应
             response_content = '{' + response['output']['message']['content'][0]['text']
             
+            # 响应被截断时，只保留已完整输出的条目
+            if response.get('stopReason') == 'max_tokens':
+                raise TruncatedResponseError(parse_partial_json_object(response_content))
+            
             # 尝试解析JSON响应
             try:
                 return json.loads(response_content)
@@ -139,6 +862,9 @@ def _call_bedrock_with_retry(messages, system, inference_config):
                 logger.warning("无法从响应中提取JSON格式")
                 return ""
         
+        except TruncatedResponseError:
+            raise
+        
         except ClientError as e:
             error_code = e.response.get('Error', {}).get('Code', '')
             error_message = str(e)
@@ -159,6 +885,9 @@ def _call_bedrock_with_retry(messages, system, inference_config):
                     retry_count += 1
                     continue
             
+            if error_code in _S3_IMAGE_SOURCE_REJECTION_CODES and _has_s3_image_source(messages):
+                raise S3ImageSourceRejectedError(error_message)
+            
             logger.error(f"Bedrock API调用失败: {error_message}")
             return ""
             
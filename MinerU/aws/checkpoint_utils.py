@@ -0,0 +1,228 @@
+"""
+图片分析检查点模块，持久化每张图片的分析结果，文档处理失败后重新运行时只分析尚未完成的图片
+"""
+
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+from boto3.dynamodb.conditions import Key
+from clients import get_dynamodb_resource
+from config import CHECKPOINT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def build_checkpoint_entry_id(image_url, context_text):
+    """
+    构建检查点条目ID，同一图片在相同上下文中的分析结果视为同一条目
+    
+    Args:
+        image_url: 图片URL
+        context_text: 图片所在段落的上下文
+    
+    Returns:
+        条目ID字符串
+    """
+    digest = hashlib.sha256(f"{image_url}\n{context_text}".encode('utf-8')).hexdigest()
+    return digest[:32]
+
+class DynamoDBCheckpointStore:
+    """基于DynamoDB的检查点存储，分区键为document_id，排序键为entry_id"""
+    
+    def __init__(self, table_name):
+        """
+        初始化检查点存储
+        
+        Args:
+            table_name: DynamoDB表名
+        """
+        self.table_name = table_name
+    
+    @property
+    def table(self):
+        return get_dynamodb_resource().Table(self.table_name)
+    
+    def load(self, document_id):
+        """
+        读取文档的所有检查点条目
+        
+        Args:
+            document_id: 文档ID
+        
+        Returns:
+            条目ID到分析结果的字典
+        """
+        entries = {}
+        query_args = {'KeyConditionExpression': Key('document_id').eq(document_id)}
+        while True:
+            response = self.table.query(**query_args)
+            for item in response.get('Items', []):
+                entries[item['entry_id']] = item.get('understanding', '')
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return entries
+    
+    def save(self, document_id, entries):
+        """
+        写入检查点条目
+        
+        Args:
+            document_id: 文档ID
+            entries: 条目ID到分析结果的字典
+        """
+        current_time = datetime.now().isoformat()
+        with self.table.batch_writer(overwrite_by_pkeys=['document_id', 'entry_id']) as batch:
+            for entry_id, understanding in entries.items():
+                batch.put_item(Item={
+                    'document_id': document_id,
+                    'entry_id': entry_id,
+                    'understanding': understanding,
+                    'updated_at': current_time
+                })
+    
+    def clear(self, document_id):
+        """
+        删除文档的所有检查点条目
+        
+        Args:
+            document_id: 文档ID
+        """
+        entry_ids = list(self.load(document_id))
+        with self.table.batch_writer() as batch:
+            for entry_id in entry_ids:
+                batch.delete_item(Key={'document_id': document_id, 'entry_id': entry_id})
+
+class SQLiteCheckpointStore:
+    """基于本地SQLite文件的检查点存储，接口与DynamoDBCheckpointStore一致，用于本地运行和测试"""
+    
+    def __init__(self, path):
+        """
+        初始化检查点存储
+        
+        Args:
+            path: SQLite文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS image_checkpoints ("
+                "document_id TEXT NOT NULL, entry_id TEXT NOT NULL, understanding TEXT NOT NULL, "
+                "updated_at TEXT NOT NULL, PRIMARY KEY (document_id, entry_id))"
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def load(self, document_id):
+        """参见 DynamoDBCheckpointStore.load"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT entry_id, understanding FROM image_checkpoints WHERE document_id = ?",
+                (document_id,)
+            ).fetchall()
+        return {entry_id: json.loads(understanding) for entry_id, understanding in rows}
+    
+    def save(self, document_id, entries):
+        """参见 DynamoDBCheckpointStore.save"""
+        current_time = datetime.now().isoformat()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO image_checkpoints (document_id, entry_id, understanding, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (document_id, entry_id, json.dumps(understanding, ensure_ascii=False), current_time)
+                    for entry_id, understanding in entries.items()
+                ]
+            )
+    
+    def clear(self, document_id):
+        """参见 DynamoDBCheckpointStore.clear"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM image_checkpoints WHERE document_id = ?", (document_id,))
+
+@lru_cache(maxsize=1)
+def get_checkpoint_store():
+    """
+    按配置获取检查点存储
+    
+    Returns:
+        检查点存储实例；未启用检查点时返回None
+    """
+    backend = CHECKPOINT_CONFIG['BACKEND']
+    if backend == 'dynamodb':
+        return DynamoDBCheckpointStore(CHECKPOINT_CONFIG['TABLE_NAME'])
+    if backend == 'sqlite':
+        return SQLiteCheckpointStore(CHECKPOINT_CONFIG['SQLITE_PATH'])
+    return None
+
+def load_checkpoint(document_id):
+    """
+    读取文档的检查点，失败时返回空字典
+    
+    Args:
+        document_id: 文档ID
+    
+    Returns:
+        条目ID到分析结果的字典
+    """
+    store = get_checkpoint_store()
+    if store is None:
+        return {}
+    try:
+        entries = store.load(document_id)
+        if entries:
+            logger.info(f"已读取文档 {document_id} 的 {len(entries)} 条图片分析检查点")
+        return entries
+    except Exception as e:
+        logger.error(f"读取图片分析检查点失败: {str(e)}")
+        return {}
+
+def save_checkpoint(document_id, entries):
+    """
+    写入文档的检查点条目
+    
+    Args:
+        document_id: 文档ID
+        entries: 条目ID到分析结果的字典
+    
+    Returns:
+        bool: 操作是否成功
+    """
+    store = get_checkpoint_store()
+    if store is None or not entries:
+        return True
+    try:
+        store.save(document_id, entries)
+        return True
+    except Exception as e:
+        logger.error(f"写入图片分析检查点失败: {str(e)}")
+        return False
+
+def clear_checkpoint(document_id):
+    """
+    文档处理成功后删除其检查点
+    
+    Args:
+        document_id: 文档ID
+    
+    Returns:
+        bool: 操作是否成功
+    """
+    store = get_checkpoint_store()
+    if store is None:
+        return True
+    try:
+        store.clear(document_id)
+        return True
+    except Exception as e:
+        logger.error(f"删除图片分析检查点失败: {str(e)}")
+        return False
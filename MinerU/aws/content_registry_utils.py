@@ -0,0 +1,165 @@
+"""
+内容哈希登记模块，记录每份已处理成功的文档内容对应的输出位置，相同内容在其他键下再次上传时直接复用已有输出
+"""
+
+import os
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+from clients import get_dynamodb_resource
+from config import CONTENT_REGISTRY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class DynamoDBContentRegistry:
+    """基于DynamoDB的内容哈希登记表，分区键为content_hash"""
+    
+    def __init__(self, table_name):
+        """
+        初始化登记表
+        
+        Args:
+            table_name: DynamoDB表名
+        """
+        self.table_name = table_name
+    
+    @property
+    def table(self):
+        return get_dynamodb_resource().Table(self.table_name)
+    
+    def get(self, content_hash):
+        """
+        查询内容哈希的登记记录
+        
+        Args:
+            content_hash: 内容哈希
+        
+        Returns:
+            包含bucket、source_key、md_file_path的字典；未登记时返回None
+        """
+        item = self.table.get_item(Key={'content_hash': content_hash}).get('Item')
+        if item is None:
+            return None
+        return {name: item[name] for name in ('bucket', 'source_key', 'md_file_path')}
+    
+    def put(self, content_hash, bucket, source_key, md_file_path):
+        """
+        登记内容哈希的输出位置，已有登记时以最近一次处理的输出为准
+        
+        Args:
+            content_hash: 内容哈希
+            bucket: S3桶名
+            source_key: 源文件的S3对象键
+            md_file_path: Markdown文件的S3对象键
+        """
+        self.table.put_item(Item={
+            'content_hash': content_hash,
+            'bucket': bucket,
+            'source_key': source_key,
+            'md_file_path': md_file_path,
+            'updated_at': datetime.now().isoformat()
+        })
+
+class SQLiteContentRegistry:
+    """基于本地SQLite文件的内容哈希登记表，接口与DynamoDBContentRegistry一致，用于本地运行和测试"""
+    
+    def __init__(self, path):
+        """
+        初始化登记表
+        
+        Args:
+            path: SQLite文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS content_registry ("
+                "content_hash TEXT PRIMARY KEY, bucket TEXT NOT NULL, source_key TEXT NOT NULL, "
+                "md_file_path TEXT NOT NULL, updated_at TEXT NOT NULL)"
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def get(self, content_hash):
+        """参见 DynamoDBContentRegistry.get"""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT bucket, source_key, md_file_path FROM content_registry WHERE content_hash = ?",
+                (content_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('bucket', 'source_key', 'md_file_path'), row))
+    
+    def put(self, content_hash, bucket, source_key, md_file_path):
+        """参见 DynamoDBContentRegistry.put"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO content_registry (content_hash, bucket, source_key, md_file_path, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (content_hash, bucket, source_key, md_file_path, datetime.now().isoformat())
+            )
+
+@lru_cache(maxsize=1)
+def get_content_registry():
+    """
+    按配置获取内容哈希登记表
+    
+    Returns:
+        登记表实例；未启用时返回None
+    """
+    backend = CONTENT_REGISTRY_CONFIG['BACKEND']
+    if backend == 'dynamodb':
+        return DynamoDBContentRegistry(CONTENT_REGISTRY_CONFIG['TABLE_NAME'])
+    if backend == 'sqlite':
+        return SQLiteContentRegistry(CONTENT_REGISTRY_CONFIG['SQLITE_PATH'])
+    return None
+
+def lookup_processed_content(content_hash):
+    """
+    查询相同内容的文档是否已处理成功
+    
+    Args:
+        content_hash: 内容哈希
+        
+    Returns:
+        登记记录；未启用、未登记或查询失败时返回None
+    """
+    registry = get_content_registry()
+    if registry is None or not content_hash:
+        return None
+    try:
+        return registry.get(content_hash)
+    except Exception as e:
+        logger.error(f"查询内容哈希登记失败: {str(e)}")
+        return None
+
+def register_processed_content(content_hash, bucket, source_key, md_file_path):
+    """
+    文档处理成功后登记其内容哈希和输出位置
+    
+    Args:
+        content_hash: 内容哈希
+        bucket: S3桶名
+        source_key: 源文件的S3对象键
+        md_file_path: Markdown文件的S3对象键
+        
+    Returns:
+        bool: 操作是否成功
+    """
+    registry = get_content_registry()
+    if registry is None or not content_hash:
+        return True
+    try:
+        registry.put(content_hash, bucket, source_key, md_file_path)
+        return True
+    except Exception as e:
+        logger.error(f"写入内容哈希登记失败: {str(e)}")
+        return False
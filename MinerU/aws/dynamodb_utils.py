@@ -42,3 +42,104 @@ def update_processing_status(file_name, status):
     except Exception as e:
         logger.error(f"更新 DynamoDB 记录失败: {str(e)}")
         return False
+
+def update_processing_progress(file_name, images_done, images_total):
+    """
+    更新DynamoDB中文件处理记录的图片分析进度
+    
+    Args:
+        file_name: 文件名，作为唯一键
+        images_done: 已完成分析的图片数量
+        images_total: 需要分析的图片总数
+    
+    Returns:
+        bool: 操作是否成功
+    """
+    try:
+        table = get_dynamodb_resource().Table(DYNAMODB_CONFIG['TABLE_NAME'])
+        current_time = datetime.now().isoformat()
+        
+        table.update_item(
+            Key={
+                'file_name': file_name
+            },
+            UpdateExpression='SET updated_at = :updated_at, images_done = :images_done, images_total = :images_total',
+            ExpressionAttributeValues={
+                ':updated_at': current_time,
+                ':images_done': images_done,
+                ':images_total': images_total
+            }
+        )
+        return True
+    except Exception as e:
+        logger.error(f"更新 DynamoDB 记录进度失败: {str(e)}")
+        return False
+
+def update_parse_stats(file_name, parse_stats):
+    """
+    在DynamoDB处理记录中写入PDF解析统计
+    
+    Args:
+        file_name: 文件名，作为唯一键
+        parse_stats: 解析统计，包含总页数、OCR页数、文本模式页数和片段数
+    
+    Returns:
+        bool: 操作是否成功
+    """
+    try:
+        table = get_dynamodb_resource().Table(DYNAMODB_CONFIG['TABLE_NAME'])
+        current_time = datetime.now().isoformat()
+        
+        table.update_item(
+            Key={
+                'file_name': file_name
+            },
+            UpdateExpression='SET updated_at = :updated_at, page_count = :pages, ocr_pages = :ocr_pages, txt_pages = :txt_pages',
+            ExpressionAttributeValues={
+                ':updated_at': current_time,
+                ':pages': parse_stats['pages'],
+                ':ocr_pages': parse_stats['ocr_pages'],
+                ':txt_pages': parse_stats['txt_pages']
+            }
+        )
+        return True
+    except Exception as e:
+        logger.error(f"更新 DynamoDB 记录解析统计失败: {str(e)}")
+        return False
+
+def update_content_hash(file_name, content_hash, dedup_source=None):
+    """
+    在DynamoDB处理记录中写入文件内容哈希，复用已有输出时同时记录其来源文件
+    
+    Args:
+        file_name: 文件名，作为唯一键
+        content_hash: 文件内容哈希
+        dedup_source: 复用其输出的已处理文件名，重新处理时为None
+    
+    Returns:
+        bool: 操作是否成功
+    """
+    try:
+        table = get_dynamodb_resource().Table(DYNAMODB_CONFIG['TABLE_NAME'])
+        current_time = datetime.now().isoformat()
+        
+        update_expression = 'SET updated_at = :updated_at, content_hash = :content_hash'
+        expression_values = {
+            ':updated_at': current_time,
+            ':content_hash': content_hash
+        }
+        if dedup_source:
+            update_expression += ', dedup_source = :dedup_source'
+            expression_values[':dedup_source'] = dedup_source
+        
+        table.update_item(
+            Key={
+                'file_name': file_name
+            },
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_values
+        )
+        return True
+    except Exception as e:
+        logger.error(f"更新 DynamoDB 记录内容哈希失败: {str(e)}")
+        return False
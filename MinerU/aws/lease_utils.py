@@ -0,0 +1,470 @@
+"""
+文件处理租约模块，在处理记录表上以条件写入获取按文件名的租约，防止多个服务器同时处理同一文件
+"""
+
+import os
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from clients import get_dynamodb_resource
+from config import LEASE_CONFIG, DYNAMODB_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 回收过期租约时写入的处理状态，Lambda重新触发时会重新提交该文件
+LEASE_EXPIRED_STATUS = '处理中断'
+
+def new_lease_owner():
+    """
+    生成租约持有者标识，包含主机名以便排查
+    
+    Returns:
+        持有者标识字符串
+    """
+    return f"{socket.gethostname()}:{uuid.uuid4().hex}"
+
+class DynamoDBLeaseStore:
+    """
+    基于DynamoDB处理记录表的租约存储，租约字段（lease_owner、lease_expires_at、lease_heartbeat_at）写在
+    以file_name为分区键的处理记录上，所有操作均为条件写入
+    """
+    
+    def __init__(self, table_name, dynamodb_resource=None):
+        """
+        初始化租约存储
+        
+        Args:
+            table_name: DynamoDB表名
+            dynamodb_resource: DynamoDB资源，默认使用全局客户端；测试时可传入指向DynamoDB Local的资源
+        """
+        self.table_name = table_name
+        self.dynamodb_resource = dynamodb_resource
+    
+    @property
+    def table(self):
+        return (self.dynamodb_resource or get_dynamodb_resource()).Table(self.table_name)
+    
+    def _conditional_update(self, **kwargs):
+        """执行条件更新，条件不满足时返回False"""
+        try:
+            self.table.update_item(**kwargs)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+    
+    def acquire(self, file_name, owner, ttl_seconds):
+        """
+        获取租约：记录没有租约、租约已过期或已由同一持有者持有时成功
+        
+        Args:
+            file_name: 文件名
+            owner: 持有者标识
+            ttl_seconds: 租约有效期（秒）
+        
+        Returns:
+            是否获取成功
+        """
+        now = int(time.time())
+        return self._conditional_update(
+            Key={'file_name': file_name},
+            UpdateExpression='SET lease_owner = :owner, lease_expires_at = :expires_at, '
+                             'lease_heartbeat_at = :heartbeat_at, updated_at = :heartbeat_at',
+            ConditionExpression=(
+                Attr('lease_owner').not_exists() | Attr('lease_expires_at').lt(now) | Attr('lease_owner').eq(owner)
+            ),
+            ExpressionAttributeValues={
+                ':owner': owner,
+                ':expires_at': now + ttl_seconds,
+                ':heartbeat_at': datetime.now().isoformat()
+            }
+        )
+    
+    def renew(self, file_name, owner, ttl_seconds):
+        """
+        续约：只有当前持有者可以续约
+        
+        Args:
+            file_name: 文件名
+            owner: 持有者标识
+            ttl_seconds: 租约有效期（秒）
+        
+        Returns:
+            是否续约成功；失败表示租约已被其他持有者获取或已被回收
+        """
+        return self._conditional_update(
+            Key={'file_name': file_name},
+            UpdateExpression='SET lease_expires_at = :expires_at, lease_heartbeat_at = :heartbeat_at',
+            ConditionExpression=Attr('lease_owner').eq(owner),
+            ExpressionAttributeValues={
+                ':expires_at': int(time.time()) + ttl_seconds,
+                ':heartbeat_at': datetime.now().isoformat()
+            }
+        )
+    
+    def release(self, file_name, owner):
+        """
+        释放租约：只有当前持有者可以释放
+        
+        Args:
+            file_name: 文件名
+            owner: 持有者标识
+        
+        Returns:
+            是否释放成功
+        """
+        return self._conditional_update(
+            Key={'file_name': file_name},
+            UpdateExpression='REMOVE lease_owner, lease_expires_at, lease_heartbeat_at',
+            ConditionExpression=Attr('lease_owner').eq(owner)
+        )
+    
+    def sweep(self):
+        """
+        回收已过期的租约，删除租约字段并将处理状态设为处理中断
+        
+        Returns:
+            被回收租约的文件名列表
+        """
+        now = int(time.time())
+        scan_args = {
+            'FilterExpression': Attr('lease_expires_at').lt(now),
+            'ProjectionExpression': 'file_name, lease_owner'
+        }
+        reclaimed = []
+        while True:
+            response = self.table.scan(**scan_args)
+            for item in response.get('Items', []):
+                # 扫描之后持有者可能已续约或其他服务器已获取，按扫描到的持有者和过期时间条件删除
+                if self._conditional_update(
+                    Key={'file_name': item['file_name']},
+                    UpdateExpression='REMOVE lease_owner, lease_expires_at, lease_heartbeat_at '
+                                     'SET #status = :status, updated_at = :updated_at',
+                    ConditionExpression=Attr('lease_owner').eq(item.get('lease_owner')) & Attr('lease_expires_at').lt(now),
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues={
+                        ':status': LEASE_EXPIRED_STATUS,
+                        ':updated_at': datetime.now().isoformat()
+                    }
+                ):
+                    reclaimed.append(item['file_name'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return reclaimed
+    
+    def get(self, file_name):
+        """
+        读取文件的处理记录，包含处理状态和租约字段
+        
+        Args:
+            file_name: 文件名
+        
+        Returns:
+            记录字典；记录不存在时返回None
+        """
+        return self.table.get_item(Key={'file_name': file_name}, ConsistentRead=True).get('Item')
+
+class SQLiteLeaseStore:
+    """
+    基于本地SQLite文件的租约存储，接口与DynamoDBLeaseStore一致，用于本地运行和测试（多个进程可共享同一文件）
+    
+    与DynamoDB处理记录表一样，租约字段和处理状态写在同一条以file_name为主键的记录上
+    """
+    
+    def __init__(self, path):
+        """
+        初始化租约存储
+        
+        Args:
+            path: SQLite文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS processing_records ("
+                "file_name TEXT PRIMARY KEY, status TEXT, lease_owner TEXT, lease_expires_at INTEGER, "
+                "lease_heartbeat_at TEXT, updated_at TEXT)"
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def acquire(self, file_name, owner, ttl_seconds):
+        """参见 DynamoDBLeaseStore.acquire"""
+        now = int(time.time())
+        heartbeat_at = datetime.now().isoformat()
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO processing_records (file_name, lease_owner, lease_expires_at, lease_heartbeat_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(file_name) DO UPDATE SET "
+                "lease_owner = excluded.lease_owner, lease_expires_at = excluded.lease_expires_at, "
+                "lease_heartbeat_at = excluded.lease_heartbeat_at, updated_at = excluded.updated_at "
+                "WHERE processing_records.lease_owner IS NULL OR processing_records.lease_expires_at < ? "
+                "OR processing_records.lease_owner = excluded.lease_owner",
+                (file_name, owner, now + ttl_seconds, heartbeat_at, heartbeat_at, now)
+            )
+            return cursor.rowcount > 0
+    
+    def renew(self, file_name, owner, ttl_seconds):
+        """参见 DynamoDBLeaseStore.renew"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE processing_records SET lease_expires_at = ?, lease_heartbeat_at = ? "
+                "WHERE file_name = ? AND lease_owner = ?",
+                (int(time.time()) + ttl_seconds, datetime.now().isoformat(), file_name, owner)
+            )
+            return cursor.rowcount > 0
+    
+    def release(self, file_name, owner):
+        """参见 DynamoDBLeaseStore.release"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE processing_records SET lease_owner = NULL, lease_expires_at = NULL, lease_heartbeat_at = NULL "
+                "WHERE file_name = ? AND lease_owner = ?",
+                (file_name, owner)
+            )
+            return cursor.rowcount > 0
+    
+    def sweep(self):
+        """参见 DynamoDBLeaseStore.sweep"""
+        now = int(time.time())
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT file_name FROM processing_records WHERE lease_expires_at < ?", (now,)
+            ).fetchall()
+            conn.execute(
+                "UPDATE processing_records SET lease_owner = NULL, lease_expires_at = NULL, lease_heartbeat_at = NULL, "
+                "status = ?, updated_at = ? WHERE lease_expires_at < ?",
+                (LEASE_EXPIRED_STATUS, datetime.now().isoformat(), now)
+            )
+        return [file_name for file_name, in rows]
+    
+    def get(self, file_name):
+        """参见 DynamoDBLeaseStore.get"""
+        with self._lock, self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM processing_records WHERE file_name = ?", (file_name,)).fetchone()
+        if row is None:
+            return None
+        return {key: row[key] for key in row.keys() if row[key] is not None}
+
+class LeaseKeeper:
+    """
+    租约维护器：记录本进程持有的租约，由后台心跳线程定期续约，
+    并按间隔回收其他服务器异常退出后遗留的过期租约
+    """
+    
+    def __init__(self, store, ttl_seconds, heartbeat_seconds, sweep_interval_seconds):
+        """
+        初始化租约维护器并启动心跳线程
+        
+        Args:
+            store: 租约存储
+            ttl_seconds: 租约有效期（秒）
+            heartbeat_seconds: 续约间隔（秒），应明显小于有效期
+            sweep_interval_seconds: 回收过期租约的间隔（秒），0表示不回收
+        """
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._held = {}  # 文件名 -> 持有者标识
+        self._lost = set()  # 续约失败的(文件名, 持有者标识)
+        self._last_sweep = 0.0
+        self._acquired = 0
+        self._rejected = 0
+        self._reclaimed = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+    
+    def acquire(self, file_name, owner):
+        """
+        获取租约，成功后由心跳线程续约直到释放
+        
+        Args:
+            file_name: 文件名
+            owner: 持有者标识，同一持有者重复获取时视为续约（如服务重启后恢复的任务）
+        
+        Returns:
+            是否获取成功；其他服务器正在处理该文件时返回False
+        """
+        acquired = self.store.acquire(file_name, owner, self.ttl_seconds)
+        with self._lock:
+            if acquired:
+                self._acquired += 1
+                self._held[file_name] = owner
+                self._lost.discard((file_name, owner))
+            else:
+                self._rejected += 1
+        if not acquired:
+            logger.warning(f"文件 {file_name} 正在由其他服务器处理，未获取到租约")
+        return acquired
+    
+    def release(self, file_name, owner):
+        """
+        释放租约并停止续约
+        
+        Args:
+            file_name: 文件名
+            owner: 持有者标识
+        """
+        with self._lock:
+            if self._held.get(file_name) == owner:
+                del self._held[file_name]
+            self._lost.discard((file_name, owner))
+        try:
+            self.store.release(file_name, owner)
+        except Exception as e:
+            # 未能释放的租约在过期后由回收线程回收
+            logger.error(f"释放文件 {file_name} 的租约失败: {str(e)}")
+    
+    def is_lost(self, file_name, owner):
+        """
+        检查租约是否因续约失败而丢失
+        
+        Args:
+            file_name: 文件名
+            owner: 持有者标识
+        
+        Returns:
+            租约是否已丢失
+        """
+        with self._lock:
+            return (file_name, owner) in self._lost
+    
+    def metrics(self):
+        """
+        获取租约指标
+        
+        Returns:
+            包含持有租约数、获取成功数、拒绝数、丢失数和回收数的字典
+        """
+        with self._lock:
+            return {
+                'held': len(self._held),
+                'acquired': self._acquired,
+                'rejected': self._rejected,
+                'lost': len(self._lost),
+                'reclaimed': self._reclaimed
+            }
+    
+    def _renew_all(self):
+        """续约所有持有的租约，续约失败的租约标记为丢失"""
+        with self._lock:
+            held = list(self._held.items())
+        for file_name, owner in held:
+            try:
+                renewed = self.store.renew(file_name, owner, self.ttl_seconds)
+            except Exception as e:
+                # 暂时性错误在下一次心跳时重试，租约在有效期内仍然有效
+                logger.error(f"文件 {file_name} 的租约续约失败: {str(e)}")
+                continue
+            if not renewed:
+                logger.error(f"文件 {file_name} 的租约已被其他服务器获取或已被回收")
+                with self._lock:
+                    if self._held.get(file_name) == owner:
+                        del self._held[file_name]
+                        self._lost.add((file_name, owner))
+    
+    def _sweep(self):
+        """按间隔回收过期租约"""
+        if not self.sweep_interval_seconds or time.time() - self._last_sweep < self.sweep_interval_seconds:
+            return
+        self._last_sweep = time.time()
+        try:
+            reclaimed = self.store.sweep()
+        except Exception as e:
+            logger.error(f"回收过期租约失败: {str(e)}")
+            return
+        if reclaimed:
+            logger.warning(f"已回收 {len(reclaimed)} 个过期租约: {reclaimed}")
+            with self._lock:
+                self._reclaimed += len(reclaimed)
+    
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            self._renew_all()
+            self._sweep()
+
+@lru_cache(maxsize=1)
+def get_lease_keeper():
+    """
+    按配置获取进程内共享的租约维护器
+    
+    Returns:
+        LeaseKeeper实例；未启用租约时返回None
+    """
+    backend = LEASE_CONFIG['BACKEND']
+    if backend == 'dynamodb':
+        store = DynamoDBLeaseStore(DYNAMODB_CONFIG['TABLE_NAME'])
+    elif backend == 'sqlite':
+        store = SQLiteLeaseStore(LEASE_CONFIG['SQLITE_PATH'])
+    else:
+        return None
+    return LeaseKeeper(
+        store,
+        ttl_seconds=LEASE_CONFIG['TTL_SECONDS'],
+        heartbeat_seconds=LEASE_CONFIG['HEARTBEAT_SECONDS'],
+        sweep_interval_seconds=LEASE_CONFIG['SWEEP_INTERVAL_SECONDS']
+    )
+
+def acquire_file_lease(file_name, owner):
+    """
+    获取文件的处理租约，存储出错时放行以免阻塞处理
+    
+    Args:
+        file_name: 文件名
+        owner: 持有者标识
+        
+    Returns:
+        是否可以处理该文件；未启用租约时返回True
+    """
+    keeper = get_lease_keeper()
+    if keeper is None:
+        return True
+    try:
+        return keeper.acquire(file_name, owner)
+    except Exception as e:
+        logger.error(f"获取文件 {file_name} 的租约失败: {str(e)}")
+        return True
+
+def release_file_lease(file_name, owner):
+    """
+    释放文件的处理租约
+    
+    Args:
+        file_name: 文件名
+        owner: 持有者标识
+    """
+    keeper = get_lease_keeper()
+    if keeper is not None:
+        keeper.release(file_name, owner)
+
+def file_lease_lost(file_name, owner):
+    """
+    检查文件的处理租约是否已丢失（续约失败，可能已由其他服务器接手）
+    
+    Args:
+        file_name: 文件名
+        owner: 持有者标识
+        
+    Returns:
+        租约是否已丢失；未启用租约时返回False
+    """
+    keeper = get_lease_keeper()
+    return keeper is not None and keeper.is_lost(file_name, owner)
@@ -2,7 +2,9 @@
 S3操作相关工具函数
 """
 
+import hashlib
 import logging
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
 from clients import get_s3_client
 from config import AWS_CONFIG
@@ -63,6 +65,64 @@ def get_object_size(bucket, key):
         logger.error(f"获取对象大小失败: {str(e)}")
         return 0
 
+def get_content_hash(bucket, key, chunk_size=8 * 1024 * 1024):
+    """
+    获取S3对象内容的哈希，相同内容的对象在不同的键下得到相同的哈希
+    
+    单段上传且未使用KMS或客户提供密钥加密的对象，ETag即为内容的MD5，只需一次HEAD请求；
+    分段上传等ETag不是内容MD5的对象，流式读取并计算SHA-256
+    
+    Args:
+        bucket: S3桶名
+        key: S3对象键
+        chunk_size: 流式读取的块大小（字节）
+        
+    Returns:
+        带算法前缀的哈希字符串（md5:...或sha256:...）；获取失败时返回None
+    """
+    try:
+        s3_client = get_s3_client()
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+        etag = response.get('ETag', '').strip('"')
+        encrypted = response.get('ServerSideEncryption', '').startswith('aws:kms') or 'SSECustomerAlgorithm' in response
+        if etag and '-' not in etag and not encrypted:
+            return f"md5:{etag}"
+        
+        digest = hashlib.sha256()
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        try:
+            for chunk in iter(lambda: body.read(chunk_size), b''):
+                digest.update(chunk)
+        finally:
+            body.close()
+        return f"sha256:{digest.hexdigest()}"
+    except Exception as e:
+        logger.error(f"计算对象内容哈希失败: {str(e)}")
+        return None
+
+def list_object_sizes(bucket, prefix):
+    """
+    分页列出指定前缀下所有对象的大小
+    
+    Args:
+        bucket: S3桶名
+        prefix: 对象键前缀
+        
+    Returns:
+        对象键到大小（字节）的字典；列举失败时返回None
+    """
+    try:
+        s3_client = get_s3_client()
+        paginator = s3_client.get_paginator('list_objects_v2')
+        sizes = {}
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                sizes[obj['Key']] = obj['Size']
+        return sizes
+    except Exception as e:
+        logger.error(f"列举对象失败: {str(e)}")
+        return None
+
 def download_s3_object(bucket, key):
     """
     从S3下载对象
@@ -87,6 +147,30 @@ def download_s3_object(bucket, key):
         logger.error(f"下载S3对象失败: {str(e)}")
         return None
 
+def download_s3_range(bucket, key, start, end):
+    """
+    下载S3对象的指定字节范围
+    
+    Args:
+        bucket: S3桶名
+        key: S3对象键
+        start: 起始字节偏移
+        end: 结束字节偏移（包含）
+        
+    Returns:
+        范围内的内容（字节）；下载失败时返回None
+    """
+    try:
+        s3_client = get_s3_client()
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+        try:
+            return response['Body'].read()
+        finally:
+            response['Body'].close()
+    except Exception as e:
+        logger.error(f"下载S3对象范围失败: {str(e)}")
+        return None
+
 def upload_s3_object(content, bucket, key, content_type=None):
     """
     上传对象到S3
@@ -122,3 +206,54 @@ def upload_s3_object(content, bucket, key, content_type=None):
     except Exception as e:
         logger.error(f"上传对象失败: {str(e)}")
         return False
+
+def copy_s3_object(bucket, source_key, dest_key):
+    """
+    在同一桶内服务端复制对象，数据不经过本机（大对象自动使用分段复制）
+    
+    Args:
+        bucket: S3桶名
+        source_key: 源对象键
+        dest_key: 目标对象键
+        
+    Returns:
+        是否复制成功
+    """
+    try:
+        s3_client = get_s3_client()
+        s3_client.copy({'Bucket': bucket, 'Key': source_key}, bucket, dest_key)
+        logger.info(f"已复制对象 s3://{bucket}/{source_key} 到 {dest_key}")
+        return True
+    except Exception as e:
+        logger.error(f"复制对象失败: {str(e)}")
+        return False
+
+def delete_expired_objects(bucket, prefix, max_age_seconds):
+    """
+    删除指定前缀下最后修改时间早于保留期限的对象
+    
+    Args:
+        bucket: S3桶名
+        prefix: 对象键前缀
+        max_age_seconds: 保留期限（秒）
+        
+    Returns:
+        删除的对象数；失败时返回0
+    """
+    try:
+        s3_client = get_s3_client()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        paginator = s3_client.get_paginator('list_objects_v2')
+        deleted = 0
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            expired = [{'Key': obj['Key']} for obj in page.get('Contents', []) if obj['LastModified'] < cutoff]
+            # 每次最多删除1000个对象，与单页列举数量一致
+            if expired:
+                s3_client.delete_objects(Bucket=bucket, Delete={'Objects': expired, 'Quiet': True})
+                deleted += len(expired)
+        if deleted:
+            logger.info(f"已删除 s3://{bucket}/{prefix} 下 {deleted} 个过期对象")
+        return deleted
+    except Exception as e:
+        logger.error(f"删除过期对象失败: {str(e)}")
+        return 0
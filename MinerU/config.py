@@ -15,15 +15,125 @@ AWS_CONFIG = {
 IMAGE_CONFIG = {
     "MIN_SIZE_BYTES": 5120,  # 最小图片尺寸，小于此尺寸的图片引用将被删除（5KB）
     "MIN_UNDERSTANDING_SIZE_BYTES": 10240,  # 最小图片理解尺寸，小于此尺寸的图片不进行理解（10KB）
-    "MAX_BATCH_SIZE": 5  # 每批处理的图片数量
+    "MAX_BATCH_SIZE": 8,  # 每次Bedrock调用的最大图片数量
+    "MAX_DIMENSION": 1568,  # 发送给Bedrock的图片最长边上限（像素），超过时等比缩小
+    "JPEG_QUALITY": 85,  # 缩放后重新编码为JPEG时的质量
+    "ANALYSIS_SOURCE": "bytes"  # 图片来源: "bytes"下载图片数据发送; "s3"以S3位置引用图片（需Nova模型且Bedrock可读取该桶），不支持时自动回退下载
 }
 
-# 线程池配置
+# 近似重复图片去重配置
+DEDUP_CONFIG = {
+    "ENABLED": True,  # 是否启用感知哈希去重
+    "HASH_SIZE": 8,  # dHash边长，生成64位哈希
+    "MAX_DISTANCE": 5,  # 判定为近似重复的最大汉明距离
+    "REPEATED_RATIO": 0.5,  # 出现在超过该比例段落中的图片视为重复元素（logo、页眉等）
+    "REPEATED_MIN_COUNT": 3,  # 视为重复元素的最少出现段落数
+    "DROP_REPEATED_REFERENCES": False,  # 是否从Markdown中删除重复元素的图片引用，否则仅不添加理解内容
+    "GLOBAL_INDEX_SIZE": 4096  # 跨文档复用理解结果的感知哈希索引大小（只在近似重复图片的上下文相同时复用，空结果不记录）
+}
+
+# 图片理解缓存配置
+CACHE_CONFIG = {
+    "ENABLED": True,  # 是否启用图片理解结果缓存
+    "MEMORY_ENTRIES": 2048,  # 内存LRU缓存的最大条目数
+    "DB_PATH": "output/understanding_cache.db",  # 本地SQLite缓存文件路径，None表示仅使用内存缓存
+    "MAX_DB_BYTES": 256 * 1024 * 1024  # SQLite缓存的总大小上限（256MB），超过时淘汰最久未访问的条目
+}
+
+# 图片分析检查点配置，文档处理失败后重新运行时跳过已完成分析的图片
+CHECKPOINT_CONFIG = {
+    "BACKEND": "dynamodb",  # 检查点存储："dynamodb"、"sqlite"（本地运行和测试）或None（不启用）
+    "TABLE_NAME": "pdf_image_checkpoints",  # DynamoDB表名，分区键document_id，排序键entry_id（均为字符串）
+    "SQLITE_PATH": "output/image_checkpoints.db"  # 本地SQLite检查点文件路径
+}
+
+# 内容列表上下文配置，PDF解析得到的内容列表中每张图片以前后最近的文本块作为分析上下文
+CONTENT_LIST_CONFIG = {
+    "ENABLED": True,  # 是否按内容列表构建图片上下文，否则使用图片所在的整个章节
+    "MAX_CONTEXT_TOKENS": 500  # 每张图片上下文文本的估算令牌上限（不含图片）
+}
+
+# 图片分析批次配置，相邻段落的图片合并到同一次Bedrock调用中
+BATCH_CONFIG = {
+    "MAX_INPUT_TOKENS": 24000,  # 单次调用的估算输入令牌上限（上下文文本 + 图片）
+    "OUTPUT_TOKENS_PER_IMAGE": 250,  # 每张图片预留的输出令牌数，与MAX_OUTPUT_TOKENS共同限制单次调用的图片数量
+    "LINGER_SECONDS": 0.5  # 批次未装满时等待后续段落的最长时间（秒）
+}
+
+# 线程池配置，S3和Bedrock线程池由进程内所有文档共享，按文档轮转调度
 THREAD_POOL_CONFIG = {
-    "EXTRACT": 5,  # 提取图片信息的线程池大小
-    "DOWNLOAD": 5,  # 下载图片的线程池大小
-    "ANALYZE": 2,   # 分析图片的线程池大小，确定所支持的速率
-    "PROCESS": 5    # 处理图片引用的线程池大小
+    "S3_WORKERS": 16,  # 共享S3 I/O线程池大小（处理图片引用、提取图片信息、下载图片）
+    "BEDROCK_WORKERS": 16,  # 共享Bedrock调用线程池大小，实际Bedrock并发由自适应限制器控制
+    "S3_PER_DOCUMENT": 5,  # 单个文档在S3线程池中的在途任务上限，0表示不限制
+    "BEDROCK_PER_DOCUMENT": 8,  # 单个文档在Bedrock线程池中的在途批次上限，0表示不限制
+    "PIPELINE_QUEUE_SIZE": 4  # 已下载待分析的段落队列长度，队列满时暂停下载
+}
+
+# 异步任务配置，API请求提交任务后立即返回，任务在后台依次经过各处理阶段
+JOB_CONFIG = {
+    "QUEUE_SIZE": 32,  # 尚未开始处理的排队任务上限，队列满时API返回429
+    "LANES": {"fast": 100, "slow": None},  # 车道名 -> 估算成本上限（按顺序匹配，None表示不限），成本未知的任务进入最后一个车道
+    "COST_PER_PAGE": 1.0,  # 每页的估算成本
+    "COST_PER_MB": 2.0,  # 每MB文件大小的估算成本（扫描页面和图片较多的文档文件较大）
+    "PROBE_BYTES": 65536,  # 估算PDF页数时读取的文件头尾字节数
+    "AGING_SECONDS": 600,  # 车道内按成本排序的任务等待超过该时间后按提交顺序执行，0表示不老化
+    "STAGES": {  # 各阶段独立的执行器，不同文档的阶段重叠执行；WORKERS为各车道的线程数，QUEUE_SIZE为每个车道上一阶段移交的等待任务上限，达到上限时上一阶段阻塞
+        "parse": {"WORKERS": {"fast": 1, "slow": 1}, "QUEUE_SIZE": 0},  # PDF解析（CPU密集，实际解析在解析进程池中执行，线程总数与PARSE_POOL_CONFIG的WORKERS一致）
+        "enhance": {"WORKERS": {"fast": 3, "slow": 1}, "QUEUE_SIZE": 4},  # 图片增强（S3下载和Bedrock延迟密集），持有解析结果的内存数据
+        "upload": {"WORKERS": {"fast": 1, "slow": 1}, "QUEUE_SIZE": 8}  # 上传结果和更新处理记录（S3/DynamoDB延迟密集）
+    },
+    "MAX_FINISHED_JOBS": 1000,  # 保留的已结束任务记录数，超过时淘汰最早结束的任务
+    "STATE_PATH": None  # 任务持久化SQLite文件路径，服务重启后恢复未完成的任务；访问密钥不写入文件，需通过 POST /jobs/<job_id>/resume 重新提供，None表示仅保存在内存中
+}
+
+# PDF解析进程池配置，解析阶段在常驻工作进程中执行，每个进程启动时加载一次模型
+PARSE_POOL_CONFIG = {
+    "ENABLED": True,  # 是否启用解析进程池，否则在任务线程中直接解析
+    "WORKERS": 2,  # 工作进程数，受CPU核数和模型显存/内存占用限制
+    "MAX_JOBS_PER_WORKER": 50,  # 每个进程执行该数量的任务后重启，0表示不限制
+    "MAX_MEMORY_MB": 8192,  # 进程常驻内存超过该值（MB）时在任务结束后重启，0表示不限制
+    "START_METHOD": "spawn",  # 进程启动方式，spawn避免继承Flask进程中的线程和锁状态
+    "SHARD_PAGE_THRESHOLD": 200,  # 页数超过该值的PDF按页范围拆分后并行解析
+    "SHARD_PAGES": 50  # 每个分片的页数
+}
+
+# 解析调试文件配置（布局和span标注PDF），由保存的中间结果渲染，不在解析过程中同步生成
+DEBUG_ARTIFACT_CONFIG = {
+    "MODE": "off",  # "off"只在通过API请求时生成；"async"每个PDF解析完成后在后台低优先级线程中生成
+    "KINDS": ["layout", "span"],  # 默认生成的调试文件类型
+    "S3_PREFIX": "DebugArtifacts/",  # 调试文件的S3前缀，其下的目录结构与S3_OUTPUT_PREFIX一致
+    "WORKERS": 1,  # 渲染线程数
+    "QUEUE_SIZE": 16,  # 等待渲染的请求上限，队列满时丢弃新的请求
+    "NICE": 10,  # 渲染线程的nice增量，降低与解析和增强争用CPU时的优先级
+    "RETENTION_DAYS": 7,  # S3上调试文件的保留天数，0表示不清理
+    "CLEANUP_INTERVAL_SECONDS": 3600  # 清理过期调试文件的最小间隔（秒）
+}
+
+# PDF逐页分类配置，只对没有可提取文本层的页面使用OCR模式
+PAGE_CLASSIFY_CONFIG = {
+    "ENABLED": True,  # 是否逐页分类，否则由MinerU对整个文档分类
+    "MIN_TEXT_CHARS": 50,  # 页面可提取的非空白字符少于该值时使用OCR
+    "MAX_INVALID_CHAR_RATIO": 0.1  # 文本层中无法映射的字符占比超过该值时使用OCR
+}
+
+# Bedrock 自适应并发配置（AIMD）
+BEDROCK_CONCURRENCY_CONFIG = {
+    "INITIAL": 2,  # 初始并发上限
+    "MIN": 1,  # 并发上限最小值
+    "MAX": 16,  # 并发上限最大值
+    "INCREASE_STEP": 1.0,  # 每轮无限流时增加的并发数
+    "DECREASE_FACTOR": 0.5,  # 遇到限流时并发上限的衰减系数
+    "LATENCY_THRESHOLD": 60  # 请求延迟阈值（秒），超过时不再增加并发
+}
+
+# Bedrock 速率限制配置（进程内所有文档共享）
+BEDROCK_RATE_LIMIT_CONFIG = {
+    "REQUESTS_PER_MINUTE": 0,  # 每分钟请求数配额，0表示不限制
+    "TOKENS_PER_MINUTE": 0,  # 每分钟令牌数配额，0表示不限制
+    "BURST_SECONDS": 10,  # 令牌桶容量对应的秒数，决定允许的突发量
+    "CHARS_PER_TOKEN": 2,  # 估算令牌数时每个令牌对应的字符数
+    "TOKENS_PER_IMAGE": 1600,  # 估算令牌数时每张图片对应的令牌数
+    "STATE_PATH": None  # SQLite状态文件路径，设置后同一主机的多个worker进程共享配额
 }
 
 # API 调用配置
@@ -31,7 +141,8 @@ API_CONFIG = {
     "MAX_RETRIES": 10,  # API调用最大重试次数
     "INITIAL_BACKOFF": 1,  # 初始退避时间（秒）
     "MAX_BACKOFF": 60,  # 最大退避时间（秒）
-    "MAX_TOKENS": 2000,  # 生成令牌的最大数量
+    "MAX_TOKENS": 2000,  # 生成令牌数的基础值，图片较多时按OUTPUT_TOKENS_PER_IMAGE增加
+    "MAX_OUTPUT_TOKENS": 5000,  # 单次调用生成令牌数的上限（Nova Pro最大为5000）
     "TEMPERATURE": 0.1,  # 生成的随机性（0.0表示确定性输出）
     "TOP_P": 0.1  # 核采样参数
 }
@@ -69,6 +180,13 @@ Example:
     "IMAGE_SYSTEM": "You are a technical documentation analysis expert specializing in multimodal content processing. Your task is to systematically analyze images within knowledge base documents, extract semantically meaningful information that enhances searchability in vector databases, while filtering out non-essential decorative elements. Focus on preserving technical specifications, data patterns, critical diagrams, and domain-specific information relevant to potential search queries."
 }
 
+# 内存预算配置，下载和待分析的图片数据按字节预留，多个文档并发处理时共享同一预算
+MEMORY_CONFIG = {
+    "BUDGET_MB": 2048,  # 进程内图片数据的内存预算（MB），预算用尽时下载线程等待，0表示不限制
+    "WAIT_TIMEOUT_SECONDS": 60,  # 预算不足时的最长等待时间（秒），超时后超额放行，避免同一段落的图片相互等待
+    "CHECKPOINT_GC": True  # 是否在文档和分片处理结束的检查点执行完整垃圾回收
+}
+
 # 日志配置
 LOGGING_CONFIG = {
     "LEVEL": "INFO",
@@ -81,9 +199,27 @@ DYNAMODB_CONFIG = {
     "TABLE_NAME": "pdf_processing_records"
 }
 
+# 内容哈希登记配置，相同内容的PDF上传到不同路径时复制已有输出，不再重复解析和增强
+CONTENT_REGISTRY_CONFIG = {
+    "BACKEND": "dynamodb",  # 登记表存储："dynamodb"、"sqlite"（本地运行和测试）或None（不启用）
+    "TABLE_NAME": "pdf_content_registry",  # DynamoDB表名，分区键content_hash（字符串）
+    "SQLITE_PATH": "output/content_registry.db",  # 本地SQLite登记文件路径
+    "HASH_CHUNK_BYTES": 8 * 1024 * 1024  # ETag不是内容MD5的对象（如分段上传）流式计算SHA-256时的读取块大小
+}
+
+# 文件处理租约配置，S3事件重试或重复上传时防止多个服务器同时处理同一文件
+LEASE_CONFIG = {
+    "BACKEND": "dynamodb",  # 租约存储："dynamodb"（写在处理记录表的记录上）、"sqlite"（本地运行和测试）或None（不启用）
+    "SQLITE_PATH": "output/file_leases.db",  # 本地SQLite租约文件路径（processing_records表保存租约字段和处理状态）
+    "TTL_SECONDS": 300,  # 租约有效期（秒），持有者异常退出后最多经过该时间可由其他服务器接手
+    "HEARTBEAT_SECONDS": 60,  # 续约间隔（秒），应明显小于有效期
+    "SWEEP_INTERVAL_SECONDS": 600  # 回收过期租约（扫描处理记录表）的间隔（秒），0表示不回收
+}
+
 # 文件处理配置
 FILE_PROCESSING = {
     "LOCAL_OUTPUT_DIR": "output/",
     "LOCAL_IMAGE_DIR": "output/images/",
-    "S3_OUTPUT_PREFIX": "ProcessingFile/"
+    "S3_OUTPUT_PREFIX": "ProcessingFile/",
+    "HANDOFF_MAX_IMAGE_BYTES": 128 * 1024 * 1024  # 解析阶段为增强阶段保留在内存中的图片数据上限（128MB），超过部分增强时从S3下载
 }
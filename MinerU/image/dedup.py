@@ -0,0 +1,174 @@
+"""
+图片感知哈希去重模块，识别文档内及跨文档的近似重复图片（如每页重复的logo、页眉横幅）
+"""
+
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image
+from config import DEDUP_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def compute_dhash(image_bytes, hash_size=8):
+    """
+    计算图片的差值哈希（dHash）
+    
+    Args:
+        image_bytes: 图片数据
+        hash_size: 哈希边长，生成 hash_size*hash_size 位的哈希
+    
+    Returns:
+        整数形式的哈希值；无法解析图片时返回None
+    """
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            # 先用draft快速解码缩略图，再缩放到(hash_size+1) x hash_size的灰度图
+            img.draft('L', (hash_size * 8, hash_size * 8))
+            pixels = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).tobytes()
+    except Exception as e:
+        logger.warning(f"计算图片感知哈希失败: {str(e)}")
+        return None
+    
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(hash_a, hash_b):
+    """计算两个哈希值的汉明距离"""
+    return bin(hash_a ^ hash_b).count('1')
+
+class DocumentImageClusters:
+    """单个文档内的近似重复图片聚类，每个聚类的第一张图片作为代表图片送去分析"""
+    
+    def __init__(self, max_distance):
+        """
+        初始化聚类
+        
+        Args:
+            max_distance: 判定为近似重复的最大汉明距离
+        """
+        self.max_distance = max_distance
+        self._representatives = []  # [(哈希, 代表图片URL)]
+        self._members = {}  # 代表图片URL -> [(图片URL, 段落索引)]
+        self._lock = threading.Lock()
+    
+    def assign(self, image_hash, url, paragraph_idx):
+        """
+        将图片归入聚类
+        
+        Args:
+            image_hash: 图片的感知哈希
+            url: 图片URL
+            paragraph_idx: 图片所在段落索引
+        
+        Returns:
+            若图片与已有聚类近似重复，返回该聚类代表图片的URL；否则图片成为新聚类的代表，返回None
+        """
+        with self._lock:
+            for representative_hash, representative_url in self._representatives:
+                if hamming_distance(image_hash, representative_hash) <= self.max_distance:
+                    self._members[representative_url].append((url, paragraph_idx))
+                    return representative_url
+            
+            self._representatives.append((image_hash, url))
+            self._members[url] = [(url, paragraph_idx)]
+            return None
+    
+    def representative_hashes(self):
+        """获取所有(代表图片哈希, 代表图片URL)"""
+        with self._lock:
+            return list(self._representatives)
+    
+    def repeated_clusters(self, total_paragraphs, ratio, min_count):
+        """
+        找出在大多数段落中重复出现的聚类
+        
+        Args:
+            total_paragraphs: 包含图片的段落总数
+            ratio: 判定为重复图片的段落占比阈值
+            min_count: 判定为重复图片的最少出现段落数
+        
+        Returns:
+            {代表图片URL: 聚类内所有图片URL集合}
+        """
+        with self._lock:
+            result = {}
+            for representative_url, members in self._members.items():
+                paragraph_count = len({paragraph_idx for _, paragraph_idx in members})
+                if paragraph_count >= min_count and paragraph_count >= ratio * total_paragraphs:
+                    result[representative_url] = {url for url, _ in members}
+            return result
+
+def _context_digest(context_text):
+    """计算上下文文本的SHA-256摘要"""
+    return hashlib.sha256(context_text.encode('utf-8')).hexdigest()
+
+class PerceptualHashIndex:
+    """
+    进程内共享的感知哈希索引，保存已分析图片的理解结果，供后续文档复用
+    
+    理解结果是结合图片所在段落的上下文生成的，只在近似重复图片的上下文相同时复用
+    """
+    
+    def __init__(self, max_entries, max_distance):
+        """
+        初始化索引
+        
+        Args:
+            max_entries: 最大条目数，超过时淘汰最久未使用的条目
+            max_distance: 判定为近似重复的最大汉明距离
+        """
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # (哈希, 上下文摘要) -> 理解内容
+        self._lock = threading.Lock()
+    
+    def lookup(self, image_hash, context_text):
+        """
+        查找上下文相同的近似重复图片的理解内容
+        
+        Args:
+            image_hash: 图片的感知哈希
+            context_text: 发送给模型的上下文文本（图片引用已替换为[imageN]标签）
+        
+        Returns:
+            理解内容；未找到时返回None
+        """
+        context_digest = _context_digest(context_text)
+        with self._lock:
+            for entry_key, understanding in self._entries.items():
+                known_hash, known_digest = entry_key
+                if known_digest == context_digest and hamming_distance(image_hash, known_hash) <= self.max_distance:
+                    self._entries.move_to_end(entry_key)
+                    return understanding
+            return None
+    
+    def add(self, image_hash, context_text, understanding):
+        """
+        记录图片的理解内容，空结果（分析失败或没有有效信息）不记录
+        
+        Args:
+            image_hash: 图片的感知哈希
+            context_text: 生成理解内容时的上下文文本
+            understanding: 理解内容
+        """
+        if not understanding:
+            return
+        entry_key = (image_hash, _context_digest(context_text))
+        with self._lock:
+            self._entries[entry_key] = understanding
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@lru_cache(maxsize=1)
+def get_perceptual_hash_index():
+    """获取进程内共享的感知哈希索引"""
+    return PerceptualHashIndex(DEDUP_CONFIG['GLOBAL_INDEX_SIZE'], DEDUP_CONFIG['MAX_DISTANCE'])
@@ -4,80 +4,254 @@
 
 import logging
 import io
-import gc
 from io import BytesIO
 from PIL import Image
 import base64
-from aws.s3_utils import download_s3_object, get_object_size
+from aws.s3_utils import download_s3_object, get_object_size, list_object_sizes
 from config import IMAGE_CONFIG
 
 logger = logging.getLogger(__name__)
 
-def download_and_convert_image(bucket, key):
+# Bedrock Converse接口支持直接发送的图片格式（PIL格式名 -> Converse format字段）
+_PASSTHROUGH_FORMATS = {
+    'JPEG': 'jpeg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'GIF': 'gif'
+}
+
+def prepare_image(image_bytes):
+    """
+    准备发送给Bedrock的图片：最长边超过上限时等比缩小并重新编码，
+    否则对Bedrock支持的格式直接透传原始字节，不做转码
+    
+    Args:
+        image_bytes: 原始图片数据
+        
+    Returns:
+        (图片数据, Converse format字段)元组；无法解析时返回None
+    """
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            source_format = img.format
+            max_dimension = IMAGE_CONFIG['MAX_DIMENSION']
+            needs_resize = max(img.size) > max_dimension
+            
+            if not needs_resize and source_format in _PASSTHROUGH_FORMATS:
+                return image_bytes, _PASSTHROUGH_FORMATS[source_format]
+            
+            if needs_resize:
+                img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+            with io.BytesIO() as buffer:
+                if source_format == 'JPEG' or (needs_resize and not has_alpha):
+                    # 无透明通道的图片缩放后编码为JPEG，体积远小于PNG
+                    if img.mode not in ('RGB', 'L'):
+                        img = img.convert('RGB')
+                    img.save(buffer, format='JPEG', quality=IMAGE_CONFIG['JPEG_QUALITY'], optimize=True)
+                    return buffer.getvalue(), 'jpeg'
+                
+                img.save(buffer, format='PNG', optimize=needs_resize)
+                return buffer.getvalue(), 'png'
+    except Exception as e:
+        logger.error(f"图片格式转换失败: {str(e)}")
+        return None
+
+def download_and_convert_image(bucket, key, image_store=None):
     """
-    从S3下载图片，转换为PNG格式，并返回Base64编码的图片数据
+    从S3下载图片，并按需缩放和转换为Bedrock支持的格式
     
     Args:
         bucket: S3桶名
         key: S3对象键
+        image_store: 可选的InMemoryImageStore，保存有图片数据时不再下载
         
     Returns:
-        Base64编码的PNG格式图片数据
+        (图片数据, Converse format字段, 原始图片字节数)元组；失败时返回None
     """
     try:
-        # 下载原始图片数据
-        image_bytes = download_s3_object(bucket, key)
+        # 优先使用内存中的图片数据，否则从S3下载
+        image_bytes = image_store.get_bytes(bucket, key) if image_store is not None else None
+        if image_bytes is None:
+            image_bytes = download_s3_object(bucket, key)
         if not image_bytes:
             return None
         
-        try:
-            # 使用with语句确保资源正确关闭
-            with Image.open(BytesIO(image_bytes)) as img:
-                with io.BytesIO() as buffer:
-                    img.save(buffer, format='PNG')
-                    png_bytes = buffer.getvalue()
-                    
-            # 显式删除大型变量以帮助垃圾回收
-            del image_bytes
-            
-            # 返回Base64编码的图片数据
-            return png_bytes
-            
-        except Exception as e:
-            logger.error(f"图片格式转换失败: {str(e)}")
+        original_size = len(image_bytes)
+        prepared = prepare_image(image_bytes)
+        
+        # 显式删除大型变量以帮助垃圾回收
+        del image_bytes
+        
+        if prepared is None:
             return None
         
+        prepared_bytes, image_format = prepared
+        return prepared_bytes, image_format, original_size
+        
     except Exception as e:
         logger.error(f"下载图片失败: {str(e)}")
         return None
-    finally:
-        # 显式调用垃圾回收
-        gc.collect()
 
-def is_image_processable(bucket, key):
+class ImageManifest:
+    """文档图片清单，通过一次分页LIST获取图片目录下所有对象的大小，替代逐个HEAD请求"""
+    
+    def __init__(self, bucket, prefix):
+        """
+        初始化图片清单
+        
+        Args:
+            bucket: S3桶名
+            prefix: 图片目录的对象键前缀，如"<md_dir>/images/"
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self._sizes = list_object_sizes(bucket, prefix)
+        
+        if self._sizes is None:
+            logger.warning(f"无法列举 s3://{bucket}/{prefix}，回退到逐个获取对象大小")
+        else:
+            logger.info(f"已加载图片清单 s3://{bucket}/{prefix}，共 {len(self._sizes)} 个对象")
+    
+    def get_size(self, bucket, key):
+        """
+        获取图片大小，清单范围外的对象回退到HEAD请求
+        
+        Args:
+            bucket: S3桶名
+            key: S3对象键
+            
+        Returns:
+            对象大小（字节），对象不存在时返回0
+        """
+        if self._sizes is not None and bucket == self.bucket and key.startswith(self.prefix):
+            return self._sizes.get(key, 0)
+        return get_object_size(bucket, key)
+
+class InMemoryImageStore:
+    """
+    解析阶段写出的图片在内存中的副本，接口与ImageManifest一致
+    
+    记录所有图片的大小，并在总字节数上限内保存图片数据，增强阶段直接使用，不再发起HEAD和下载请求
+    """
+    
+    def __init__(self, bucket, max_bytes):
+        """
+        初始化图片存储
+        
+        Args:
+            bucket: 图片所在的S3桶名
+            max_bytes: 保存图片数据的总字节数上限，超过后只记录大小
+        """
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.stored_bytes = 0
+        self._sizes = {}
+        self._data = {}
+    
+    def put(self, key, data):
+        """
+        记录一张图片
+        
+        Args:
+            key: S3对象键
+            data: 图片数据
+        """
+        self._sizes[key] = len(data)
+        if key not in self._data and self.stored_bytes + len(data) <= self.max_bytes:
+            self._data[key] = data
+            self.stored_bytes += len(data)
+    
+    def merge(self, other):
+        """
+        合并另一个图片存储中的图片（如各分片的解析结果）
+        
+        Args:
+            other: InMemoryImageStore
+        """
+        for key, size in other._sizes.items():
+            if key in other._data:
+                self.put(key, other._data[key])
+            else:
+                self._sizes[key] = size
+    
+    def get_size(self, bucket, key):
+        """
+        获取图片大小，存储范围外的对象回退到HEAD请求
+        
+        Args:
+            bucket: S3桶名
+            key: S3对象键
+            
+        Returns:
+            对象大小（字节），对象不存在时返回0
+        """
+        if bucket == self.bucket and key in self._sizes:
+            return self._sizes[key]
+        return get_object_size(bucket, key)
+    
+    def get_bytes(self, bucket, key):
+        """
+        获取图片数据
+        
+        Args:
+            bucket: S3桶名
+            key: S3对象键
+            
+        Returns:
+            图片数据；未保存时返回None
+        """
+        if bucket != self.bucket:
+            return None
+        return self._data.get(key)
+    
+    def stats(self):
+        """获取图片数量、保存数据的图片数量和保存的字节数"""
+        return {'images': len(self._sizes), 'stored_images': len(self._data), 'stored_bytes': self.stored_bytes}
+
+def get_image_size(bucket, key, manifest=None):
+    """
+    获取图片大小，优先查询图片清单
+    
+    Args:
+        bucket: S3桶名
+        key: S3对象键
+        manifest: 可选的ImageManifest或InMemoryImageStore
+        
+    Returns:
+        对象大小（字节）
+    """
+    if manifest is not None:
+        return manifest.get_size(bucket, key)
+    return get_object_size(bucket, key)
+
+def is_image_processable(bucket, key, manifest=None):
     """
     检查图片是否可处理（大小是否超过最小阈值）
     
     Args:
         bucket: S3桶名
         key: S3对象键
+        manifest: 可选的ImageManifest，提供时不再发起HEAD请求
         
     Returns:
         bool: 图片是否可处理
     """
-    image_size = get_object_size(bucket, key)
+    image_size = get_image_size(bucket, key, manifest)
     return image_size >= IMAGE_CONFIG['MIN_SIZE_BYTES']
 
-def is_image_analyzable(bucket, key):
+def is_image_analyzable(bucket, key, manifest=None):
     """
     检查图片是否可分析（大小是否超过最小理解阈值）
     
     Args:
         bucket: S3桶名
         key: S3对象键
+        manifest: 可选的ImageManifest，提供时不再发起HEAD请求
         
     Returns:
         bool: 图片是否可分析
     """
-    image_size = get_object_size(bucket, key)
+    image_size = get_image_size(bucket, key, manifest)
     return image_size >= IMAGE_CONFIG['MIN_UNDERSTANDING_SIZE_BYTES']
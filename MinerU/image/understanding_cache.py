@@ -0,0 +1,229 @@
+"""
+图片理解结果缓存模块，按图片名哈希和上下文缓存Bedrock图片分析结果
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from config import AWS_CONFIG, PROMPTS, CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# MinerU以sha256("{PDF数据的MD5}/images/{页码}_{边界框}")命名提取的图片：同一PDF、同一分片方式下图片名稳定，
+# 不同图片不会重名；但图片名不是图片字节的哈希，分片方式改变（或整体解析与分片解析之间）图片名不同，缓存不命中
+_SHA256_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def _sha256_text(text):
+    """计算文本的SHA-256摘要"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+@lru_cache(maxsize=1)
+def get_prompt_version():
+    """
+    获取提示词版本，由图片理解提示词内容计算得到，提示词修改后旧缓存自动失效
+    
+    Returns:
+        提示词版本字符串
+    """
+    return _sha256_text(PROMPTS['IMAGE_SYSTEM'] + PROMPTS['IMAGE_UNDERSTANDING'])[:16]
+
+def get_image_content_hash(image_key):
+    """
+    从图片对象键中获取图片标识哈希（MinerU命名图片的SHA-256，唯一确定PDF数据、页码和边界框）
+    
+    Args:
+        image_key: 图片的S3对象键
+    
+    Returns:
+        图片标识哈希；文件名不是SHA-256时返回None
+    """
+    stem = os.path.splitext(os.path.basename(image_key))[0].lower()
+    if _SHA256_NAME_PATTERN.match(stem):
+        return stem
+    return None
+
+def build_cache_key(image_key, context_text):
+    """
+    构建图片理解结果的缓存键：(图片哈希, 上下文哈希, 模型ID, 提示词版本)
+    
+    Args:
+        image_key: 图片的S3对象键
+        context_text: 发送给模型的上下文文本
+    
+    Returns:
+        缓存键字符串；图片名不是SHA-256时返回None
+    """
+    image_hash = get_image_content_hash(image_key)
+    if image_hash is None:
+        return None
+    parts = [image_hash, _sha256_text(context_text), AWS_CONFIG['BEDROCK_MODEL_ID'], get_prompt_version()]
+    return _sha256_text('|'.join(parts))
+
+class UnderstandingCache:
+    """两级图片理解结果缓存：内存LRU + 本地SQLite，SQLite按总大小淘汰最久未访问的条目"""
+    
+    def __init__(self, memory_entries, db_path=None, max_db_bytes=0):
+        """
+        初始化缓存
+        
+        Args:
+            memory_entries: 内存LRU的最大条目数
+            db_path: SQLite文件路径，为None时仅使用内存缓存
+            max_db_bytes: SQLite中缓存值的总大小上限（字节），0表示不限制
+        """
+        self.memory_entries = memory_entries
+        self.db_path = db_path
+        self.max_db_bytes = max_db_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        
+        if self.db_path:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS understanding_cache ("
+                    "cache_key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_understanding_cache_accessed "
+                    "ON understanding_cache (accessed_at)"
+                )
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+    
+    def _remember(self, cache_key, value):
+        """写入内存LRU，调用方需持有锁"""
+        self._memory[cache_key] = value
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def get(self, cache_key):
+        """
+        查询缓存
+        
+        Args:
+            cache_key: 缓存键
+        
+        Returns:
+            缓存的图片理解内容（可能为空字符串，表示图片无有效信息）；未命中时返回None
+        """
+        with self._lock:
+            if cache_key in self._memory:
+                self._memory.move_to_end(cache_key)
+                self._stats['memory_hits'] += 1
+                return self._memory[cache_key]
+        
+        value = None
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT value FROM understanding_cache WHERE cache_key = ?", (cache_key,)
+                    ).fetchone()
+                    if row is not None:
+                        value = json.loads(row[0])
+                        conn.execute(
+                            "UPDATE understanding_cache SET accessed_at = ? WHERE cache_key = ?",
+                            (time.time(), cache_key)
+                        )
+            except Exception as e:
+                logger.error(f"读取图片理解缓存失败: {str(e)}")
+        
+        with self._lock:
+            if value is None:
+                self._stats['misses'] += 1
+            else:
+                self._stats['disk_hits'] += 1
+                self._remember(cache_key, value)
+        return value
+    
+    def put(self, cache_key, value):
+        """
+        写入缓存
+        
+        Args:
+            cache_key: 缓存键
+            value: 图片理解内容
+        """
+        with self._lock:
+            self._remember(cache_key, value)
+            self._stats['writes'] += 1
+        
+        if not self.db_path:
+            return
+        
+        try:
+            serialized = json.dumps(value, ensure_ascii=False)
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO understanding_cache (cache_key, value, size, accessed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (cache_key, serialized, len(serialized.encode('utf-8')), time.time())
+                )
+                self._evict(conn)
+        except Exception as e:
+            logger.error(f"写入图片理解缓存失败: {str(e)}")
+    
+    def _evict(self, conn):
+        """总大小超过上限时淘汰最久未访问的条目"""
+        if not self.max_db_bytes:
+            return
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM understanding_cache").fetchone()[0]
+        if total_size <= self.max_db_bytes:
+            return
+        
+        evicted = 0
+        for cache_key, size in conn.execute(
+            "SELECT cache_key, size FROM understanding_cache ORDER BY accessed_at"
+        ).fetchall():
+            if total_size <= self.max_db_bytes:
+                break
+            conn.execute("DELETE FROM understanding_cache WHERE cache_key = ?", (cache_key,))
+            total_size -= size
+            evicted += 1
+        
+        with self._lock:
+            self._stats['evictions'] += evicted
+    
+    def stats(self):
+        """
+        获取缓存命中统计
+        
+        Returns:
+            包含命中、未命中、写入和淘汰次数的字典
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+@lru_cache(maxsize=1)
+def get_understanding_cache():
+    """
+    获取进程内共享的图片理解缓存
+    
+    Returns:
+        UnderstandingCache实例；缓存未启用时返回None
+    """
+    if not CACHE_CONFIG['ENABLED']:
+        return None
+    return UnderstandingCache(
+        memory_entries=CACHE_CONFIG['MEMORY_ENTRIES'],
+        db_path=CACHE_CONFIG['DB_PATH'],
+        max_db_bytes=CACHE_CONFIG['MAX_DB_BYTES']
+    )
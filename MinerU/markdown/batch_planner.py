@@ -0,0 +1,165 @@
+"""
+图片分析批次规划模块，将相邻段落的图片按图片数量和令牌预算装箱到尽量少的Bedrock调用中
+"""
+
+import re
+from aws.bedrock_utils import estimate_input_tokens
+from config import IMAGE_CONFIG, API_CONFIG, BATCH_CONFIG
+
+# 上下文中的图片标签，如[image3]
+_IMAGE_TAG_PATTERN = re.compile(r'\[image(\d+)\]')
+
+def get_max_images_per_call():
+    """
+    获取单次调用的最大图片数量，同时受图片数量上限和输出令牌预算约束
+    
+    Returns:
+        单次调用的最大图片数量
+    """
+    output_limit = API_CONFIG['MAX_OUTPUT_TOKENS'] // BATCH_CONFIG['OUTPUT_TOKENS_PER_IMAGE']
+    return max(1, min(IMAGE_CONFIG['MAX_BATCH_SIZE'], output_limit))
+
+def split_analysis_task(task, max_images):
+    """
+    将段落分析任务拆分为图片数量不超过上限的片段
+    
+    Args:
+        task: 段落分析任务 (modified_context, image_base64_list, image_url_to_index, paragraph_idx)
+        max_images: 每个片段的最大图片数量
+    
+    Returns:
+        片段列表，每个元素为(段落索引, 上下文, [(图片索引, 图片URL, 图片)])
+    """
+    modified_context, image_base64_list, image_url_to_index, paragraph_idx = task
+    url_by_index = {idx: url for url, idx in image_url_to_index.items()}
+    images = [
+        (idx, url_by_index[idx], image_base64_list[idx - 1])
+        for idx in sorted(url_by_index)
+        if image_base64_list[idx - 1]
+    ]
+    return [
+        (paragraph_idx, modified_context, images[i:i + max_images])
+        for i in range(0, len(images), max_images)
+    ]
+
+class ImageBatchPlanner:
+    """按文档顺序将段落片段贪心装箱，单个批次不超过图片数量上限和估算输入令牌预算"""
+    
+    def __init__(self, max_images=None, max_input_tokens=None):
+        """
+        初始化批次规划器
+        
+        Args:
+            max_images: 单次调用的最大图片数量，默认由配置计算
+            max_input_tokens: 单次调用的估算输入令牌上限，默认取配置
+        """
+        self.max_images = max_images or get_max_images_per_call()
+        self.max_input_tokens = max_input_tokens or BATCH_CONFIG['MAX_INPUT_TOKENS']
+        self._sections = []
+        self._image_count = 0
+        self._input_tokens = 0
+    
+    @property
+    def pending(self):
+        """是否有尚未输出的片段"""
+        return bool(self._sections)
+    
+    def add(self, section):
+        """
+        添加一个段落片段
+        
+        Args:
+            section: 段落片段 (段落索引, 上下文, [(图片索引, 图片URL, 图片)])
+        
+        Returns:
+            加入该片段会超出预算时，返回此前已装满的批次；否则返回None
+        """
+        _, context_text, images = section
+        section_tokens = estimate_input_tokens(len(context_text), len(images))
+        
+        completed = None
+        if self._sections and (
+            self._image_count + len(images) > self.max_images
+            or self._input_tokens + section_tokens > self.max_input_tokens
+        ):
+            completed = self.flush()
+        
+        self._sections.append(section)
+        self._image_count += len(images)
+        self._input_tokens += section_tokens
+        return completed
+    
+    def flush(self):
+        """
+        输出当前批次
+        
+        Returns:
+            片段列表；没有待输出片段时返回None
+        """
+        if not self._sections:
+            return None
+        batch = self._sections
+        self._sections = []
+        self._image_count = 0
+        self._input_tokens = 0
+        return batch
+
+def build_batch_request(batch):
+    """
+    为批次中的图片分配调用内唯一的标签，并改写各段落上下文中的图片标签
+    
+    Args:
+        batch: 片段列表
+    
+    Returns:
+        (Bedrock段落列表, 标签映射)
+        Bedrock段落列表的每个元素为(上下文, [(图片标签, 图片)])，
+        标签映射为 {图片标签: (段落索引, 图片URL, 图片索引)}
+    """
+    sections = []
+    label_map = {}
+    counter = 0
+    
+    for paragraph_idx, context_text, images in batch:
+        local_labels = {}
+        labeled_images = []
+        for idx, url, image in images:
+            counter += 1
+            label = f"image{counter}"
+            local_labels[idx] = label
+            labeled_images.append((label, image))
+            label_map[label] = (paragraph_idx, url, idx)
+        
+        # 本次调用不包含的图片标签替换为通用占位，避免与其他段落的标签混淆
+        rewritten_context = _IMAGE_TAG_PATTERN.sub(
+            lambda match: f"[{local_labels[int(match.group(1))]}]" if int(match.group(1)) in local_labels else "[图片]",
+            context_text
+        )
+        sections.append((rewritten_context, labeled_images))
+    
+    return sections, label_map
+
+def remap_batch_results(understanding_results, label_map):
+    """
+    将批次分析结果映射回各段落
+    
+    Args:
+        understanding_results: 以图片标签为键的分析结果，调用失败时为空字符串
+        label_map: build_batch_request返回的标签映射
+    
+    Returns:
+        分析结果列表，每个元素为(段落索引, 图片URL到索引的映射, 以imageN为键的分析结果)
+        调用失败时分析结果为空字符串
+    """
+    paragraphs = {}
+    for label, (paragraph_idx, url, idx) in label_map.items():
+        image_url_to_index, paragraph_results = paragraphs.setdefault(paragraph_idx, ({}, {}))
+        image_url_to_index[url] = idx
+        if isinstance(understanding_results, dict) and label in understanding_results:
+            paragraph_results[f"image{idx}"] = understanding_results[label]
+    
+    failed = not isinstance(understanding_results, dict)
+    return [
+        (paragraph_idx, image_url_to_index, "" if failed else paragraph_results)
+        for paragraph_idx, (image_url_to_index, paragraph_results) in paragraphs.items()
+    ]
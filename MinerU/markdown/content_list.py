@@ -0,0 +1,160 @@
+"""
+内容列表解析模块，根据MinerU输出的内容列表为每张图片构建分析上下文
+"""
+
+import os
+import logging
+from urllib.parse import urlparse
+from aws.bedrock_utils import estimate_input_tokens
+from parser import extract_image_references, extract_paragraphs_with_images
+from config import CONTENT_LIST_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 作为上下文的文本块类型，以及带有图片的块类型
+_TEXT_BLOCK_TYPES = ('text', 'equation')
+_IMAGE_BLOCK_TYPES = ('image', 'table')
+
+def _block_text(item):
+    """获取文本块的文本，标题块加上Markdown标题标记；非文本块返回空字符串"""
+    if item.get('type') not in _TEXT_BLOCK_TYPES:
+        return ''
+    text = (item.get('text') or '').strip()
+    if text and item.get('text_level'):
+        text = f"{'#' * item['text_level']} {text}"
+    return text
+
+def _next_text_block(content_list, idx, step):
+    """
+    从idx开始按step方向查找下一个非空文本块
+    
+    Returns:
+        (块索引, 文本)；没有更多文本块时返回(None, '')
+    """
+    while 0 <= idx < len(content_list):
+        text = _block_text(content_list[idx])
+        if text:
+            return idx, text
+        idx += step
+    return None, ''
+
+def _image_caption(item):
+    """
+    获取图片块或表格块的标题和脚注
+    
+    Returns:
+        (标题, 脚注)
+    """
+    if item.get('type') == 'table':
+        captions, footnotes = item.get('table_caption'), item.get('table_footnote')
+    else:
+        captions, footnotes = item.get('img_caption'), item.get('img_footnote')
+    return ' '.join(captions or []).strip(), ' '.join(footnotes or []).strip()
+
+def collect_neighbour_text(content_list, image_pos, max_tokens):
+    """
+    在令牌预算内交替收集图片前后最近的文本块，并在预算允许时补充图片所在章节的标题
+    
+    Args:
+        content_list: 内容列表
+        image_pos: 图片块在内容列表中的索引
+        max_tokens: 上下文文本的估算令牌上限
+        
+    Returns:
+        (图片之前的文本块列表, 图片之后的文本块列表)，均按文档顺序排列
+    """
+    remaining = max_tokens
+    cursors = {-1: image_pos, 1: image_pos}
+    blocks = {-1: [], 1: []}
+    open_steps = [-1, 1]
+    while open_steps:
+        for step in list(open_steps):
+            idx, text = _next_text_block(content_list, cursors[step] + step, step)
+            if idx is None or remaining <= 0:
+                open_steps.remove(step)
+                continue
+            tokens = estimate_input_tokens(len(text), 0)
+            if tokens > remaining:
+                # 超出预算的文本块截取靠近图片的部分后停止该方向
+                max_chars = int(remaining * len(text) / max(tokens, 1))
+                if max_chars > 0:
+                    blocks[step].append(text[-max_chars:] if step < 0 else text[:max_chars])
+                remaining = 0
+                open_steps.remove(step)
+                continue
+            cursors[step] = idx
+            blocks[step].append(text)
+            remaining -= tokens
+    
+    before = blocks[-1][::-1]
+    
+    # 图片之前最近的标题未包含在上下文中时，在预算允许的情况下放在最前面
+    for idx in range(cursors[-1] - 1, -1, -1):
+        item = content_list[idx]
+        if item.get('type') == 'text' and item.get('text_level'):
+            heading = _block_text(item)
+            if heading and estimate_input_tokens(len(heading), 0) <= remaining:
+                before.insert(0, heading)
+            break
+    
+    return before, blocks[1]
+
+def build_image_contexts(content_list, md_content, max_context_tokens=None):
+    """
+    根据内容列表为Markdown中的每个图片引用构建分析上下文
+    
+    每张图片的上下文由其标题、脚注以及前后最近的文本块组成，不再使用图片所在的整个章节；
+    内容列表中找不到的图片引用回退为按标题分段的上下文
+    
+    Args:
+        content_list: MinerU输出的内容列表
+        md_content: 已更新图片引用的Markdown内容
+        max_context_tokens: 每张图片上下文文本的估算令牌上限，默认取配置
+        
+    Returns:
+        (段落列表, 图片位置字典)
+        段落列表的元素为(上下文文本, 图片URL列表)，与extract_paragraphs_with_images的返回格式一致
+        图片位置字典为图片URL到{'page_idx', 'bbox', 'caption'}的映射
+    """
+    max_context_tokens = max_context_tokens or CONTENT_LIST_CONFIG['MAX_CONTEXT_TOKENS']
+    
+    # 内容列表中的图片路径与Markdown中的图片URL按文件名对应（同一次解析中MinerU按PDF数据、页码和边界框计算的哈希命名，文件名唯一）
+    url_by_name = {}
+    for _, image_url, _ in extract_image_references(md_content):
+        url_by_name.setdefault(os.path.basename(urlparse(image_url).path), image_url)
+    
+    paragraphs = []
+    image_locations = {}
+    for pos, item in enumerate(content_list):
+        if item.get('type') not in _IMAGE_BLOCK_TYPES or not item.get('img_path'):
+            continue
+        image_url = url_by_name.get(os.path.basename(item['img_path']))
+        if image_url is None:
+            # 图片引用已因尺寸过小等原因被删除
+            continue
+        
+        caption, footnote = _image_caption(item)
+        before, after = collect_neighbour_text(content_list, pos, max_context_tokens)
+        image_lines = [f"![{caption}]({image_url})"]
+        if caption:
+            image_lines.append(f"图片标题：{caption}")
+        if footnote:
+            image_lines.append(f"图片注释：{footnote}")
+        
+        paragraphs.append(('\n\n'.join(before + ['\n'.join(image_lines)] + after), [image_url]))
+        image_locations.setdefault(image_url, {
+            'page_idx': item.get('page_idx'),
+            'bbox': item.get('bbox'),
+            'caption': caption
+        })
+    
+    # 内容列表中没有对应图片块的引用，使用所在章节作为上下文
+    uncovered_urls = set(url_by_name.values()) - set(image_locations)
+    if uncovered_urls:
+        logger.info(f"{len(uncovered_urls)} 个图片引用不在内容列表中，使用所在章节作为上下文")
+        for paragraph, image_urls in extract_paragraphs_with_images(md_content):
+            image_urls = [image_url for image_url in image_urls if image_url in uncovered_urls]
+            if image_urls:
+                paragraphs.append((paragraph, image_urls))
+    
+    return paragraphs, image_locations
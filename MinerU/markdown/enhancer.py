@@ -6,31 +6,107 @@ import os
 import re
 import logging
 import concurrent.futures
+import queue
 import threading
 import time
-import gc
 from urllib.parse import urlparse
-from config import THREAD_POOL_CONFIG, IMAGE_CONFIG
+from config import THREAD_POOL_CONFIG, IMAGE_CONFIG, DEDUP_CONFIG, BATCH_CONFIG, CONTENT_LIST_CONFIG
 from aws.s3_utils import s3_url_to_cloudfront_url, parse_s3_url
-from image.processor import download_and_convert_image, is_image_processable, is_image_analyzable
-from aws.bedrock_utils import analyze_image_with_bedrock
-from parser import extract_paragraphs_with_images, get_image_path_from_md_path
+from image.processor import download_and_convert_image, is_image_processable, is_image_analyzable, get_image_size, ImageManifest
+from aws.bedrock_utils import analyze_image_sections_with_bedrock, get_s3_image_source, S3ImageSource
+from image.understanding_cache import get_understanding_cache, build_cache_key
+from image.dedup import compute_dhash, DocumentImageClusters, get_perceptual_hash_index
+from aws.checkpoint_utils import build_checkpoint_entry_id, load_checkpoint, save_checkpoint
+from utils.memory_utils import get_memory_budget
+from utils.fair_executor import get_s3_executor, get_bedrock_executor
+from parser import extract_paragraphs_with_images, get_image_path_from_md_path, splice_markdown
+from batch_planner import ImageBatchPlanner, split_analysis_task, build_batch_request, remap_batch_results
+from content_list import build_image_contexts
 
 logger = logging.getLogger(__name__)
 
+class _ParagraphDownloadState:
+    """记录单个段落的图片下载进度，最后一张图片下载完成时生成分析任务"""
+    
+    def __init__(self, modified_context, image_info_list, paragraph_idx):
+        self.modified_context = modified_context
+        self.paragraph_idx = paragraph_idx
+        self.remaining = len(image_info_list)
+        # 按图片在上下文中的编号存放数据，保证imageN标签与上下文一致
+        self.image_base64_list = [None] * max(info[3] for info in image_info_list)
+        self.image_url_to_index = {}
+        self._lock = threading.Lock()
+    
+    def add_result(self, image_info, result):
+        """
+        登记一张图片的下载结果
+        
+        Args:
+            image_info: 图片信息 (bucket, key, url, idx)
+            result: download_image_with_logging的返回值，失败时为None
+            
+        Returns:
+            段落全部图片处理完毕且至少有一张成功时返回分析任务元组，否则返回None
+        """
+        with self._lock:
+            if result:
+                url, idx, image_bytes, _ = result
+                self.image_base64_list[idx - 1] = image_bytes
+                self.image_url_to_index[url] = idx
+            self.remaining -= 1
+            if self.remaining > 0 or not self.image_url_to_index:
+                return None
+            task = (self.modified_context, self.image_base64_list, self.image_url_to_index, self.paragraph_idx)
+            self.image_base64_list = None
+            return task
+
 class MarkdownImageEnhancer:
     """Markdown图片增强器，用于处理和增强Markdown文件中的图片引用"""
     
-    def __init__(self, md_content, md_s3_url):
+    def __init__(self, md_content, md_s3_url, progress_callback=None, image_store=None, content_list=None):
         """
         初始化Markdown图片增强器
         
         Args:
             md_content: Markdown文件内容
-            md_s3_url: Markdown文件的S3 URL
+            md_s3_url: Markdown文件的S3 URL，同时作为图片分析检查点的文档ID
+            progress_callback: 图片分析进度回调，参数为(已完成图片数, 图片总数)
+            image_store: 解析阶段保存的InMemoryImageStore，提供时直接使用其中的图片大小和数据
+            content_list: PDF解析得到的内容列表，提供时按图片前后的文本块构建分析上下文
         """
         self.md_content = md_content
         self.md_s3_url = md_s3_url
+        self.progress_callback = progress_callback
+        self.image_store = image_store
+        self.content_list = content_list
+        # 按内容列表构建上下文时，图片URL到所在页码、边界框和标题的映射
+        self.image_locations = {}
+        # 图片分析进度，以及待分析图片的检查点条目ID（以(段落索引, 图片URL)为键）
+        self.image_progress = {'done': 0, 'total': 0}
+        self._checkpoint_entry_ids = {}
+        self._image_manifest = None
+        self._manifest_lock = threading.Lock()
+        # 图片准备统计：下载的原始字节数与实际发送给Bedrock的字节数
+        self.image_prep_stats = {'downloaded_bytes': 0, 'prepared_bytes': 0}
+        self._stats_lock = threading.Lock()
+        # 本文档在进程内存预算中的预留：下载前按图片大小预留，分析完成或丢弃后释放
+        self._memory_lease = get_memory_budget().lease()
+        # 近似重复图片去重：文档内聚类、重复图片到代表图片的映射、跨文档索引命中的理解内容、代表图片的上下文
+        self._image_clusters = DocumentImageClusters(DEDUP_CONFIG['MAX_DISTANCE']) if DEDUP_CONFIG['ENABLED'] else None
+        self._duplicate_of = {}
+        self._known_understanding = {}
+        self._representative_contexts = {}
+    
+    @property
+    def image_manifest(self):
+        """获取文档图片清单（有内存图片存储时直接使用，否则首次访问时通过LIST构建）"""
+        if self.image_store is not None:
+            return self.image_store
+        with self._manifest_lock:
+            if self._image_manifest is None:
+                image_bucket, image_prefix = parse_s3_url(get_image_path_from_md_path(self.md_s3_url))
+                self._image_manifest = ImageManifest(image_bucket, f"{image_prefix}/")
+        return self._image_manifest
     
     def log_thread_info(self, message):
         """
@@ -70,7 +146,7 @@ class MarkdownImageEnhancer:
         image_bucket, image_key = parse_s3_url(image_s3_url)
         
         # 检查图片是否可处理
-        if not is_image_processable(image_bucket, image_key):
+        if not is_image_processable(image_bucket, image_key, self.image_manifest):
             # 图片太小，删除引用
             logger.info(f"图片 {image_s3_url} 太小，已删除引用")
             return ""
@@ -89,17 +165,17 @@ class MarkdownImageEnhancer:
             args: 参数元组 (match, idx)
             
         Returns:
-            (原始引用, 处理后的引用)
+            (起始位置, 结束位置, 处理后的引用)
         """
         match, idx = args
         
         try:
             # 调用原始处理函数
             result = self.process_image_reference(match)
-            return match.group(0), result
+            return match.start(), match.end(), result
         except Exception as e:
             logger.error(f"处理图片引用 #{idx} 时出错: {str(e)}")
-            return match.group(0), match.group(0)  # 出错时保持原样
+            return match.start(), match.end(), match.group(0)  # 出错时保持原样
     
     def update_image_references(self):
         """
@@ -115,35 +191,26 @@ class MarkdownImageEnhancer:
         if not matches:
             return self.md_content
         
-        # 创建一个字典，用于存储原始引用和处理后的引用
-        replacements = {}
+        # 编辑列表，记录每个引用的(起始位置, 结束位置, 处理后的引用)
+        edits = []
         
         # 准备任务
         tasks = [(match, idx) for idx, match in enumerate(matches)]
         
-        # 使用线程池并行处理图片引用
-        with concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_CONFIG['PROCESS']) as executor:
-            # 提交所有任务
-            future_to_task = {
-                executor.submit(self.process_image_reference_with_logging, task): task
-                for task in tasks
-            }
-            
-            # 收集结果
-            for future in concurrent.futures.as_completed(future_to_task):
-                try:
-                    original, replacement = future.result()
-                    # 存储原始引用和处理后的引用
-                    replacements[original] = replacement
-                except Exception as e:
-                    logger.error(f"处理图片引用时出错: {str(e)}")
-        
-        # 替换所有图片引用
-        processed_content = self.md_content
-        for original, replacement in replacements.items():
-            processed_content = processed_content.replace(original, replacement)
-        
-        return processed_content
+        # 使用进程内共享的S3线程池并行处理图片引用
+        executor = get_s3_executor()
+        futures = [executor.submit(self.md_s3_url, self.process_image_reference_with_logging, task) for task in tasks]
+        
+        # 收集结果
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                start, end, replacement = future.result()
+                edits.append((start, end, replacement))
+            except Exception as e:
+                logger.error(f"处理图片引用时出错: {str(e)}")
+        
+        # 一次性拼接重建内容，替换所有图片引用
+        return splice_markdown(self.md_content, edits)
     
     def extract_image_info(self, paragraph, image_urls, paragraph_idx):
         """
@@ -160,17 +227,14 @@ class MarkdownImageEnhancer:
         """
         # 直接使用当前段落作为上下文
         context_text = paragraph
-        modified_context = context_text
 
         # 收集图片信息
         image_info_list = []
+        image_tags = {}
         
-        # 遍历：收集图片信息并替换上下文中的图片引用
+        # 遍历：收集图片信息，记录每个图片URL对应的[imageX]标签
         for idx, image_url in enumerate(image_urls, 1):
-            # 替换上下文中的图片引用为[imageX]标签
-            image_tag = f"[image{idx}]"
-            pattern = f'!\\[(.*?)\\]\\({re.escape(image_url)}\\)'
-            modified_context = re.sub(pattern, image_tag, modified_context)
+            image_tags.setdefault(image_url, f"[image{idx}]")
             
             # 如果是CloudFront URL，则从URL中提取S3路径
             if image_url.startswith("https://"):
@@ -186,13 +250,21 @@ class MarkdownImageEnhancer:
                 image_bucket, image_key = parse_s3_url(image_s3_url)
             
             # 检查图片是否可分析
-            if not is_image_analyzable(image_bucket, image_key):
+            if not is_image_analyzable(image_bucket, image_key, self.image_manifest):
                 logger.info(f"图片 {image_url} 太小，跳过理解")
                 continue
             
             # 存储图片信息
             image_info_list.append((image_bucket, image_key, image_url, idx))
         
+        # 单次扫描替换上下文中的图片引用为[imageX]标签
+        edits = [
+            (match.start(), match.end(), image_tags[match.group(2)])
+            for match in re.finditer(r'!\[(.*?)\]\((.*?)\)', context_text)
+            if match.group(2) in image_tags
+        ]
+        modified_context = splice_markdown(context_text, edits)
+        
         return modified_context, image_info_list
     
     def extract_image_info_with_logging(self, args):
@@ -223,17 +295,34 @@ class MarkdownImageEnhancer:
             args: 参数元组 (image_info, paragraph_idx)
             
         Returns:
-            (图片URL, 索引, base64编码的图片数据, 段落索引)
+            (图片URL, 索引, (图片数据, 图片格式)或S3ImageSource, 段落索引)
         """
         image_info, paragraph_idx = args
         bucket, key, url, idx = image_info
         
+        # S3引用模式下，模型和图片格式支持时直接引用S3位置，不下载图片
+        if IMAGE_CONFIG['ANALYSIS_SOURCE'] == 's3':
+            s3_source = get_s3_image_source(bucket, key)
+            if s3_source is not None:
+                return url, idx, s3_source, paragraph_idx
+        
+        # 按图片原始大小预留内存，进程内存预算用尽时等待其他图片分析完成
+        reserved_bytes = get_image_size(bucket, key, self.image_manifest)
+        self._memory_lease.reserve(reserved_bytes)
+        
         try:
             # 调用下载函数
-            image_bytes = download_and_convert_image(bucket, key)
+            prepared = download_and_convert_image(bucket, key, self.image_store)
             
-            if image_bytes:
-                return url, idx, image_bytes, paragraph_idx
+            if prepared:
+                image_bytes, image_format, original_size = prepared
+                with self._stats_lock:
+                    self.image_prep_stats['downloaded_bytes'] += original_size
+                    self.image_prep_stats['prepared_bytes'] += len(image_bytes)
+                # 预留量调整为待分析图片数据的大小，分析完成后释放
+                self._memory_lease.resize(reserved_bytes, len(image_bytes))
+                reserved_bytes = 0
+                return url, idx, (image_bytes, image_format), paragraph_idx
             else:
                 logger.warning(f"下载图片 #{idx} (段落 #{paragraph_idx}) 失败")
                 return None
@@ -241,35 +330,366 @@ class MarkdownImageEnhancer:
             logger.error(f"下载图片 #{idx} (段落 #{paragraph_idx}) 出错: {str(e)}")
             return None
         finally:
-            # 显式调用垃圾回收，帮助释放大型图片数据
-            gc.collect()
+            self._memory_lease.release(reserved_bytes)
     
-    def analyze_images_with_logging(self, args):
+    def analyze_batch_with_logging(self, batch):
         """
-        分析段落中的图片（带日志记录，用于多线程）
+        分析一个批次中的图片（带日志记录，用于多线程）
         
         Args:
-            args: 参数元组 (modified_context, image_base64_list, image_url_to_index, paragraph_idx)
+            batch: 片段列表，每个元素为(段落索引, 上下文, [(图片索引, 图片URL, 图片)])
             
         Returns:
-            (段落索引, 图片URL到索引的映射, 分析结果)
+            分析结果列表，每个元素为(段落索引, 图片URL到索引的映射, 分析结果)
         """
-        modified_context, image_base64_list, image_url_to_index, paragraph_idx = args
+        paragraph_ids = sorted({section[0] for section in batch})
         
         try:
-            # 使用Bedrock分析所有图片
-            understanding_results = analyze_image_with_bedrock(image_base64_list, modified_context)
+            sections, label_map = build_batch_request(batch)
+            self.log_thread_info(f"分析段落 {paragraph_ids} 中的 {len(label_map)} 张图片")
+            
+            # 使用Bedrock在一次调用中分析批次内所有图片
+            understanding_results = analyze_image_sections_with_bedrock(sections)
             
-            return paragraph_idx, image_url_to_index, understanding_results
+            return remap_batch_results(understanding_results, label_map)
         except Exception as e:
-            logger.error(f"分析段落 #{paragraph_idx} 中图片时出错: {str(e)}")
-            return paragraph_idx, image_url_to_index, {}
+            logger.error(f"分析段落 {paragraph_ids} 中图片时出错: {str(e)}")
+            return []
+        finally:
+            # 释放批次内图片数据的内存预留
+            self._memory_lease.release(sum(
+                len(image[0]) for _, _, images in batch for _, _, image in images
+                if not isinstance(image, S3ImageSource)
+            ))
+            del batch
+    
+    def restore_checkpoint(self, paragraph_info_list):
+        """
+        读取文档的图片分析检查点，已记录结果的图片跳过下载和分析
+        
+        Args:
+            paragraph_info_list: 段落信息列表，每个元素为(modified_context, image_info_list, paragraph_idx)
+            
+        Returns:
+            (检查点中的分析结果列表, 仍需分析的段落信息列表)
+        """
+        checkpoint = load_checkpoint(self.md_s3_url)
+        
+        restored_results = []
+        pending_paragraphs = []
+        
+        for modified_context, image_info_list, paragraph_idx in paragraph_info_list:
+            pending_images = []
+            restored_understanding = {}
+            image_url_to_index = {}
+            
+            for image_info in image_info_list:
+                _, _, url, idx = image_info
+                entry_id = build_checkpoint_entry_id(url, modified_context)
+                if entry_id in checkpoint:
+                    restored_understanding[f"image{idx}"] = checkpoint[entry_id]
+                    image_url_to_index[url] = idx
+                else:
+                    self._checkpoint_entry_ids[(paragraph_idx, url)] = entry_id
+                    pending_images.append(image_info)
+            
+            if image_url_to_index:
+                restored_results.append((paragraph_idx, image_url_to_index, restored_understanding))
+            if pending_images:
+                pending_paragraphs.append((modified_context, pending_images, paragraph_idx))
+        
+        restored_count = sum(len(result[1]) for result in restored_results)
+        if restored_count:
+            logger.info(f"从检查点恢复 {restored_count} 张图片的分析结果")
+        
+        return restored_results, pending_paragraphs
+    
+    def checkpoint_results(self, analysis_results):
+        """
+        记录分析结果到检查点，并更新图片分析进度
+        
+        Args:
+            analysis_results: 分析结果列表，每个元素为(段落索引, 图片URL到索引的映射, 分析结果)
+        """
+        entries = {}
+        completed = 0
+        for paragraph_idx, image_url_to_index, understanding_results in analysis_results:
+            # 调用失败时不记录，重新运行时再次分析
+            if not isinstance(understanding_results, dict):
+                continue
+            for image_url, idx in image_url_to_index.items():
+                value = understanding_results.get(f"image{idx}")
+                if not isinstance(value, str):
+                    continue
+                completed += 1
+                entry_id = self._checkpoint_entry_ids.get((paragraph_idx, image_url))
+                if entry_id:
+                    entries[entry_id] = value
+        
+        save_checkpoint(self.md_s3_url, entries)
+        self.report_progress(completed)
+    
+    def report_progress(self, completed):
+        """
+        累加已完成分析的图片数量，并通过回调报告进度
+        
+        Args:
+            completed: 新完成分析的图片数量
+        """
+        with self._stats_lock:
+            self.image_progress['done'] = min(self.image_progress['done'] + completed, self.image_progress['total'])
+            done, total = self.image_progress['done'], self.image_progress['total']
+        if self.progress_callback and completed:
+            self.progress_callback(done, total)
+    
+    def lookup_cached_understanding(self, paragraph_info_list):
+        """
+        查询图片理解缓存
+        
+        Args:
+            paragraph_info_list: 段落信息列表，每个元素为(modified_context, image_info_list, paragraph_idx)
+            
+        Returns:
+            (缓存命中的分析结果列表, 仍需分析的段落信息列表, 未命中图片的缓存键字典)
+            缓存键字典以(段落索引, 图片URL)为键
+        """
+        cache = get_understanding_cache()
+        if cache is None:
+            return [], paragraph_info_list, {}
+        
+        cached_results = []
+        pending_paragraphs = []
+        cache_keys = {}
+        
+        for modified_context, image_info_list, paragraph_idx in paragraph_info_list:
+            pending_images = []
+            cached_understanding = {}
+            image_url_to_index = {}
+            
+            for image_info in image_info_list:
+                _, key, url, idx = image_info
+                cache_key = build_cache_key(key, modified_context)
+                value = cache.get(cache_key) if cache_key else None
+                
+                if value is None:
+                    if cache_key:
+                        cache_keys[(paragraph_idx, url)] = cache_key
+                    pending_images.append(image_info)
+                else:
+                    cached_understanding[f"image{idx}"] = value
+                    image_url_to_index[url] = idx
+            
+            if image_url_to_index:
+                cached_results.append((paragraph_idx, image_url_to_index, cached_understanding))
+            if pending_images:
+                pending_paragraphs.append((modified_context, pending_images, paragraph_idx))
+        
+        cached_count = sum(len(result[1]) for result in cached_results)
+        if cached_count:
+            logger.info(f"图片理解缓存命中 {cached_count} 张图片")
+        
+        return cached_results, pending_paragraphs, cache_keys
+    
+    def store_understanding_results(self, analysis_results, cache_keys):
+        """
+        将分析结果写入图片理解缓存
+        
+        Args:
+            analysis_results: 分析结果列表，每个元素为(段落索引, 图片URL到索引的映射, 分析结果)
+            cache_keys: 以(段落索引, 图片URL)为键的缓存键字典
+        """
+        cache = get_understanding_cache()
+        if cache is None or not cache_keys:
+            return
+        
+        for paragraph_idx, image_url_to_index, understanding_results in analysis_results:
+            # 调用失败时不缓存，下次重新分析
+            if not isinstance(understanding_results, dict):
+                continue
+            for image_url, idx in image_url_to_index.items():
+                cache_key = cache_keys.get((paragraph_idx, image_url))
+                value = understanding_results.get(f"image{idx}")
+                if cache_key and isinstance(value, str):
+                    cache.put(cache_key, value)
+    
+    def run_image_pipeline(self, paragraph_info_list):
+        """
+        以流式生产者/消费者方式下载并分析图片
+        
+        进程内共享的S3线程池按段落顺序下载图片，某段落的全部图片下载完成后即放入有界队列，
+        批次线程将相邻段落的图片装箱为批次，提交到进程内共享的Bedrock线程池分析，
+        使S3下载与Bedrock分析的延迟相互重叠；队列满或提交的批次达到上限时上游阻塞，限制内存中待分析图片的数量。
+        两个线程池按文档轮转调度，单个文档的在途任务数受配置限制，多个文档并发处理时公平共享。
+        
+        Args:
+            paragraph_info_list: 段落信息列表，每个元素为(modified_context, image_info_list, paragraph_idx)
+            
+        Returns:
+            分析结果列表，每个元素为(段落索引, 图片URL到索引的映射, 分析结果)
+        """
+        ready_queue = queue.Queue(maxsize=THREAD_POOL_CONFIG['PIPELINE_QUEUE_SIZE'])
+        # 已提交但尚未分析完成的批次上限：在途批次 + 等待队列
+        pending_batches = threading.BoundedSemaphore(
+            THREAD_POOL_CONFIG['BEDROCK_PER_DOCUMENT'] + THREAD_POOL_CONFIG['PIPELINE_QUEUE_SIZE']
+        )
+        analyze_futures = []
+        analysis_results = []
+        results_lock = threading.Lock()
+        
+        def analyze_batch(batch):
+            try:
+                results = self.analyze_batch_with_logging(batch)
+                # 每个批次完成后立即记录检查点，处理中断时已完成的批次不必重新分析
+                self.checkpoint_results(results)
+                with results_lock:
+                    analysis_results.extend(results)
+            finally:
+                pending_batches.release()
+        
+        def submit_batch(batch):
+            pending_batches.acquire()
+            analyze_futures.append(get_bedrock_executor().submit(self.md_s3_url, analyze_batch, batch))
+        
+        def batch_worker():
+            # 将就绪段落装箱为批次；队列暂时为空时最多等待LINGER_SECONDS再输出未装满的批次
+            planner = ImageBatchPlanner()
+            while True:
+                try:
+                    task = ready_queue.get(timeout=BATCH_CONFIG['LINGER_SECONDS'] if planner.pending else None)
+                except queue.Empty:
+                    submit_batch(planner.flush())
+                    continue
+                if task is None:
+                    if planner.pending:
+                        submit_batch(planner.flush())
+                    break
+                for section in split_analysis_task(task, planner.max_images):
+                    completed = planner.add(section)
+                    if completed:
+                        submit_batch(completed)
+        
+        batch_thread = threading.Thread(target=batch_worker, name="analyze-batcher", daemon=True)
+        batch_thread.start()
+        
+        try:
+            download_futures = []
+            for modified_context, image_info_list, paragraph_idx in paragraph_info_list:
+                state = _ParagraphDownloadState(modified_context, image_info_list, paragraph_idx)
+                for image_info in image_info_list:
+                    download_futures.append(get_s3_executor().submit(
+                        self.md_s3_url, self._download_into_paragraph, image_info, state, ready_queue
+                    ))
+            concurrent.futures.wait(download_futures)
         finally:
-            # 清理大型变量以帮助垃圾回收
-            del image_base64_list
+            # 通知批次线程结束，并等待已提交的批次分析完成
+            ready_queue.put(None)
+            batch_thread.join()
+            concurrent.futures.wait(analyze_futures)
+            # 归还未能释放的预留（如分析出错时仍在段落中的图片）
+            self._memory_lease.close()
+        
+        return analysis_results
+    
+    def _download_into_paragraph(self, image_info, state, ready_queue):
+        """
+        下载单个图片并登记到所属段落，段落图片全部下载完成后放入分析队列
+        
+        Args:
+            image_info: 图片信息 (bucket, key, url, idx)
+            state: 段落下载状态
+            ready_queue: 待分析段落队列
+        """
+        result = self.download_image_with_logging((image_info, state.paragraph_idx))
+        if result and not self._should_analyze_image(result, state.modified_context):
+            # 近似重复图片不再送去分析，释放图片数据及其内存预留
+            if not isinstance(result[2], S3ImageSource):
+                self._memory_lease.release(len(result[2][0]))
+            result = None
+        task = state.add_result(image_info, result)
+        if task is not None:
+            # 队列满时阻塞，形成背压
+            ready_queue.put(task)
+    
+    def _should_analyze_image(self, download_result, context_text):
+        """
+        计算已下载图片的感知哈希，判断是否需要送去分析
+        
+        与文档内已有图片近似重复时记录其代表图片，与跨文档索引中上下文相同的图片近似重复时直接复用理解内容
+        
+        Args:
+            download_result: download_image_with_logging的返回值
+            context_text: 图片所在段落发送给模型的上下文
+            
+        Returns:
+            bool: 图片是否需要送去分析
+        """
+        if self._image_clusters is None:
+            return True
+        
+        url, _, image, paragraph_idx = download_result
+        
+        # S3引用的图片没有本地数据，无法计算感知哈希
+        if isinstance(image, S3ImageSource):
+            return True
+        
+        image_hash = compute_dhash(image[0], DEDUP_CONFIG['HASH_SIZE'])
+        if image_hash is None:
+            return True
+        
+        representative_url = self._image_clusters.assign(image_hash, url, paragraph_idx)
+        if representative_url is not None:
+            with self._stats_lock:
+                self._duplicate_of[url] = representative_url
+            return False
+        
+        with self._stats_lock:
+            self._representative_contexts[url] = context_text
+        known_understanding = get_perceptual_hash_index().lookup(image_hash, context_text)
+        if known_understanding is not None:
+            with self._stats_lock:
+                self._known_understanding[url] = known_understanding
+            return False
+        
+        return True
+    
+    def resolve_duplicate_understanding(self, analyzed_by_url, total_paragraphs):
+        """
+        将代表图片的理解内容分发给近似重复的图片，并找出在大多数段落中重复出现的图片
+        
+        Args:
+            analyzed_by_url: 图片URL到理解内容的字典（包含空字符串结果），原地更新
+            total_paragraphs: 包含图片的段落总数
             
-            # 显式调用垃圾回收
-            gc.collect()
+        Returns:
+            需要丢弃的重复图片URL集合
+        """
+        if self._image_clusters is None:
+            return set()
+        
+        # 记录新分析得到非空结果的代表图片及其上下文，供后续文档中上下文相同的近似重复图片复用
+        phash_index = get_perceptual_hash_index()
+        for image_hash, representative_url in self._image_clusters.representative_hashes():
+            understanding = analyzed_by_url.get(representative_url)
+            if understanding and representative_url in self._representative_contexts:
+                phash_index.add(image_hash, self._representative_contexts[representative_url], understanding)
+        
+        analyzed_by_url.update(self._known_understanding)
+        for url, representative_url in self._duplicate_of.items():
+            if url not in analyzed_by_url and representative_url in analyzed_by_url:
+                analyzed_by_url[url] = analyzed_by_url[representative_url]
+        
+        repeated = self._image_clusters.repeated_clusters(
+            total_paragraphs,
+            DEDUP_CONFIG['REPEATED_RATIO'],
+            DEDUP_CONFIG['REPEATED_MIN_COUNT']
+        )
+        dropped_urls = set()
+        for urls in repeated.values():
+            dropped_urls.update(urls)
+        
+        logger.info(f"图片去重: {len(self._duplicate_of)} 张近似重复，{len(self._known_understanding)} 张复用已有结果，"
+                    f"{len(dropped_urls)} 张在多数段落重复出现")
+        return dropped_urls
     
     def add_image_understanding(self, md_content):
         """
@@ -281,8 +701,12 @@ class MarkdownImageEnhancer:
         Returns:
             添加图片理解后的Markdown内容
         """
-        # 提取包含图片的段落
-        paragraphs_with_images = extract_paragraphs_with_images(md_content)
+        # 提取包含图片的段落：有内容列表时每张图片只取前后最近的文本块，否则取图片所在的整个章节
+        if self.content_list and CONTENT_LIST_CONFIG['ENABLED']:
+            paragraphs_with_images, self.image_locations = build_image_contexts(self.content_list, md_content)
+            logger.info(f"按内容列表构建 {len(paragraphs_with_images)} 个图片上下文")
+        else:
+            paragraphs_with_images = extract_paragraphs_with_images(md_content)
         
         if not paragraphs_with_images:
             return md_content
@@ -293,23 +717,19 @@ class MarkdownImageEnhancer:
         # 步骤1：使用多线程提取所有段落中的图片信息
         extract_tasks = [(paragraph, image_urls, idx) for idx, (paragraph, image_urls) in enumerate(paragraphs_with_images)]
         
-        # 使用线程池并行提取图片信息
+        # 使用进程内共享的S3线程池并行提取图片信息
         paragraph_info_list = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_CONFIG['EXTRACT']) as executor:
-            # 提交所有提取任务
-            future_to_task = {
-                executor.submit(self.extract_image_info_with_logging, task): task
-                for task in extract_tasks
-            }
-            
-            # 收集结果
-            for future in concurrent.futures.as_completed(future_to_task):
-                try:
-                    modified_context, image_info_list, paragraph_idx = future.result()
-                    if image_info_list:  # 只添加有图片的段落
-                        paragraph_info_list.append((modified_context, image_info_list, paragraph_idx))
-                except Exception as e:
-                    logger.error(f"提取图片信息时出错: {str(e)}")
+        executor = get_s3_executor()
+        futures = [executor.submit(self.md_s3_url, self.extract_image_info_with_logging, task) for task in extract_tasks]
+        
+        # 收集结果
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                modified_context, image_info_list, paragraph_idx = future.result()
+                if image_info_list:  # 只添加有图片的段落
+                    paragraph_info_list.append((modified_context, image_info_list, paragraph_idx))
+            except Exception as e:
+                logger.error(f"提取图片信息时出错: {str(e)}")
         
         # 清理不再需要的变量
         del extract_tasks
@@ -318,144 +738,103 @@ class MarkdownImageEnhancer:
         if not paragraph_info_list:
             return md_content
         
-        # 步骤2：使用多线程下载所有图片
-        all_image_info = []
-        for modified_context, image_info_list, paragraph_idx in paragraph_info_list:
-            for image_info in image_info_list:
-                all_image_info.append((image_info, paragraph_idx))
-        
-        if not all_image_info:
-            return md_content
-        
-        # 使用线程池并行下载图片
-        image_download_results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_CONFIG['DOWNLOAD']) as executor:
-            # 分批提交下载任务，避免一次性加载过多图片
-            batch_size = IMAGE_CONFIG['MAX_BATCH_SIZE']
-            for i in range(0, len(all_image_info), batch_size):
-                batch = all_image_info[i:i+batch_size]
-                
-                # 提交当前批次的下载任务
-                future_to_task = {
-                    executor.submit(self.download_image_with_logging, task): task
-                    for task in batch
-                }
-                
-                # 收集当前批次的结果
-                for future in concurrent.futures.as_completed(future_to_task):
-                    try:
-                        result = future.result()
-                        if result:
-                            image_download_results.append(result)
-                    except Exception as e:
-                        logger.error(f"下载图片时出错: {str(e)}")
-                
-                # 在批次之间进行垃圾回收
-                gc.collect()
-        
-        # 清理不再需要的变量
-        del all_image_info
+        # 按文档顺序排列段落，使下载与分析按段落先后推进
+        paragraph_info_list.sort(key=lambda info: info[2])
+        total_paragraphs = len(paragraph_info_list)
+        self.image_progress['total'] = sum(len(info[1]) for info in paragraph_info_list)
         
-        if not image_download_results:
-            return md_content
+        # 读取检查点，上次处理中断前已完成分析的图片跳过下载和分析
+        restored_results, paragraph_info_list = self.restore_checkpoint(paragraph_info_list)
         
-        # 按段落组织下载结果
-        paragraph_analysis_info = {}
-        for url, idx, base64_image, paragraph_idx in image_download_results:
-            if paragraph_idx not in paragraph_analysis_info:
-                # 查找对应的段落信息
-                for modified_context, _, p_idx in paragraph_info_list:
-                    if p_idx == paragraph_idx:
-                        paragraph_analysis_info[paragraph_idx] = {
-                            'modified_context': modified_context,
-                            'image_base64_list': [],
-                            'image_url_to_index': {}
-                        }
-                        break
-            
-            # 添加图片信息
-            paragraph_analysis_info[paragraph_idx]['image_base64_list'].append(base64_image)
-            paragraph_analysis_info[paragraph_idx]['image_url_to_index'][url] = idx
+        # 查询图片理解缓存，命中缓存的图片跳过下载和分析
+        cached_results, paragraph_info_list, cache_keys = self.lookup_cached_understanding(paragraph_info_list)
         
-        # 清理不再需要的变量
-        del image_download_results
-        del paragraph_info_list
+        # 缓存命中的结果同样记录到检查点，并计入进度
+        self.checkpoint_results(cached_results)
+        cached_results.extend(restored_results)
+        self.report_progress(sum(len(result[1]) for result in restored_results))
+        del restored_results
         
-        if not paragraph_analysis_info:
-            return md_content
+        # 步骤2：流水线下载并分析图片，段落的图片下载完成后立即提交分析
+        analysis_results = self.run_image_pipeline(paragraph_info_list) if paragraph_info_list else []
         
-        # 步骤3：使用多线程分析图片
-        analysis_tasks = []
-        for paragraph_idx, info in paragraph_analysis_info.items():
-            if info['image_base64_list']:
-                analysis_tasks.append((
-                    info['modified_context'],
-                    info['image_base64_list'],
-                    info['image_url_to_index'],
-                    paragraph_idx
-                ))
-        
-        # 清理不再需要的变量
-        del paragraph_analysis_info
-        
-        if not analysis_tasks:
-            return md_content
+        downloaded_bytes = self.image_prep_stats['downloaded_bytes']
+        saved_bytes = downloaded_bytes - self.image_prep_stats['prepared_bytes']
+        logger.info(f"图片准备完成: 下载 {downloaded_bytes} 字节，发送 {self.image_prep_stats['prepared_bytes']} 字节，节省 {saved_bytes} 字节")
         
-        # 使用线程池并行分析图片
-        analysis_results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_CONFIG['ANALYZE']) as executor:
-            # 提交所有分析任务
-            future_to_task = {
-                executor.submit(self.analyze_images_with_logging, task): task
-                for task in analysis_tasks
-            }
-            
-            # 收集结果
-            for future in concurrent.futures.as_completed(future_to_task):
-                try:
-                    result = future.result()
-                    if result:
-                        analysis_results.append(result)
-                except Exception as e:
-                    logger.error(f"分析图片时出错: {str(e)}")
+        # 写入新的分析结果到缓存，并合并缓存命中的结果
+        self.store_understanding_results(analysis_results, cache_keys)
+        analysis_results.extend(cached_results)
         
         # 清理不再需要的变量
-        del analysis_tasks
-        
-        if not analysis_results:
-            return md_content
+        del paragraph_info_list
+        del cached_results
         
-        # 处理分析结果，更新Markdown内容
+        # 汇总每个图片URL的分析结果（包括无有效信息的空结果）
+        analyzed_by_url = {}
         for paragraph_idx, image_url_to_index, understanding_results in analysis_results:
             # 处理每个图片的分析结果
             for image_url, idx in image_url_to_index.items():
                 image_key = f"image{idx}"
                 
-                # 获取当前图片的分析结果
-                image_understanding = ""
-                if isinstance(understanding_results, dict) and image_key in understanding_results:
-                    image_understanding = understanding_results.get(image_key, "")
-                
-                # 如果分析结果为空，跳过此图片
-                if not image_understanding:
+                # 跳过没有分析结果的图片
+                if not isinstance(understanding_results, dict) or image_key not in understanding_results:
                     continue
                 
-                # 在图片引用后添加理解内容
-                pattern = f'!\\[(.*?)\\]\\({re.escape(image_url)}\\)'
-                # 转义图片解析内容中的特殊字符，避免正则表达式错误
-                safe_understanding = image_understanding.replace('\\', '\\\\')
-                replacement = f'![\\1]({image_url})\n\n*图片解析：{safe_understanding}*'
-                
-                new_md_content = re.sub(pattern, replacement, new_md_content)
+                # 同一图片多次出现时保留非空结果
+                image_understanding = understanding_results.get(image_key) or ""
+                if image_understanding or image_url not in analyzed_by_url:
+                    analyzed_by_url[image_url] = image_understanding
         
         # 清理不再需要的变量
         del analysis_results
         
-        # 最终垃圾回收
-        gc.collect()
+        # 近似重复图片复用代表图片的理解内容，多数段落重复出现的图片不添加理解内容
+        dropped_urls = self.resolve_duplicate_understanding(analyzed_by_url, total_paragraphs)
+        remove_dropped = DEDUP_CONFIG['DROP_REPEATED_REFERENCES']
+        
+        # 单次扫描记录插入位置，在图片引用后添加理解内容
+        edits = []
+        for match in re.finditer(r'!\[(.*?)\]\((.*?)\)', new_md_content):
+            image_url = match.group(2)
+            if image_url in dropped_urls:
+                if remove_dropped:
+                    edits.append((match.start(), match.end(), ""))
+                continue
+            image_understanding = analyzed_by_url.get(image_url)
+            if image_understanding:
+                edits.append((match.end(), match.end(), self.format_image_understanding(image_url, image_understanding)))
+        
+        new_md_content = splice_markdown(new_md_content, edits)
+        
+        # 近似重复图片复用已有结果，在去重完成后计入进度
+        self.report_progress(len(self._duplicate_of) + len(self._known_understanding))
         
         return new_md_content
     
+    def format_image_understanding(self, image_url, image_understanding):
+        """
+        生成插入到图片引用后的理解内容，按内容列表定位到的图片附带所在页码和边界框
+        
+        Args:
+            image_url: 图片URL
+            image_understanding: 图片理解内容
+            
+        Returns:
+            插入Markdown的文本
+        """
+        location = self.image_locations.get(image_url) or {}
+        page_idx = location.get('page_idx')
+        if page_idx is None:
+            return f'\n\n*图片解析：{image_understanding}*'
+        
+        # 页码从1开始计数，边界框为MinerU页面坐标(x0, y0, x1, y1)
+        position = f"第{page_idx + 1}页"
+        bbox = location.get('bbox')
+        if bbox:
+            position += f"，位置[{', '.join(str(round(v)) for v in bbox)}]"
+        return f'\n\n*图片解析（{position}）：{image_understanding}*'
+    
     def enhance(self):
         """
         增强Markdown文件，包括更新图片引用和添加图片理解内容
@@ -91,3 +91,30 @@ def get_image_path_from_md_path(md_s3_url):
     image_dir = f"{md_dir}/images"
     
     return f"s3://{bucket}/{image_dir}"
+
+def splice_markdown(md_content, edits):
+    """
+    按编辑列表一次性重建Markdown内容，避免逐个替换带来的重复字符串拷贝
+    
+    Args:
+        md_content: 原始Markdown内容
+        edits: 编辑列表，每个元素为(start, end, replacement)，区间基于原始内容且互不重叠
+        
+    Returns:
+        重建后的Markdown内容
+    """
+    if not edits:
+        return md_content
+    
+    parts = []
+    cursor = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+        if start < cursor:
+            logger.warning(f"忽略重叠的编辑区间: ({start}, {end})")
+            continue
+        parts.append(md_content[cursor:start])
+        parts.append(replacement)
+        cursor = end
+    parts.append(md_content[cursor:])
+    
+    return ''.join(parts)
@@ -0,0 +1,223 @@
+"""
+解析调试文件服务模块，由保存在S3上的中间结果渲染布局和span标注PDF，在低优先级后台线程中执行并上传S3
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import tempfile
+import threading
+from functools import lru_cache
+from magic_pdf.libs.draw_bbox import draw_layout_bbox, draw_span_bbox
+from aws.s3_utils import download_s3_object, upload_s3_object, delete_expired_objects
+from config import DEBUG_ARTIFACT_CONFIG, FILE_PROCESSING
+
+logger = logging.getLogger(__name__)
+
+# 调试文件类型 -> 绘制函数，参数为(pdf_info, PDF数据, 输出目录, 文件名)
+# 模型检测结果（draw_model）不在中间结果中，无法在解析完成后渲染
+_ARTIFACT_DRAWERS = {
+    'layout': draw_layout_bbox,
+    'span': draw_span_bbox
+}
+
+# 旧版本在解析过程中写入本地输出目录的调试文件后缀
+_LOCAL_ARTIFACT_SUFFIXES = ('_model.pdf', '_layout.pdf', '_spans.pdf')
+
+def get_artifact_key(md_file_path, kind):
+    """
+    获取调试文件的S3对象键，目录结构与Markdown输出一致
+    
+    Args:
+        md_file_path: Markdown文件的S3对象键
+        kind: 调试文件类型
+        
+    Returns:
+        调试文件的S3对象键
+    """
+    relative_path = md_file_path
+    if relative_path.startswith(FILE_PROCESSING['S3_OUTPUT_PREFIX']):
+        relative_path = relative_path[len(FILE_PROCESSING['S3_OUTPUT_PREFIX']):]
+    return f"{DEBUG_ARTIFACT_CONFIG['S3_PREFIX']}{os.path.splitext(relative_path)[0]}_{kind}.pdf"
+
+def render_debug_artifacts(bucket_name, pdf_key, md_file_path, kinds):
+    """
+    读取PDF和保存的中间结果，渲染调试文件并上传S3，本地文件写入临时目录并在完成后删除
+    
+    Args:
+        bucket_name: S3桶名
+        pdf_key: PDF文件的S3对象键
+        md_file_path: Markdown文件的S3对象键，中间结果保存在同一目录
+        kinds: 调试文件类型列表
+        
+    Returns:
+        已上传的调试文件S3对象键列表
+    """
+    middle_json = download_s3_object(bucket_name, f"{os.path.splitext(md_file_path)[0]}_middle.json")
+    if not middle_json:
+        logger.error(f"找不到 {md_file_path} 的中间结果，无法生成调试文件")
+        return []
+    pdf_info = json.loads(middle_json).get('pdf_info', [])
+    del middle_json
+    
+    pdf_bytes = download_s3_object(bucket_name, pdf_key)
+    if not pdf_bytes:
+        logger.error(f"无法读取PDF文件 s3://{bucket_name}/{pdf_key}")
+        return []
+    
+    uploaded = []
+    with tempfile.TemporaryDirectory(prefix='mineru-artifacts-') as local_dir:
+        for kind in kinds:
+            file_name = f"{kind}.pdf"
+            try:
+                _ARTIFACT_DRAWERS[kind](pdf_info, pdf_bytes, local_dir, file_name)
+                with open(os.path.join(local_dir, file_name), 'rb') as f:
+                    content = f.read()
+            except Exception as e:
+                logger.error(f"生成 {kind} 调试文件失败: {str(e)}")
+                continue
+            
+            artifact_key = get_artifact_key(md_file_path, kind)
+            if upload_s3_object(content, bucket_name, artifact_key, content_type='application/pdf'):
+                uploaded.append(artifact_key)
+    
+    return uploaded
+
+def cleanup_local_artifacts():
+    """
+    删除旧版本在解析过程中写入本地输出目录的调试文件
+    
+    Returns:
+        删除的文件数
+    """
+    local_dir = FILE_PROCESSING['LOCAL_OUTPUT_DIR']
+    if not os.path.isdir(local_dir):
+        return 0
+    
+    removed = 0
+    for file_name in os.listdir(local_dir):
+        if not file_name.endswith(_LOCAL_ARTIFACT_SUFFIXES):
+            continue
+        try:
+            os.remove(os.path.join(local_dir, file_name))
+            removed += 1
+        except OSError as e:
+            logger.warning(f"删除本地调试文件 {file_name} 失败: {str(e)}")
+    
+    if removed:
+        logger.info(f"已删除 {removed} 个本地调试文件")
+    return removed
+
+class ArtifactRenderer:
+    """调试文件渲染器：有界等待队列 + 低优先级的后台线程，渲染完成后按保留期限清理S3上的过期文件"""
+    
+    def __init__(self, workers, queue_size, nice=0):
+        """
+        初始化渲染器并启动后台线程
+        
+        Args:
+            workers: 渲染线程数
+            queue_size: 等待渲染的请求上限
+            nice: 渲染线程的nice增量
+        """
+        self.nice = nice
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._last_cleanup = {}  # 桶名 -> 上次清理时间
+        self._rendered = 0
+        self._failed = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"artifact-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, bucket_name, pdf_key, md_file_path, kinds=None):
+        """
+        提交渲染请求
+        
+        Args:
+            bucket_name: S3桶名
+            pdf_key: PDF文件的S3对象键
+            md_file_path: Markdown文件的S3对象键
+            kinds: 调试文件类型列表，默认取配置
+        
+        Returns:
+            渲染完成后调试文件的S3对象键列表；队列已满时返回None
+        """
+        kinds = [kind for kind in (kinds or DEBUG_ARTIFACT_CONFIG['KINDS']) if kind in _ARTIFACT_DRAWERS]
+        try:
+            self._queue.put_nowait((bucket_name, pdf_key, md_file_path, kinds))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            logger.warning(f"调试文件渲染队列已满，跳过 {md_file_path}")
+            return None
+        return [get_artifact_key(md_file_path, kind) for kind in kinds]
+    
+    def metrics(self):
+        """
+        获取渲染器指标
+        
+        Returns:
+            包含排队请求数、已渲染数、失败数和丢弃数的字典
+        """
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'rendered': self._rendered,
+                'failed': self._failed,
+                'dropped': self._dropped
+            }
+    
+    def _lower_priority(self):
+        """降低当前线程的调度优先级（Linux下nice值按线程生效）"""
+        if not self.nice:
+            return
+        try:
+            thread_id = threading.get_native_id()
+            os.setpriority(os.PRIO_PROCESS, thread_id, os.getpriority(os.PRIO_PROCESS, thread_id) + self.nice)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"无法降低调试文件渲染线程的优先级: {str(e)}")
+    
+    def _worker(self):
+        self._lower_priority()
+        while True:
+            bucket_name, pdf_key, md_file_path, kinds = self._queue.get()
+            try:
+                uploaded = render_debug_artifacts(bucket_name, pdf_key, md_file_path, kinds)
+                logger.info(f"已生成 {md_file_path} 的调试文件: {uploaded}")
+            except Exception as e:
+                logger.error(f"生成调试文件时出错: {str(e)}")
+                uploaded = []
+            with self._lock:
+                if uploaded:
+                    self._rendered += 1
+                else:
+                    self._failed += 1
+            self._cleanup_expired(bucket_name)
+    
+    def _cleanup_expired(self, bucket_name):
+        """按最小间隔清理桶中超过保留期限的调试文件"""
+        retention_days = DEBUG_ARTIFACT_CONFIG['RETENTION_DAYS']
+        if not retention_days:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup.get(bucket_name, 0) < DEBUG_ARTIFACT_CONFIG['CLEANUP_INTERVAL_SECONDS']:
+                return
+            self._last_cleanup[bucket_name] = now
+        delete_expired_objects(bucket_name, DEBUG_ARTIFACT_CONFIG['S3_PREFIX'], retention_days * 86400)
+
+@lru_cache(maxsize=1)
+def get_artifact_renderer():
+    """获取进程内共享的调试文件渲染器"""
+    return ArtifactRenderer(
+        workers=DEBUG_ARTIFACT_CONFIG['WORKERS'],
+        queue_size=DEBUG_ARTIFACT_CONFIG['QUEUE_SIZE'],
+        nice=DEBUG_ARTIFACT_CONFIG['NICE']
+    )
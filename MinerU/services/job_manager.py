@@ -0,0 +1,630 @@
+"""
+异步任务管理模块，任务在后台依次经过多个阶段，各阶段由独立的执行器处理；
+按估算成本将任务分配到不同车道，车道内最短任务优先，可选持久化未结束的任务
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+# 服务重启后恢复的任务缺少未持久化的凭证，等待调用方重新提供后继续执行
+JOB_AWAITING_CREDENTIALS = 'awaiting_credentials'
+
+# 不写入持久化存储的任务参数（访问凭证），服务重启后由调用方重新提供
+CREDENTIAL_PARAMS = ('ak', 'sk')
+
+# 阶段处理函数返回该值时任务直接成功结束，不再执行后续阶段（如复用了已有输出）
+STAGE_COMPLETED = 'completed'
+
+# 每个车道用于统计排队时间的最近任务数
+_QUEUE_WAIT_WINDOW = 100
+
+def redact_credentials(params):
+    """
+    去除任务参数中的访问凭证，并在_redacted中记录被去除的参数名
+    
+    Args:
+        params: 任务参数
+        
+    Returns:
+        去除凭证后的参数副本
+    """
+    redacted = set(params.get('_redacted', []))
+    stored = {}
+    for name, value in params.items():
+        if name in CREDENTIAL_PARAMS:
+            redacted.add(name)
+        elif name != '_redacted':
+            stored[name] = value
+    if redacted:
+        stored['_redacted'] = sorted(redacted)
+    return stored
+
+class _SQLiteJobStore:
+    """任务持久化存储，保存未结束任务的参数（不含访问凭证）和状态，服务重启后恢复"""
+    
+    def __init__(self, path):
+        """
+        初始化任务存储
+        
+        Args:
+            path: SQLite文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, params TEXT NOT NULL, record TEXT NOT NULL, "
+                "status TEXT NOT NULL, created_at TEXT NOT NULL)"
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def save(self, job, params):
+        """
+        保存任务记录，任务参数中的访问凭证不写入文件
+        
+        Args:
+            job: 任务记录
+            params: 任务参数
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, params, record, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job['job_id'], json.dumps(redact_credentials(params)), json.dumps(job, ensure_ascii=False), job['status'], job['created_at'])
+            )
+    
+    def delete(self, job_id):
+        """删除任务记录"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+    
+    def load(self):
+        """
+        读取所有任务记录
+        
+        Returns:
+            按创建时间排序的(任务记录, 任务参数)列表
+        """
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT record, params FROM jobs ORDER BY created_at").fetchall()
+        return [(json.loads(record), json.loads(params)) for record, params in rows]
+
+class _LaneQueue:
+    """
+    单个车道的等待队列：按估算成本从小到大出队（最短任务优先），
+    等待超过老化时间的任务按入队顺序优先出队，避免成本较大的任务一直等待
+    """
+    
+    def __init__(self, aging_seconds):
+        """
+        初始化等待队列
+        
+        Args:
+            aging_seconds: 老化时间（秒），0表示不老化
+        """
+        self.aging_seconds = aging_seconds
+        self._items = []  # (成本, 入队序号, 入队时间, 任务ID, 是否占用移交名额)
+        self._seq = 0
+        self._cond = threading.Condition()
+    
+    def put(self, job_id, cost, holds_slot):
+        """
+        放入任务
+        
+        Args:
+            job_id: 任务ID
+            cost: 估算成本
+            holds_slot: 是否占用移交名额
+        """
+        with self._cond:
+            self._seq += 1
+            self._items.append((cost, self._seq, time.time(), job_id, holds_slot))
+            self._cond.notify()
+    
+    def get(self):
+        """
+        取出下一个任务，队列为空时阻塞等待
+        
+        Returns:
+            (任务ID, 是否占用移交名额, 排队时间)
+        """
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            now = time.time()
+            aged = [item for item in self._items if self.aging_seconds and now - item[2] >= self.aging_seconds]
+            item = min(aged, key=lambda item: item[1]) if aged else min(self._items)
+            self._items.remove(item)
+            return item[3], item[4], now - item[2]
+    
+    def qsize(self):
+        """等待中的任务数"""
+        with self._cond:
+            return len(self._items)
+
+class _StageExecutor:
+    """
+    单个处理阶段的执行器：每个车道有独立的等待队列和固定数量的工作线程，
+    车道内按估算成本最短任务优先，统计各车道的队列深度、排队时间和线程利用率
+    """
+    
+    def __init__(self, name, lanes, queue_size, run_stage, aging_seconds=0):
+        """
+        初始化阶段执行器并启动工作线程
+        
+        Args:
+            name: 阶段名称
+            lanes: 车道名称到工作线程数的字典
+            queue_size: 每个车道上一阶段移交的等待任务上限，0表示不限制；达到上限时上一阶段的线程阻塞等待，形成背压
+            run_stage: 执行函数，参数为(阶段名称, 任务ID)
+            aging_seconds: 车道内任务的老化时间（秒），超过后不再按成本排序
+        """
+        self.name = name
+        self.queue_size = queue_size
+        self._run_stage = run_stage
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._lanes = {}
+        for lane, workers in lanes.items():
+            self._lanes[lane] = {
+                'workers': workers,
+                # 新提交的任务由JobManager按排队上限准入，不占用移交名额
+                'queue': _LaneQueue(aging_seconds),
+                'handoff_slots': threading.BoundedSemaphore(queue_size) if queue_size else None,
+                'busy': 0,
+                'busy_seconds': 0.0,
+                'task_started': {},  # 工作线程ID -> 当前任务开始时间
+                'processed': 0,
+                'queue_waits': deque(maxlen=_QUEUE_WAIT_WINDOW)
+            }
+        self._threads = [
+            threading.Thread(target=self._worker, args=(lane,), name=f"job-{name}-{lane}-{i}", daemon=True)
+            for lane, workers in lanes.items()
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def put(self, job_id, lane, cost, handoff=True):
+        """
+        将任务放入车道的等待队列
+        
+        Args:
+            job_id: 任务ID
+            lane: 车道名称
+            cost: 估算成本，车道内成本小的任务先执行
+            handoff: 是否为上一阶段移交的任务，是时在移交名额用完后阻塞等待
+        """
+        state = self._lanes[lane]
+        holds_slot = handoff and state['handoff_slots'] is not None
+        if holds_slot:
+            state['handoff_slots'].acquire()
+        state['queue'].put(job_id, cost, holds_slot)
+    
+    def qsize(self):
+        """所有车道等待队列中的任务数"""
+        return sum(state['queue'].qsize() for state in self._lanes.values())
+    
+    def _worker(self, lane):
+        state = self._lanes[lane]
+        thread_id = threading.get_ident()
+        while True:
+            job_id, holds_slot, queue_wait = state['queue'].get()
+            if holds_slot:
+                state['handoff_slots'].release()
+            with self._lock:
+                state['busy'] += 1
+                state['task_started'][thread_id] = time.time()
+                state['queue_waits'].append(queue_wait)
+            try:
+                self._run_stage(self.name, job_id)
+            except Exception as e:
+                logger.error(f"执行任务 {job_id} 的 {self.name} 阶段时出错: {str(e)}")
+            finally:
+                with self._lock:
+                    state['busy'] -= 1
+                    state['busy_seconds'] += time.time() - state['task_started'].pop(thread_id)
+                    state['processed'] += 1
+    
+    def metrics(self):
+        """
+        获取阶段指标
+        
+        Returns:
+            包含排队任务数、忙碌线程数、已处理任务数和线程利用率，以及每个车道的上述指标和最近排队时间的字典
+        """
+        with self._lock:
+            now = time.time()
+            lanes = {}
+            for lane, state in self._lanes.items():
+                busy_seconds = state['busy_seconds'] + sum(now - started for started in state['task_started'].values())
+                capacity = (now - self._started_at) * state['workers']
+                waits = state['queue_waits']
+                lanes[lane] = {
+                    'queued': state['queue'].qsize(),
+                    'workers': state['workers'],
+                    'busy': state['busy'],
+                    'processed': state['processed'],
+                    'utilization': busy_seconds / capacity if capacity > 0 else 0.0,
+                    'queue_wait_avg': sum(waits) / len(waits) if waits else 0.0,
+                    'queue_wait_max': max(waits) if waits else 0.0
+                }
+        
+        workers = sum(lane['workers'] for lane in lanes.values())
+        return {
+            'queued': sum(lane['queued'] for lane in lanes.values()),
+            'queue_size': self.queue_size,
+            'workers': workers,
+            'busy': sum(lane['busy'] for lane in lanes.values()),
+            'processed': sum(lane['processed'] for lane in lanes.values()),
+            'utilization': sum(lane['utilization'] * lane['workers'] for lane in lanes.values()) / workers if workers else 0.0,
+            'lanes': lanes
+        }
+
+class JobManager:
+    """
+    异步任务管理器：任务依次经过各处理阶段，每个阶段有独立的执行器，
+    不同文档的阶段可以重叠执行（文档A增强时文档B解析），各阶段的线程数按瓶颈分别配置；
+    任务提交时估算成本并确定车道，各阶段按车道分配线程，大文档不会占用小文档的处理线程
+    """
+    
+    def __init__(self, handlers, stages, queue_size, max_finished_jobs, state_path=None,
+                 probes=None, lanes=None, aging_seconds=0, finalizers=None):
+        """
+        初始化任务管理器
+        
+        Args:
+            handlers: 任务类型到阶段列表的字典，阶段列表的元素为(阶段名称, 处理函数)，
+                处理函数参数为(任务参数, 阶段间共享的上下文字典, 进度回调)，返回是否继续后续阶段，
+                返回STAGE_COMPLETED时任务成功结束
+            stages: 阶段名称到(车道名称到工作线程数的字典, 每个车道上一阶段移交的等待任务上限)的字典
+            queue_size: 尚未开始处理的排队任务上限
+            max_finished_jobs: 保留的已结束任务记录数
+            state_path: 任务持久化SQLite文件路径，为None时仅保存在内存中
+            probes: 任务类型到探测函数的字典，探测函数参数为任务参数，返回包含估算成本cost的字典，失败时返回None
+            lanes: 按顺序排列的车道名称到估算成本上限的字典，任务进入第一个上限不小于其成本的车道，
+                None表示不限；成本未知的任务进入最后一个车道。默认只有一个default车道
+            aging_seconds: 车道内任务的老化时间（秒），超过后按入队顺序执行
+            finalizers: 任务类型到结束函数的字典，结束函数参数为任务参数，任务成功或失败后调用（如释放文件租约）
+        """
+        self.handlers = handlers
+        self.probes = probes or {}
+        self.finalizers = finalizers or {}
+        self.lanes = lanes or {'default': None}
+        self.queue_size = queue_size
+        self.max_finished_jobs = max_finished_jobs
+        self._store = _SQLiteJobStore(state_path) if state_path else None
+        self._jobs = {}  # 任务ID -> 任务记录
+        self._params = {}  # 未结束任务的任务ID -> 任务参数
+        self._contexts = {}  # 运行中任务ID -> 阶段间共享的上下文（解析结果等内存数据）
+        self._finished = OrderedDict()  # 按结束顺序排列的已结束任务ID
+        self._stage_started = {}  # 正在执行阶段的任务ID -> 阶段开始时间
+        self._queued = 0  # 尚未开始第一个阶段的任务数
+        self._running = 0
+        self._lock = threading.Lock()
+        
+        self._executors = {
+            name: _StageExecutor(name, lane_workers, stage_queue_size, self._run_stage, aging_seconds)
+            for name, (lane_workers, stage_queue_size) in stages.items()
+        }
+        
+        if self._store:
+            self._recover()
+    
+    def _recover(self):
+        """
+        恢复持久化的任务，上次服务停止时未结束的任务从第一个阶段重新排队；
+        参数中的访问凭证没有持久化，这类任务等待调用方通过resume重新提供凭证
+        """
+        for job, params in self._store.load():
+            if job['status'] in (JOB_SUCCEEDED, JOB_FAILED):
+                self._jobs[job['job_id']] = job
+                self._finished[job['job_id']] = None
+                continue
+            if params.get('_redacted'):
+                job.update(status=JOB_AWAITING_CREDENTIALS, stage=JOB_AWAITING_CREDENTIALS, started_at=None, timings={})
+                self._jobs[job['job_id']] = job
+                self._params[job['job_id']] = params
+                self._persist(job['job_id'])
+                logger.info(f"任务 {job['job_id']} 等待重新提供凭证: {', '.join(params['_redacted'])}")
+                continue
+            job.update(status=JOB_QUEUED, stage=JOB_QUEUED, started_at=None, timings={})
+            job['_enqueued_at'] = time.time()
+            self._jobs[job['job_id']] = job
+            self._params[job['job_id']] = params
+            self._queued += 1
+            if job.get('lane') not in self.lanes:
+                job['lane'] = self._select_lane(job.get('cost'))
+            self._put(job, self.handlers[job['type']][0][0], handoff=False)
+            logger.info(f"恢复未完成的任务 {job['job_id']}")
+        self._evict_finished()
+    
+    def _select_lane(self, cost):
+        """
+        根据估算成本选择车道
+        
+        Args:
+            cost: 估算成本，未知时为None
+        
+        Returns:
+            车道名称
+        """
+        lane_names = list(self.lanes)
+        if cost is None:
+            return lane_names[-1]
+        for lane in lane_names:
+            max_cost = self.lanes[lane]
+            if max_cost is None or cost <= max_cost:
+                return lane
+        return lane_names[-1]
+    
+    def _probe(self, job_type, params):
+        """
+        探测任务的页数和文件大小等元数据
+        
+        Returns:
+            元数据字典；没有探测函数或探测失败时返回None
+        """
+        probe = self.probes.get(job_type)
+        if probe is None:
+            return None
+        try:
+            return probe(params)
+        except Exception as e:
+            logger.warning(f"探测 {job_type} 任务元数据失败: {str(e)}")
+            return None
+    
+    def _put(self, job, stage_name, handoff=True):
+        """将任务放入阶段执行器中所属车道的等待队列，成本未知的任务排在车道最后"""
+        cost = job.get('cost')
+        self._executors[stage_name].put(job['job_id'], job['lane'], float('inf') if cost is None else cost, handoff)
+    
+    def _persist(self, job_id):
+        """持久化任务记录，调用方需持有锁"""
+        if self._store is None:
+            return
+        try:
+            self._store.save(self._jobs[job_id], self._params.get(job_id, {}))
+        except Exception as e:
+            logger.error(f"保存任务记录失败: {str(e)}")
+    
+    def submit(self, job_type, params):
+        """
+        提交任务
+        
+        Args:
+            job_type: 任务类型
+            params: 任务参数
+        
+        Returns:
+            任务ID；排队任务已满时返回None
+        """
+        with self._lock:
+            if self._queued >= self.queue_size:
+                return None
+        
+        # 在获取锁之外探测元数据，只读取对象大小和文件头尾的少量数据
+        estimate = self._probe(job_type, params)
+        cost = estimate.get('cost') if estimate else None
+        lane = self._select_lane(cost)
+        
+        with self._lock:
+            if self._queued >= self.queue_size:
+                return None
+            
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'type': job_type,
+                'status': JOB_QUEUED,
+                'stage': JOB_QUEUED,
+                'lane': lane,
+                'cost': cost,
+                'estimate': estimate,
+                'progress': {'done': 0, 'total': 0},
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'timings': {},
+                'error': None,
+                '_enqueued_at': time.time()
+            }
+            self._params[job_id] = params
+            self._queued += 1
+            self._persist(job_id)
+            job = self._jobs[job_id]
+        
+        self._put(job, self.handlers[job_type][0][0], handoff=False)
+        logger.info(f"已提交 {job_type} 任务 {job_id}，估算成本: {cost}，车道: {lane}")
+        return job_id
+    
+    def resume(self, job_id, credentials):
+        """
+        为服务重启后等待凭证的任务重新提供凭证，任务从第一个阶段重新排队
+        
+        Args:
+            job_id: 任务ID
+            credentials: 凭证参数字典，需包含任务恢复时缺少的全部参数
+        
+        Returns:
+            是否已重新排队；任务不存在、不在等待凭证状态或凭证不完整时返回False
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != JOB_AWAITING_CREDENTIALS:
+                return False
+            params = self._params[job_id]
+            missing = [name for name in params['_redacted'] if not credentials.get(name)]
+            if missing:
+                logger.warning(f"任务 {job_id} 缺少凭证: {', '.join(missing)}")
+                return False
+            
+            params = {name: value for name, value in params.items() if name != '_redacted'}
+            params.update({name: credentials[name] for name in self._params[job_id]['_redacted']})
+            self._params[job_id] = params
+            job.update(status=JOB_QUEUED, stage=JOB_QUEUED)
+            job['_enqueued_at'] = time.time()
+            self._queued += 1
+            if job.get('lane') not in self.lanes:
+                job['lane'] = self._select_lane(job.get('cost'))
+            self._persist(job_id)
+        
+        self._put(job, self.handlers[job['type']][0][0], handoff=False)
+        logger.info(f"任务 {job_id} 已重新提供凭证，重新排队")
+        return True
+    
+    def get(self, job_id):
+        """
+        查询任务状态
+        
+        Args:
+            job_id: 任务ID
+        
+        Returns:
+            任务记录的副本；任务不存在时返回None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            result = {name: value for name, value in job.items() if not name.startswith('_')}
+            result['progress'] = dict(job['progress'])
+            result['timings'] = dict(job['timings'])
+            
+            # 当前阶段与排队阶段按已经过的时间报告
+            now = time.time()
+            if job['status'] == JOB_QUEUED:
+                result['timings']['queue_wait'] = now - job['_enqueued_at']
+            elif job['status'] == JOB_RUNNING and job_id in self._stage_started:
+                result['timings'][job['stage']] = now - self._stage_started[job_id]
+            elif job['status'] == JOB_RUNNING:
+                result['timings'][f"{job['stage']}_queue_wait"] = now - job['_enqueued_at']
+            return result
+    
+    def metrics(self):
+        """
+        获取任务队列指标
+        
+        Returns:
+            包含排队任务数、运行中任务数，以及每个阶段的队列深度和线程利用率的字典
+        """
+        with self._lock:
+            result = {
+                'queued': self._queued,
+                'queue_size': self.queue_size,
+                'running': self._running,
+                'jobs': len(self._jobs)
+            }
+        result['stages'] = {name: executor.metrics() for name, executor in self._executors.items()}
+        return result
+    
+    def _set_progress(self, job_id, done, total):
+        """更新任务进度"""
+        with self._lock:
+            self._jobs[job_id]['progress'] = {'done': done, 'total': total}
+    
+    def _run_stage(self, stage_name, job_id):
+        """在阶段执行器的线程中执行任务的一个阶段，成功后交给下一阶段的执行器"""
+        now = time.time()
+        with self._lock:
+            job = self._jobs[job_id]
+            params = self._params[job_id]
+            if job['status'] == JOB_QUEUED:
+                job['status'] = JOB_RUNNING
+                job['started_at'] = datetime.now().isoformat()
+                job['timings']['queue_wait'] = now - job['_enqueued_at']
+                job['_started_at'] = now
+                self._queued -= 1
+                self._running += 1
+                self._contexts[job_id] = {}
+            else:
+                job['timings'][f"{stage_name}_queue_wait"] = now - job['_enqueued_at']
+            job['stage'] = stage_name
+            self._stage_started[job_id] = now
+            context = self._contexts[job_id]
+            self._persist(job_id)
+        
+        stages = self.handlers[job['type']]
+        stage_names = [name for name, _ in stages]
+        handler = stages[stage_names.index(stage_name)][1]
+        
+        error = None
+        result = None
+        try:
+            result = handler(params, context, lambda done, total: self._set_progress(job_id, done, total))
+            if not result:
+                error = 'processing failed'
+        except Exception as e:
+            logger.error(f"执行任务 {job_id} 的 {stage_name} 阶段时出错: {str(e)}")
+            error = str(e)
+        
+        with self._lock:
+            job['timings'][stage_name] = time.time() - self._stage_started.pop(job_id)
+        
+        next_index = stage_names.index(stage_name) + 1
+        if error is None and result != STAGE_COMPLETED and next_index < len(stages):
+            next_stage = stage_names[next_index]
+            with self._lock:
+                job['stage'] = next_stage
+                job['_enqueued_at'] = time.time()
+                self._persist(job_id)
+            # 下一阶段移交名额用完时阻塞当前阶段的线程，形成背压
+            self._put(job, next_stage)
+            return
+        
+        self._finish_job(job_id, error)
+    
+    def _finish_job(self, job_id, error):
+        """记录任务结束状态并释放阶段间的上下文"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job['status'] = JOB_SUCCEEDED if error is None else JOB_FAILED
+            job['stage'] = job['status']
+            job['error'] = error
+            job['finished_at'] = datetime.now().isoformat()
+            job['timings']['total'] = time.time() - job.pop('_started_at')
+            self._contexts.pop(job_id, None)
+            params = self._params.pop(job_id, None)
+            self._running -= 1
+            self._persist(job_id)
+            self._finished[job_id] = None
+            self._evict_finished()
+        
+        finalizer = self.finalizers.get(job['type'])
+        if finalizer and params is not None:
+            try:
+                finalizer(params)
+            except Exception as e:
+                logger.error(f"结束任务 {job_id} 时出错: {str(e)}")
+        
+        logger.info(f"任务 {job_id} 结束，状态: {job['status']}")
+    
+    def _evict_finished(self):
+        """淘汰最早结束的任务记录，调用方需持有锁（或在初始化阶段调用）"""
+        while len(self._finished) > self.max_finished_jobs:
+            job_id, _ = self._finished.popitem(last=False)
+            self._jobs.pop(job_id, None)
+            if self._store:
+                try:
+                    self._store.delete(job_id)
+                except Exception as e:
+                    logger.error(f"删除任务记录失败: {str(e)}")
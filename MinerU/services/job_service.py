@@ -0,0 +1,127 @@
+"""
+异步任务服务模块，API请求提交任务后立即返回任务ID，任务在后台依次经过解析、增强和上传阶段，各阶段由独立的执行器处理；
+提交时按页数和文件大小估算任务成本，小任务和大任务进入不同车道，车道内最短任务优先
+"""
+
+from functools import lru_cache
+from services.job_manager import JobManager, STAGE_COMPLETED
+from services.pdf_service import parse_pdf_stage, finish_pdf_processing
+from services.markdown_service import enhance_markdown, upload_enhanced_markdown
+from aws.s3_utils import get_object_size, download_s3_range
+from aws.lease_utils import new_lease_owner, acquire_file_lease, release_file_lease, file_lease_lost
+from pdf_pages import find_pdf_page_count
+from config import JOB_CONFIG
+
+def estimate_job_cost(size, pages=None):
+    """
+    根据文件大小和页数估算任务成本
+    
+    Args:
+        size: 文件大小（字节）
+        pages: 页数，未知时为None
+        
+    Returns:
+        估算成本
+    """
+    cost = size / (1024 * 1024) * JOB_CONFIG['COST_PER_MB']
+    if pages:
+        cost += pages * JOB_CONFIG['COST_PER_PAGE']
+    return cost
+
+def _probe_pdf(params):
+    """读取PDF的大小和文件头尾的少量数据，估算页数和任务成本"""
+    size = get_object_size(params['bucket_name'], params['key'])
+    if not size:
+        return None
+    probe_bytes = JOB_CONFIG['PROBE_BYTES']
+    head = download_s3_range(params['bucket_name'], params['key'], 0, min(size, probe_bytes) - 1)
+    tail = None
+    if size > probe_bytes:
+        tail = download_s3_range(params['bucket_name'], params['key'], size - probe_bytes, size - 1)
+    pages = find_pdf_page_count(head, tail)
+    return {'size': size, 'pages': pages, 'cost': estimate_job_cost(size, pages)}
+
+def _probe_markdown(params):
+    """读取Markdown的大小估算任务成本"""
+    size = get_object_size(params['bucket_name'], params['key'])
+    if not size:
+        return None
+    return {'size': size, 'pages': None, 'cost': estimate_job_cost(size)}
+
+def _check_pdf_lease(params):
+    """确认PDF任务仍持有文件的处理租约，续约失败（可能已由其他服务器接手）时停止处理"""
+    if file_lease_lost(params['key'], params['lease_owner']):
+        raise RuntimeError(f"文件 {params['key']} 的处理租约已丢失")
+
+def _pdf_parse_stage(params, context, progress_callback):
+    """PDF任务的解析阶段，解析前获取（或在服务重启后重新获取）文件的处理租约"""
+    # 升级前提交的任务参数中没有租约持有者
+    params.setdefault('lease_owner', new_lease_owner())
+    if not acquire_file_lease(params['key'], params['lease_owner']):
+        raise RuntimeError(f"文件 {params['key']} 正在由其他服务器处理")
+    parsed = parse_pdf_stage(
+        params['bucket_name'], params['key'], params['out_put'],
+        params['ak'], params['sk'], params['endpoint_url']
+    )
+    if parsed is None:
+        return False
+    if parsed.get('reused'):
+        return STAGE_COMPLETED
+    context.update(parsed)
+    return True
+
+def _pdf_enhance_stage(params, context, progress_callback):
+    """PDF任务的增强阶段，直接使用解析阶段保留在内存中的Markdown、内容列表和图片数据"""
+    _check_pdf_lease(params)
+    context['final_content'] = enhance_markdown(
+        params['bucket_name'], context['md_file_path'], params['key'], progress_callback,
+        context['markdown'], context.pop('image_store'), context.pop('content_list')
+    )
+    if context['final_content'] is None:
+        # 增强失败时保留原始Markdown并结束任务
+        finish_pdf_processing(params['bucket_name'], params['key'], context['md_file_path'], context['markdown'], None)
+        return False
+    return True
+
+def _pdf_upload_stage(params, context, progress_callback):
+    """PDF任务的上传阶段"""
+    _check_pdf_lease(params)
+    return finish_pdf_processing(
+        params['bucket_name'], params['key'], context['md_file_path'],
+        context['markdown'], context.pop('final_content'), context.get('content_hash')
+    )
+
+def _release_pdf_lease(params):
+    """PDF任务结束后释放文件的处理租约"""
+    if params.get('lease_owner'):
+        release_file_lease(params['key'], params['lease_owner'])
+
+def _markdown_enhance_stage(params, context, progress_callback):
+    """Markdown任务的增强阶段"""
+    context['final_content'] = enhance_markdown(params['bucket_name'], params['key'], progress_callback=progress_callback)
+    return context['final_content'] is not None
+
+def _markdown_upload_stage(params, context, progress_callback):
+    """Markdown任务的上传阶段"""
+    return upload_enhanced_markdown(params['bucket_name'], params['key'], context.pop('final_content'))
+
+@lru_cache(maxsize=1)
+def get_job_manager():
+    """获取进程内共享的任务管理器"""
+    return JobManager(
+        handlers={
+            'pdf': [('parse', _pdf_parse_stage), ('enhance', _pdf_enhance_stage), ('upload', _pdf_upload_stage)],
+            'markdown': [('enhance', _markdown_enhance_stage), ('upload', _markdown_upload_stage)]
+        },
+        stages={
+            name: (stage_config['WORKERS'], stage_config['QUEUE_SIZE'])
+            for name, stage_config in JOB_CONFIG['STAGES'].items()
+        },
+        queue_size=JOB_CONFIG['QUEUE_SIZE'],
+        max_finished_jobs=JOB_CONFIG['MAX_FINISHED_JOBS'],
+        state_path=JOB_CONFIG['STATE_PATH'],
+        probes={'pdf': _probe_pdf, 'markdown': _probe_markdown},
+        lanes=JOB_CONFIG['LANES'],
+        aging_seconds=JOB_CONFIG['AGING_SECONDS'],
+        finalizers={'pdf': _release_pdf_lease}
+    )
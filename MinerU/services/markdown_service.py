@@ -3,64 +3,80 @@ Markdown处理服务模块，提供Markdown文件处理的高级功能
 """
 
 import logging
-import gc
 from aws.s3_utils import download_s3_object, upload_s3_object, parse_s3_url
+from aws.dynamodb_utils import update_processing_progress
+from aws.checkpoint_utils import clear_checkpoint
 from markdown.enhancer import MarkdownImageEnhancer
 from utils.memory_utils import memory_optimized
 
 logger = logging.getLogger(__name__)
 
 @memory_optimized
-def process_markdown_file(bucket, key):
+def enhance_markdown(bucket, key, file_name=None, progress_callback=None, md_content=None, image_store=None, content_list=None):
     """
-    处理Markdown文件，包括更新图片引用和添加图片理解内容
+    增强Markdown内容，包括更新图片引用和添加图片理解内容（不上传结果）
+    
+    图片分析结果按批次记录检查点，处理中断后重新运行只分析尚未完成的图片
     
     Args:
         bucket: S3桶名
         key: S3对象键
+        file_name: DynamoDB处理记录的文件名，提供时在记录中更新图片分析进度
+        progress_callback: 图片分析进度回调，参数为(已完成图片数, 图片总数)
+        md_content: 解析阶段保留在内存中的Markdown内容，提供时不再从S3下载
+        image_store: 解析阶段保留的InMemoryImageStore，提供时不再获取图片大小和下载图片
+        content_list: PDF解析得到的内容列表，提供时以图片前后的文本块作为分析上下文
         
     Returns:
-        bool: 处理是否成功
+        增强后的Markdown内容；失败时返回None
     """
     try:
         # 构建S3 URL
         md_s3_url = f"s3://{bucket}/{key}"
         
-        # 下载Markdown文件
-        md_content = download_s3_object(bucket, key)
-        if not md_content:
-            logger.error("无法读取Markdown文件内容")
-            return False
+        if md_content is None:
+            # 下载Markdown文件
+            md_content = download_s3_object(bucket, key)
+            if not md_content:
+                logger.error("无法读取Markdown文件内容")
+                return None
+            
+            # 解码为文本
+            md_content = md_content.decode('utf-8')
         
-        # 解码为文本
-        md_content = md_content.decode('utf-8')
+        # 图片分析进度同时写入DynamoDB处理记录和调用方回调
+        def report_progress(done, total):
+            if file_name:
+                update_processing_progress(file_name, done, total)
+            if progress_callback:
+                progress_callback(done, total)
         
         # 创建Markdown图片增强器
-        enhancer = MarkdownImageEnhancer(md_content, md_s3_url)
+        enhancer = MarkdownImageEnhancer(md_content, md_s3_url, report_progress, image_store, content_list)
         
         # 处理Markdown文件
-        final_content = enhancer.enhance()
-        
-        # 清理不再需要的变量
-        del md_content
-        del enhancer
-        
-        # 上传处理后的Markdown文件
-        result = upload_s3_object(
-            final_content, 
-            bucket, 
-            key, 
-            content_type='text/markdown'
-        )
-        
-        # 清理最终内容
-        del final_content
-        
-        # 显式调用垃圾回收
-        gc.collect()
-
-        return result
+        return enhancer.enhance()
     
     except Exception as e:
-        logger.error(f"处理Markdown文件失败: {str(e)}")
-        return False
+        logger.error(f"增强Markdown文件失败: {str(e)}")
+        return None
+
+def upload_enhanced_markdown(bucket, key, final_content):
+    """
+    上传增强后的Markdown文件，成功后删除图片分析检查点
+    
+    Args:
+        bucket: S3桶名
+        key: S3对象键
+        final_content: 增强后的Markdown内容
+        
+    Returns:
+        bool: 上传是否成功
+    """
+    result = upload_s3_object(final_content, bucket, key, content_type='text/markdown')
+    
+    # 处理成功后删除检查点
+    if result:
+        clear_checkpoint(f"s3://{bucket}/{key}")
+    
+    return result
@@ -0,0 +1,321 @@
+"""
+PDF解析进程池模块，解析阶段在常驻的工作进程中执行，每个进程只加载一次模型
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+from collections import deque
+import psutil
+
+logger = logging.getLogger(__name__)
+
+def _worker_main(task_queue, result_queue, max_jobs, max_memory_bytes, initializer):
+    """
+    工作进程主循环：初始化后通知父进程就绪，逐个执行任务，达到任务数或内存上限后退出
+    
+    Args:
+        task_queue: 本进程的任务队列，元素为(任务ID, 函数, 参数)，None表示退出
+        result_queue: 所有进程共享的结果队列
+        max_jobs: 进程退出前最多执行的任务数，0表示不限制
+        max_memory_bytes: 进程常驻内存上限（字节），任务完成后超过则退出，0表示不限制
+        initializer: 进程启动时执行的初始化函数（如加载模型）
+    """
+    from utils.logging_utils import configure_logging
+    configure_logging()
+    
+    pid = os.getpid()
+    process = psutil.Process(pid)
+    if initializer:
+        try:
+            initializer()
+        except Exception as e:
+            logger.error(f"解析进程 {pid} 初始化失败: {str(e)}")
+    result_queue.put(('ready', pid, None, process.memory_info().rss))
+    
+    jobs = 0
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, func, args = task
+        try:
+            result_queue.put(('done', pid, task_id, (True, func(*args))))
+        except Exception as e:
+            result_queue.put(('done', pid, task_id, (False, f"{type(e).__name__}: {str(e)}")))
+        
+        jobs += 1
+        rss = process.memory_info().rss
+        if max_jobs and jobs >= max_jobs:
+            logger.info(f"解析进程 {pid} 已执行 {jobs} 个任务，退出以便重启")
+            break
+        if max_memory_bytes and rss > max_memory_bytes:
+            logger.info(f"解析进程 {pid} 内存 {rss / 1024 / 1024:.0f} MB 超过上限，退出以便重启")
+            break
+        result_queue.put(('ready', pid, None, rss))
+
+class ParseWorkerPool:
+    """常驻解析进程池：父进程按需将任务派发给空闲进程，进程退出后自动补充，并统计每个进程的利用率"""
+    
+    def __init__(self, workers, max_jobs_per_worker=0, max_memory_bytes=0, start_method='spawn', initializer=None):
+        """
+        初始化进程池并启动工作进程
+        
+        Args:
+            workers: 工作进程数
+            max_jobs_per_worker: 每个进程重启前最多执行的任务数，0表示不限制
+            max_memory_bytes: 每个进程的常驻内存上限（字节），0表示不限制
+            start_method: 进程启动方式（spawn/forkserver/fork）
+            initializer: 进程启动时执行的初始化函数，需可被pickle（模块级函数）
+        """
+        self.workers = workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_memory_bytes = max_memory_bytes
+        self.initializer = initializer
+        self._context = multiprocessing.get_context(start_method)
+        self._result_queue = self._context.Queue()
+        self._pending = deque()  # 等待派发的(任务ID, 函数, 参数)
+        self._futures = {}  # 任务ID -> Future
+        self._workers = {}  # 进程ID -> 进程状态
+        self._next_task_id = 0
+        self._restarts = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        
+        with self._lock:
+            for _ in range(workers):
+                self._start_worker()
+        
+        self._manager = threading.Thread(target=self._manage, name="parse-pool-manager", daemon=True)
+        self._manager.start()
+        atexit.register(self.shutdown)
+    
+    def _start_worker(self):
+        """启动一个工作进程，调用方需持有锁"""
+        task_queue = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(task_queue, self._result_queue, self.max_jobs_per_worker, self.max_memory_bytes, self.initializer),
+            name="parse-worker"
+        )
+        process.start()
+        self._workers[process.pid] = {
+            'process': process,
+            'task_queue': task_queue,
+            'ready': False,
+            'task_id': None,
+            'task_started': None,
+            'started_at': time.time(),
+            'jobs': 0,
+            'busy_seconds': 0.0,
+            'rss': 0
+        }
+    
+    def submit(self, func, *args):
+        """
+        提交任务
+        
+        Args:
+            func: 在工作进程中执行的函数，需可被pickle（模块级函数），返回值也需可被pickle
+            *args: 函数参数
+        
+        Returns:
+            concurrent.futures.Future
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("解析进程池已关闭")
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._futures[task_id] = future
+            self._pending.append((task_id, func, args))
+            self._dispatch()
+        return future
+    
+    def run(self, func, *args):
+        """提交任务并等待结果，任务失败时抛出异常"""
+        return self.submit(func, *args).result()
+    
+    def run_all(self, func, args_iterable):
+        """
+        提交一组任务并按提交顺序返回结果
+        
+        任一任务失败时取消尚未派发的任务后抛出异常；已派发给工作进程的任务无法中断，继续执行完毕，其结果被丢弃
+        
+        Args:
+            func: 在工作进程中执行的函数，要求同submit
+            args_iterable: 每个任务的参数元组，可以是生成器，提交后不再保留参数的引用
+        
+        Returns:
+            结果列表，顺序与参数顺序一致
+        """
+        futures = [self.submit(func, *args) for args in args_iterable]
+        
+        def cancel_on_failure(future):
+            # 在设置失败结果的管理线程中执行，先于下一次派发取消其余任务
+            if not future.cancelled() and future.exception() is not None:
+                for other in futures:
+                    other.cancel()
+        
+        for future in futures:
+            future.add_done_callback(cancel_on_failure)
+        
+        done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        return [future.result() for future in futures]
+    
+    def _next_task(self):
+        """
+        取出下一个可派发的任务并将其Future置为运行中，已取消的任务直接丢弃；调用方需持有锁
+        
+        Returns:
+            (任务ID, 函数, 参数)，没有可派发的任务时返回None
+        """
+        while self._pending:
+            task = self._pending.popleft()
+            future = self._futures.get(task[0])
+            if future is not None and future.set_running_or_notify_cancel():
+                return task
+            self._futures.pop(task[0], None)
+        return None
+    
+    def _dispatch(self):
+        """将等待中的任务派发给空闲进程，调用方需持有锁"""
+        for pid, worker in self._workers.items():
+            if not self._pending:
+                break
+            if not worker['ready'] or worker['task_id'] is not None:
+                continue
+            task = self._next_task()
+            if task is None:
+                break
+            worker['task_id'] = task[0]
+            worker['task_started'] = time.time()
+            worker['task_queue'].put(task)
+    
+    def _manage(self):
+        """处理工作进程的消息，检测退出的进程并补充新进程"""
+        while True:
+            messages = []
+            try:
+                messages.append(self._result_queue.get(timeout=1))
+                # 先处理完已到达的全部消息，再检测退出的进程，避免进程退出前发出的任务结果被误判为失败
+                while True:
+                    messages.append(self._result_queue.get_nowait())
+            except queue.Empty:
+                pass
+            
+            with self._lock:
+                for message in messages:
+                    # 单条消息处理失败不能终止管理线程，否则之后提交的任务都不会再被派发
+                    try:
+                        self._handle_message(*message)
+                    except Exception as e:
+                        logger.error(f"处理解析进程消息失败: {str(e)}")
+                self._reap_workers()
+                if self._closed:
+                    break
+                self._dispatch()
+    
+    def _handle_message(self, kind, pid, task_id, payload):
+        """处理工作进程的消息，调用方需持有锁"""
+        worker = self._workers.get(pid)
+        if worker is None:
+            return
+        
+        if kind == 'ready':
+            worker['ready'] = True
+            if payload is not None:
+                worker['rss'] = payload
+            return
+        
+        # 任务完成
+        worker['busy_seconds'] += time.time() - worker['task_started']
+        worker['jobs'] += 1
+        worker['task_id'] = None
+        worker['task_started'] = None
+        worker['ready'] = False
+        
+        future = self._futures.pop(task_id, None)
+        if future is None or future.done():
+            return
+        ok, value = payload
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(value))
+    
+    def _reap_workers(self):
+        """回收已退出的进程，进程执行中的任务置为失败，并补充新进程；调用方需持有锁"""
+        for pid, worker in list(self._workers.items()):
+            if worker['process'].is_alive():
+                continue
+            worker['process'].join()
+            del self._workers[pid]
+            
+            if worker['task_id'] is not None:
+                future = self._futures.pop(worker['task_id'], None)
+                if future is not None and not future.done():
+                    future.set_exception(RuntimeError(f"解析进程 {pid} 异常退出，退出码 {worker['process'].exitcode}"))
+            
+            if not self._closed:
+                self._restarts += 1
+                self._start_worker()
+    
+    def metrics(self):
+        """
+        获取进程池运行指标
+        
+        Returns:
+            包含等待任务数、重启次数，以及每个进程的任务数、利用率和内存占用的字典
+        """
+        with self._lock:
+            now = time.time()
+            workers = []
+            for pid, worker in self._workers.items():
+                busy_seconds = worker['busy_seconds']
+                if worker['task_started'] is not None:
+                    busy_seconds += now - worker['task_started']
+                uptime = now - worker['started_at']
+                workers.append({
+                    'pid': pid,
+                    'busy': worker['task_id'] is not None,
+                    'jobs': worker['jobs'],
+                    'busy_seconds': busy_seconds,
+                    'uptime_seconds': uptime,
+                    'utilization': busy_seconds / uptime if uptime > 0 else 0.0,
+                    'rss_bytes': worker['rss']
+                })
+            return {
+                'pending': len(self._pending),
+                'restarts': self._restarts,
+                'workers': workers
+            }
+    
+    def shutdown(self):
+        """通知所有进程退出并等待其结束"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers.values())
+            for worker in workers:
+                worker['task_queue'].put(None)
+            for task_id, _, _ in self._pending:
+                future = self._futures.pop(task_id, None)
+                if future is not None:
+                    future.cancel()
+            self._pending.clear()
+        
+        for worker in workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
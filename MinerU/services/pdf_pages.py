@@ -0,0 +1,198 @@
+"""
+PDF页面工具模块，提供逐页分类、按页范围拆分和分片结果合并功能
+"""
+
+import os
+import re
+import json
+import fitz
+from config import PAGE_CLASSIFY_CONFIG
+
+def count_pdf_pages(pdf_bytes):
+    """
+    获取PDF页数
+    
+    Args:
+        pdf_bytes: PDF文件数据
+    
+    Returns:
+        页数
+    """
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+        return doc.page_count
+
+# 线性化PDF文件头中的页数，以及页面树根节点（/Type /Pages）中的页数
+_LINEARIZED_PAGES_PATTERN = re.compile(rb'/Linearized\s+[\d.]+[^>]*?/N\s+(\d+)', re.S)
+_PAGES_COUNT_PATTERNS = (
+    re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)', re.S),
+    re.compile(rb'/Count\s+(\d+)[^>]*?/Type\s*/Pages\b', re.S)
+)
+
+def find_pdf_page_count(*chunks):
+    """
+    从PDF文件头尾的部分数据中查找页数，无需下载和打开整个文件
+    
+    线性化PDF的文件头记录了总页数；其余PDF的页面树节点常位于文件尾，取其中最大的/Count。
+    页面树位于压缩对象流中时无法找到
+    
+    Args:
+        *chunks: PDF文件的部分数据
+    
+    Returns:
+        页数；找不到时返回None
+    """
+    counts = []
+    for chunk in chunks:
+        if not chunk:
+            continue
+        match = _LINEARIZED_PAGES_PATTERN.search(chunk)
+        if match:
+            return int(match.group(1))
+        for pattern in _PAGES_COUNT_PATTERNS:
+            counts.extend(int(count) for count in pattern.findall(chunk))
+    return max(counts) if counts else None
+
+def classify_pdf_pages(pdf_bytes):
+    """
+    逐页判断是否需要OCR：没有可提取文本层或文本层乱码较多的页面使用OCR，其余页面使用文本模式
+    
+    Args:
+        pdf_bytes: PDF文件数据
+    
+    Returns:
+        每页是否使用OCR的布尔值列表
+    """
+    page_modes = []
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+        for page in doc:
+            text = ''.join(page.get_text().split())
+            if len(text) < PAGE_CLASSIFY_CONFIG['MIN_TEXT_CHARS']:
+                page_modes.append(True)
+                continue
+            # 字体缺少Unicode映射时提取出的文本为替换字符
+            invalid_ratio = text.count('\ufffd') / len(text)
+            page_modes.append(invalid_ratio > PAGE_CLASSIFY_CONFIG['MAX_INVALID_CHAR_RATIO'])
+    return page_modes
+
+def plan_pdf_segments(page_modes, max_pages=None):
+    """
+    将处理方式相同的连续页面合并为片段
+    
+    Args:
+        page_modes: 每页是否使用OCR的布尔值列表
+        max_pages: 每个片段的最大页数，None表示不限制
+    
+    Returns:
+        片段列表，每个元素为(起始页索引, 结束页索引(不含), 是否使用OCR)
+    """
+    segments = []
+    start_page = 0
+    for page_idx in range(1, len(page_modes) + 1):
+        if (
+            page_idx == len(page_modes)
+            or page_modes[page_idx] != page_modes[start_page]
+            or (max_pages and page_idx - start_page >= max_pages)
+        ):
+            segments.append((start_page, page_idx, page_modes[start_page]))
+            start_page = page_idx
+    return segments
+
+def split_pdf_pages(pdf_bytes, page_ranges):
+    """
+    按页范围从PDF中拆分出分片
+    
+    Args:
+        pdf_bytes: PDF文件数据
+        page_ranges: 页范围列表，每个元素为(起始页索引, 结束页索引(不含))
+    
+    Returns:
+        与页范围一一对应的分片PDF数据列表
+    """
+    shards = []
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+        for start_page, end_page in page_ranges:
+            with fitz.open() as shard_doc:
+                shard_doc.insert_pdf(doc, from_page=start_page, to_page=end_page - 1)
+                shards.append(shard_doc.tobytes())
+    return shards
+
+def merge_shard_results(shard_results):
+    """
+    按页码顺序合并各分片的解析结果
+    
+    Args:
+        shard_results: 分片结果列表，每个元素为(起始页索引, Markdown文本, 内容列表)
+    
+    Returns:
+        (合并后的Markdown文本, 合并后的内容列表)，内容列表中的页码为整个文档的页码
+    """
+    markdown_parts = []
+    content_list = []
+    for start_page, shard_markdown, shard_content_list in sorted(shard_results, key=lambda result: result[0]):
+        if shard_markdown.strip():
+            markdown_parts.append(shard_markdown.strip())
+        for item in shard_content_list:
+            item['page_idx'] = item.get('page_idx', 0) + start_page
+            content_list.append(item)
+    return '\n\n'.join(markdown_parts) + '\n', content_list
+
+def merge_middle_json(shard_results):
+    """
+    按页码顺序合并各分片的中间结果JSON
+    
+    Args:
+        shard_results: 分片结果列表，每个元素为(起始页索引, 中间结果JSON文本)
+    
+    Returns:
+        合并后的中间结果JSON文本，页码为整个文档的页码；_segments记录各分片的起始页和解析方式
+    """
+    merged = None
+    for start_page, middle_json in sorted(shard_results, key=lambda result: result[0]):
+        middle = json.loads(middle_json)
+        pages = middle.get('pdf_info', [])
+        for page in pages:
+            page['page_idx'] = page.get('page_idx', 0) + start_page
+        segment = {'start_page': start_page, '_parse_type': middle.get('_parse_type')}
+        if merged is None:
+            merged = middle
+            merged['_segments'] = [segment]
+        else:
+            merged['pdf_info'].extend(pages)
+            merged['_segments'].append(segment)
+    return json.dumps(merged or {'pdf_info': []}, ensure_ascii=False)
+
+def _collect_image_bboxes(node, page_idx, bboxes):
+    """递归查找中间结果中带有图片路径的span，记录图片文件名到(页码, 边界框)的映射"""
+    if isinstance(node, dict):
+        if node.get('image_path') and node.get('bbox'):
+            bboxes.setdefault(os.path.basename(node['image_path']), (page_idx, node['bbox']))
+        for value in node.values():
+            _collect_image_bboxes(value, page_idx, bboxes)
+    elif isinstance(node, list):
+        for value in node:
+            _collect_image_bboxes(value, page_idx, bboxes)
+
+def attach_image_bboxes(content_list, middle_json):
+    """
+    为内容列表中的图片块和表格块补充边界框（MinerU的内容列表只记录页码，边界框在中间结果中）
+    
+    Args:
+        content_list: 内容列表，原地更新
+        middle_json: 中间结果JSON文本
+    
+    Returns:
+        补充了边界框的块数
+    """
+    bboxes = {}
+    for page in json.loads(middle_json).get('pdf_info', []):
+        _collect_image_bboxes(page.get('para_blocks', []), page.get('page_idx', 0), bboxes)
+    
+    attached = 0
+    for item in content_list:
+        if item.get('bbox') or not item.get('img_path'):
+            continue
+        location = bboxes.get(os.path.basename(item['img_path']))
+        if location is not None:
+            item['bbox'] = location[1]
+            attached += 1
+    return attached
@@ -3,128 +3,422 @@ PDF处理服务模块，提供PDF文件处理的高级功能
 """
 
 import os
+import json
 import logging
-import gc
+from functools import lru_cache
 from magic_pdf.data.data_reader_writer import S3DataReader, S3DataWriter
 from magic_pdf.data.dataset import PymuDocDataset
-from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
+from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze, ModelSingleton
 from magic_pdf.config.enums import SupportedPdfParseMethod
 from utils.memory_utils import memory_optimized
-from aws.dynamodb_utils import update_processing_status
-from markdown_service import process_markdown_file
-from config import FILE_PROCESSING
+from aws.dynamodb_utils import update_processing_status, update_parse_stats, update_content_hash
+from aws.s3_utils import upload_s3_object, download_s3_object, copy_s3_object, get_object_size, get_content_hash, s3_url_to_cloudfront_url
+from aws.content_registry_utils import lookup_processed_content, register_processed_content
+from image.processor import InMemoryImageStore
+from markdown_service import upload_enhanced_markdown
+from parser import extract_image_references
+from parse_pool import ParseWorkerPool
+from tee_writer import TeeDataWriter
+from services.artifact_service import get_artifact_renderer
+from pdf_pages import count_pdf_pages, classify_pdf_pages, plan_pdf_segments, split_pdf_pages, merge_shard_results, merge_middle_json, attach_image_bboxes
+from config import FILE_PROCESSING, PARSE_POOL_CONFIG, PAGE_CLASSIFY_CONFIG, DEBUG_ARTIFACT_CONFIG, CONTENT_REGISTRY_CONFIG
 
 logger = logging.getLogger(__name__)
 
+def init_parse_worker():
+    """
+    解析进程初始化函数，预先加载文本模式和OCR模式的模型，进程内后续任务直接复用
+    """
+    model_manager = ModelSingleton()
+    model_manager.get_model(False, False)
+    model_manager.get_model(True, False)
+    logger.info(f"解析进程 {os.getpid()} 模型加载完成")
+
+@lru_cache(maxsize=1)
+def get_parse_pool():
+    """
+    获取进程内共享的解析进程池
+    
+    Returns:
+        ParseWorkerPool实例；进程池未启用时返回None
+    """
+    if not PARSE_POOL_CONFIG['ENABLED']:
+        return None
+    return ParseWorkerPool(
+        workers=PARSE_POOL_CONFIG['WORKERS'],
+        max_jobs_per_worker=PARSE_POOL_CONFIG['MAX_JOBS_PER_WORKER'],
+        max_memory_bytes=PARSE_POOL_CONFIG['MAX_MEMORY_MB'] * 1024 * 1024,
+        start_method=PARSE_POOL_CONFIG['START_METHOD'],
+        initializer=init_parse_worker
+    )
+
+def _parse_pdf_bytes(pdf_bytes, image_writer, ocr=None):
+    """
+    解析PDF数据，图片写入image_writer
+    
+    调试文件（布局和span标注PDF）不在解析过程中生成，由artifact_service根据保存的中间结果按需渲染
+    
+    Args:
+        pdf_bytes: PDF文件数据
+        image_writer: 图片写入器
+        ocr: 是否使用OCR模式，None表示由MinerU对整个文档分类决定
+        
+    Returns:
+        MinerU的PipeResult
+    """
+    # 创建数据集实例
+    ds = PymuDocDataset(pdf_bytes)
+    
+    # 处理PDF
+    if ocr is None:
+        logger.info(f"分类PDF处理方法")
+        ocr = ds.classify() == SupportedPdfParseMethod.OCR
+    if ocr:
+        logger.info(f"使用OCR模式处理PDF")
+        infer_result = ds.apply(doc_analyze, ocr=True)
+        pipe_result = infer_result.pipe_ocr_mode(image_writer)
+    else:
+        logger.info(f"使用文本模式处理PDF")
+        infer_result = ds.apply(doc_analyze, ocr=False)
+        pipe_result = infer_result.pipe_txt_mode(image_writer)
+    
+    # 释放大型对象以帮助垃圾回收
+    del infer_result
+    del ds
+    
+    return pipe_result
+
+def get_md_file_path(key, out_put):
+    """
+    获取PDF解析输出的Markdown文件的S3对象键，内容列表和中间结果保存在同一目录
+    
+    Args:
+        key: PDF文件的S3对象键
+        out_put: 输出目录名
+        
+    Returns:
+        Markdown文件的S3对象键
+    """
+    name_without_suff = os.path.basename(key).split(".")[0]
+    return f"{FILE_PROCESSING['S3_OUTPUT_PREFIX']}{out_put}/{name_without_suff}.md"
+
+def _get_image_writer(bucket_name, out_put, ak, sk, endpoint_url, image_store):
+    """
+    创建图片写入器：图片写入S3并记录到内存图片存储（Markdown等文本输出由调用方保存）
+    
+    Returns:
+        图片写入器
+    """
+    image_prefix = f'{FILE_PROCESSING["S3_OUTPUT_PREFIX"]}{out_put}/images'
+    return TeeDataWriter(S3DataWriter(image_prefix, bucket_name, ak, sk, endpoint_url), image_prefix, image_store)
+
 @memory_optimized
-def process_pdf_file(bucket_name, key, out_put, ak, sk, endpoint_url):
+def parse_pdf_segment(pdf_bytes, bucket_name, out_put, segment_name, ak, sk, endpoint_url, ocr=None):
     """
-    处理PDF文件，转换为Markdown并增强图片
+    解析整个PDF或其一个页范围分片，图片写入S3，Markdown、内容列表、中间结果和图片数据返回给调用方
+    （启用进程池时在解析进程中执行）
+    
+    MinerU以sha256("{PDF数据的MD5}/images/{页码}_{边界框}")命名图片，页码为传入PDF内的页码：各分片的图片写入
+    同一目录时不会重名，但与整体解析得到的图片名不同。同一PDF按相同的分片方式重新解析时图片名不变
     
     Args:
+        pdf_bytes: PDF数据
         bucket_name: S3桶名
-        key: PDF文件的S3对象键
         out_put: 输出目录名
+        segment_name: 文档或分片名称，用于日志
         ak: AWS访问密钥
         sk: AWS秘密访问密钥
         endpoint_url: S3端点URL
+        ocr: 是否使用OCR模式，None表示由MinerU分类决定
         
     Returns:
-        bool: 处理是否成功
+        (Markdown文本, 内容列表, 中间结果JSON文本, InMemoryImageStore)，页码从传入PDF的第一页起算
     """
-    try:
-        # 记录文件名，用于更新DynamoDB
-        file_name = key
-        
-        # 初始化S3读写器
-        reader = S3DataReader('', bucket_name, ak, sk, endpoint_url)
-        writer = S3DataWriter('', bucket_name, ak, sk, endpoint_url)
-        image_writer = S3DataWriter(f'{FILE_PROCESSING["S3_OUTPUT_PREFIX"]}{out_put}/images', bucket_name, ak, sk, endpoint_url)
-        md_writer = S3DataWriter(f'{FILE_PROCESSING["S3_OUTPUT_PREFIX"]}{out_put}', bucket_name, ak, sk, endpoint_url)
+    image_store = InMemoryImageStore(bucket_name, FILE_PROCESSING['HANDOFF_MAX_IMAGE_BYTES'])
+    image_writer = _get_image_writer(bucket_name, out_put, ak, sk, endpoint_url, image_store)
+    image_dir = os.path.basename(FILE_PROCESSING["LOCAL_IMAGE_DIR"])
+    
+    logger.info(f"解析 {segment_name}")
+    pipe_result = _parse_pdf_bytes(pdf_bytes, image_writer, ocr)
+    del pdf_bytes
+    markdown = pipe_result.get_markdown(image_dir)
+    content_list = pipe_result.get_content_list(image_dir)
+    middle_json = pipe_result.get_middle_json()
+    
+    # 释放大型对象以帮助垃圾回收
+    del pipe_result
+    
+    # 内容列表中的图片块补充中间结果中的边界框
+    attach_image_bboxes(content_list, middle_json)
+    
+    return markdown, content_list, middle_json, image_store
 
-        # 设置本地目录
-        local_image_dir = FILE_PROCESSING["LOCAL_IMAGE_DIR"]
-        local_md_dir = FILE_PROCESSING["LOCAL_OUTPUT_DIR"]
-        image_dir = os.path.basename(local_image_dir)
+def _save_structured_outputs(bucket_name, md_file_path, content_list, middle_json):
+    """
+    将内容列表和中间结果保存到Markdown所在目录，与Markdown同名（分别以_content_list.json和_middle.json结尾）
+    
+    Args:
+        bucket_name: S3桶名
+        md_file_path: Markdown文件的S3对象键
+        content_list: 内容列表
+        middle_json: 中间结果JSON文本
+    """
+    base_path = os.path.splitext(md_file_path)[0]
+    upload_s3_object(
+        json.dumps(content_list, ensure_ascii=False),
+        bucket_name,
+        f"{base_path}_content_list.json",
+        content_type='application/json'
+    )
+    upload_s3_object(middle_json, bucket_name, f"{base_path}_middle.json", content_type='application/json')
 
-        # 设置PDF文件路径
-        pdf_file_name = f"s3://{bucket_name}/{key}"
-        name_without_suff = os.path.basename(pdf_file_name).split(".")[0]
+def _parse_pdf_shards(pdf_bytes, segments, parse_pool, bucket_name, out_put, name_without_suff, ak, sk, endpoint_url):
+    """
+    按片段拆分PDF并解析，启用进程池时各片段由不同的解析进程并行处理，结果按页码顺序合并
+    
+    Returns:
+        (Markdown文本, 内容列表, 中间结果JSON文本, InMemoryImageStore)，与parse_pdf_segment的返回值一致
+    """
+    shards = split_pdf_pages(pdf_bytes, [(start_page, end_page) for start_page, end_page, _ in segments])
+    shard_args = (
+        (shard_bytes, bucket_name, out_put, f"{name_without_suff}_p{start_page + 1}-{end_page}", ak, sk, endpoint_url, ocr)
+        for (start_page, end_page, ocr), shard_bytes in zip(segments, shards)
+    )
+    
+    # 任一片段失败时进程池取消尚未派发的片段，已在解析进程中执行的片段的结果被丢弃
+    if parse_pool:
+        results = parse_pool.run_all(parse_pdf_segment, shard_args)
+    else:
+        results = [parse_pdf_segment(*args) for args in shard_args]
+    del shards, shard_args
+    shard_results = [(start_page, *result) for (start_page, _, _), result in zip(segments, results)]
+    del results
+    
+    # 合并各分片的图片存储
+    image_store = InMemoryImageStore(bucket_name, FILE_PROCESSING['HANDOFF_MAX_IMAGE_BYTES'])
+    for result in shard_results:
+        image_store.merge(result[4])
+    
+    markdown, content_list = merge_shard_results([result[:3] for result in shard_results])
+    middle_json = merge_middle_json([(result[0], result[3]) for result in shard_results])
+    del shard_results
+    
+    return markdown, content_list, middle_json, image_store
 
-        logger.info(f"开始处理PDF文件: {pdf_file_name}")
-        
-        try:
-            # 读取PDF内容
-            pdf_bytes = reader.read(pdf_file_name)
-    
-            # 创建数据集实例
-            ds = PymuDocDataset(pdf_bytes)
-            
-            # 处理完成后释放PDF字节数据
-            del pdf_bytes
-            
-            # 处理PDF
-            logger.info(f"分类PDF处理方法")
-            if ds.classify() == SupportedPdfParseMethod.OCR:
-                logger.info(f"使用OCR模式处理PDF")
-                infer_result = ds.apply(doc_analyze, ocr=True)
-                pipe_result = infer_result.pipe_ocr_mode(image_writer)
-            else:
-                logger.info(f"使用文本模式处理PDF")
-                infer_result = ds.apply(doc_analyze, ocr=False)
-                pipe_result = infer_result.pipe_txt_mode(image_writer)
-    
-            # 生成结果文件
-            logger.info(f"生成结果文件")
-            infer_result.draw_model(os.path.join(local_md_dir, f"{name_without_suff}_model.pdf"))
-            model_inference_result = infer_result.get_infer_res()
-            pipe_result.draw_layout(os.path.join(local_md_dir, f"{name_without_suff}_layout.pdf"))
-            pipe_result.draw_span(os.path.join(local_md_dir, f"{name_without_suff}_spans.pdf"))
-            pipe_result.dump_md(md_writer, f"{name_without_suff}.md", image_dir)
-            
-            # 释放大型对象以帮助垃圾回收
-            del infer_result
-            del model_inference_result
-            
-            # 显式调用垃圾回收
-            gc.collect()
-        except Exception as e:
-            logger.error(f"处理PDF时发生错误: {str(e)}")
-            update_processing_status(file_name, '处理失败-转MD')
-            return False
-        
-        # 开始MD优化
-        # 更新DynamoDB状态为处理中
-        update_processing_status(file_name, '图片转换中')
-        
-        # 处理Markdown文件中的图片
-        md_file_path = f"{FILE_PROCESSING['S3_OUTPUT_PREFIX']}{out_put}/{name_without_suff}.md"
-        result = process_markdown_file(bucket_name, md_file_path)
+def parse_pdf(bucket_name, key, out_put, ak, sk, endpoint_url):
+    """
+    读取PDF并解析为Markdown
+    
+    逐页判断是否需要OCR，只对没有文本层的页面使用OCR模式；处理方式不同的页面和页数超过阈值的文档
+    按页范围拆分为片段，在解析进程池中并行解析后按页码顺序合并
+    
+    Args:
+        bucket_name: S3桶名
+        key: PDF文件的S3对象键
+        out_put: 输出目录名
+        ak: AWS访问密钥
+        sk: AWS秘密访问密钥
+        endpoint_url: S3端点URL
         
-        if result:
-            # 更新DynamoDB状态为处理成功
-            update_processing_status(file_name, '处理成功')
+    Returns:
+        (Markdown文件的S3对象键, Markdown文本, 内容列表, InMemoryImageStore, 解析统计)
+        Markdown尚未写入S3，内容列表和中间结果已写入Markdown所在目录；
+        解析统计包含总页数、OCR页数、文本模式页数和片段数
+    """
+    # 读取PDF内容
+    reader = S3DataReader('', bucket_name, ak, sk, endpoint_url)
+    pdf_file_name = f"s3://{bucket_name}/{key}"
+    name_without_suff = os.path.basename(pdf_file_name).split(".")[0]
+    md_file_path = get_md_file_path(key, out_put)
+    pdf_bytes = reader.read(pdf_file_name)
+    
+    # 逐页分类，未启用时整个文档由MinerU分类
+    if PAGE_CLASSIFY_CONFIG['ENABLED']:
+        page_modes = classify_pdf_pages(pdf_bytes)
+    else:
+        page_modes = [None] * count_pdf_pages(pdf_bytes)
+    
+    # 启用进程池且页数超过阈值时按页数拆分片段
+    parse_pool = get_parse_pool()
+    max_pages = None
+    if parse_pool and len(page_modes) > PARSE_POOL_CONFIG['SHARD_PAGE_THRESHOLD']:
+        max_pages = PARSE_POOL_CONFIG['SHARD_PAGES']
+    segments = plan_pdf_segments(page_modes, max_pages)
+    
+    parse_stats = {
+        'pages': len(page_modes),
+        'ocr_pages': sum(1 for ocr in page_modes if ocr),
+        'txt_pages': sum(1 for ocr in page_modes if ocr is False),
+        'segments': len(segments)
+    }
+    logger.info(f"PDF共 {parse_stats['pages']} 页，OCR {parse_stats['ocr_pages']} 页，"
+                f"文本模式 {parse_stats['txt_pages']} 页，拆分为 {len(segments)} 个片段解析")
+    
+    # 只有一个片段时整体解析
+    if len(segments) <= 1:
+        ocr = segments[0][2] if segments else None
+        segment_args = (pdf_bytes, bucket_name, out_put, name_without_suff, ak, sk, endpoint_url, ocr)
+        if parse_pool:
+            markdown, content_list, middle_json, image_store = parse_pool.run(parse_pdf_segment, *segment_args)
         else:
-            update_processing_status(file_name, '处理失败-转图片')
-            return False
-        
-        # 获取其他处理结果
-        logger.info(f"获取其他处理结果")
-        content_list_content = pipe_result.get_content_list(image_dir)
-        middle_json_content = pipe_result.get_middle_json()
-        
-        # 释放大型对象以帮助垃圾回收
-        del pipe_result
-        del content_list_content
-        del middle_json_content
-        
-        # 显式调用垃圾回收
-        gc.collect()
+            markdown, content_list, middle_json, image_store = parse_pdf_segment(*segment_args)
+    else:
+        markdown, content_list, middle_json, image_store = _parse_pdf_shards(
+            pdf_bytes, segments, parse_pool, bucket_name, out_put, name_without_suff, ak, sk, endpoint_url
+        )
+    del pdf_bytes
+    
+    _save_structured_outputs(bucket_name, md_file_path, content_list, middle_json)
+    del middle_json
+    
+    return md_file_path, markdown, content_list, image_store, parse_stats
+
+def copy_processed_outputs(bucket_name, source_md_file_path, md_file_path):
+    """
+    将相同内容文档的已有输出复制到新的输出位置
+    
+    内容列表、中间结果和Markdown引用的图片在服务端复制；Markdown中的图片链接改为指向新输出目录后上传，
+    新输出不依赖源文档的输出目录
+    
+    Args:
+        bucket_name: S3桶名
+        source_md_file_path: 已有Markdown文件的S3对象键
+        md_file_path: 新Markdown文件的S3对象键
         
-        logger.info(f"PDF处理成功: {file_name}")
-        return True
+    Returns:
+        bool: 复制是否成功
+    """
+    markdown = download_s3_object(bucket_name, source_md_file_path)
+    if not markdown:
+        logger.warning(f"已有输出 {source_md_file_path} 不存在")
+        return False
+    markdown = markdown.decode('utf-8')
+    
+    source_base, target_base = os.path.splitext(source_md_file_path)[0], os.path.splitext(md_file_path)[0]
+    for suffix in ('_content_list.json', '_middle.json'):
+        if not copy_s3_object(bucket_name, f"{source_base}{suffix}", f"{target_base}{suffix}"):
+            return False
+    
+    # 输出目录相同时Markdown引用的就是源文档的图片，无需复制
+    source_dir, target_dir = os.path.dirname(source_md_file_path), os.path.dirname(md_file_path)
+    if source_dir != target_dir:
+        source_image_url = s3_url_to_cloudfront_url(f"s3://{bucket_name}/{source_dir}/images/")
+        target_image_url = s3_url_to_cloudfront_url(f"s3://{bucket_name}/{target_dir}/images/")
+        image_names = {
+            image_url[len(source_image_url):]
+            for _, image_url, _ in extract_image_references(markdown)
+            if image_url.startswith(source_image_url)
+        }
+        for image_name in image_names:
+            if not copy_s3_object(bucket_name, f"{source_dir}/images/{image_name}", f"{target_dir}/images/{image_name}"):
+                return False
+        markdown = markdown.replace(source_image_url, target_image_url)
+    
+    return upload_s3_object(markdown, bucket_name, md_file_path, content_type='text/markdown')
 
+def _reuse_processed_outputs(bucket_name, key, md_file_path, content_hash):
+    """
+    相同内容的文档已处理成功时复用其输出，并将处理记录更新为处理成功
+    
+    Returns:
+        是否已复用输出；未找到可复用的输出时返回False
+    """
+    record = lookup_processed_content(content_hash)
+    if record is None or record['bucket'] != bucket_name:
+        return False
+    
+    logger.info(f"{key} 与已处理的 {record['source_key']} 内容相同，复制已有输出")
+    if record['md_file_path'] == md_file_path:
+        reused = get_object_size(bucket_name, md_file_path) > 0
+    else:
+        reused = copy_processed_outputs(bucket_name, record['md_file_path'], md_file_path)
+    if not reused:
+        logger.warning(f"无法复用 {record['source_key']} 的输出，重新处理 {key}")
+        return False
+    
+    update_content_hash(key, content_hash, record['source_key'])
+    update_processing_status(key, '处理成功')
+    return True
+
+def parse_pdf_stage(bucket_name, key, out_put, ak, sk, endpoint_url):
+    """
+    PDF处理的解析阶段：相同内容的文档已处理成功时复制其输出，否则解析PDF并更新DynamoDB处理记录
+    
+    Args:
+        bucket_name: S3桶名
+        key: PDF文件的S3对象键，同时作为DynamoDB处理记录的文件名
+        out_put: 输出目录名
+        ak: AWS访问密钥
+        sk: AWS秘密访问密钥
+        endpoint_url: S3端点URL
+        
+    Returns:
+        包含md_file_path、markdown、content_list、image_store、content_hash的字典，供增强阶段使用；
+        复用已有输出时返回只包含md_file_path和reused的字典；解析失败时返回None
+    """
+    logger.info(f"开始处理PDF文件: s3://{bucket_name}/{key}")
+    
+    # 按内容哈希查找已处理成功的相同文档（如上传到多个部门目录的同一文件）
+    content_hash = None
+    if CONTENT_REGISTRY_CONFIG['BACKEND']:
+        content_hash = get_content_hash(bucket_name, key, CONTENT_REGISTRY_CONFIG['HASH_CHUNK_BYTES'])
+        md_file_path = get_md_file_path(key, out_put)
+        if content_hash and _reuse_processed_outputs(bucket_name, key, md_file_path, content_hash):
+            return {'md_file_path': md_file_path, 'reused': True}
+    
+    try:
+        # 解析PDF，启用进程池时在已加载模型的解析进程中执行
+        md_file_path, markdown, content_list, image_store, parse_stats = parse_pdf(bucket_name, key, out_put, ak, sk, endpoint_url)
     except Exception as e:
         logger.error(f"处理PDF时发生错误: {str(e)}")
-        update_processing_status(file_name, '处理失败-转MD')
-        return False
+        update_processing_status(key, '处理失败-转MD')
+        return None
+    
+    # 记录各处理方式的页数
+    update_parse_stats(key, parse_stats)
+    
+    # 调试文件在后台低优先级线程中根据保存的中间结果渲染，不阻塞图片增强
+    if DEBUG_ARTIFACT_CONFIG['MODE'] == 'async':
+        get_artifact_renderer().submit(bucket_name, key, md_file_path)
+    
+    # 开始MD优化
+    # 更新DynamoDB状态为处理中
+    update_processing_status(key, '图片转换中')
+    logger.info(f"解析输出交接: {image_store.stats()}")
+    
+    return {
+        'md_file_path': md_file_path,
+        'markdown': markdown,
+        'content_list': content_list,
+        'image_store': image_store,
+        'content_hash': content_hash
+    }
+
+def finish_pdf_processing(bucket_name, key, md_file_path, markdown, final_content, content_hash=None):
+    """
+    PDF处理的上传阶段：上传增强后的Markdown并更新DynamoDB处理记录，成功后登记文件内容哈希
+    
+    Args:
+        bucket_name: S3桶名
+        key: PDF文件的S3对象键
+        md_file_path: Markdown文件的S3对象键
+        markdown: 解析得到的原始Markdown，增强或上传失败时保留到S3
+        final_content: 增强后的Markdown内容，增强失败时为None
+        content_hash: 文件内容哈希，提供时登记输出位置供相同内容的文件复用
+        
+    Returns:
+        bool: 处理是否成功
+    """
+    if final_content is not None and upload_enhanced_markdown(bucket_name, md_file_path, final_content):
+        if content_hash:
+            update_content_hash(key, content_hash)
+            register_processed_content(content_hash, bucket_name, key, md_file_path)
+        # 更新DynamoDB状态为处理成功
+        update_processing_status(key, '处理成功')
+        logger.info(f"PDF处理成功: {key}")
+        return True
+    
+    # 保留解析得到的原始Markdown，便于排查和重新处理
+    upload_s3_object(markdown, bucket_name, md_file_path, content_type='text/markdown')
+    update_processing_status(key, '处理失败-转图片')
+    return False
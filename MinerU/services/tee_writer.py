@@ -0,0 +1,45 @@
+"""
+解析输出写入器模块，图片写入S3的同时保留一份内存副本，供增强阶段直接使用
+"""
+
+class TeeDataWriter:
+    """
+    包装MinerU的S3DataWriter：图片写入S3的同时记录到InMemoryImageStore
+    """
+    
+    def __init__(self, writer, key_prefix, image_store):
+        """
+        初始化写入器
+        
+        Args:
+            writer: 被包装的S3DataWriter
+            key_prefix: writer对应的S3对象键前缀
+            image_store: 图片存储，写入S3的数据同时记录到该存储
+        """
+        self.writer = writer
+        self.key_prefix = key_prefix.rstrip('/')
+        self.image_store = image_store
+    
+    def _key(self, path):
+        return f"{self.key_prefix}/{path}"
+    
+    def write(self, path, data):
+        """
+        写入二进制数据
+        
+        Args:
+            path: 相对于key_prefix的路径
+            data: 数据
+        """
+        self.writer.write(path, data)
+        self.image_store.put(self._key(path), data)
+    
+    def write_string(self, path, data):
+        """
+        写入文本数据
+        
+        Args:
+            path: 相对于key_prefix的路径
+            data: 文本
+        """
+        self.write(path, data.encode('utf-8'))
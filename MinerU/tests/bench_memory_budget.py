@@ -0,0 +1,98 @@
+"""
+内存预算基准：模拟图片下载和Bedrock分析的工作线程，比较启用和不启用内存预算时的吞吐量和进程峰值常驻内存
+
+每个任务按图片大小分配内存（模拟下载的图片数据），持有一段时间（模拟等待Bedrock响应）后释放。
+运行方式（在MinerU目录下）：
+    python tests/bench_memory_budget.py [--images 200] [--workers 32] [--budget-mb 64]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.memory_utils import MemoryBudget
+
+class PeakRSSSampler:
+    """后台线程定期采样进程常驻内存，记录峰值"""
+    
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            self._stop.wait(self.interval)
+    
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def run_workload(budget, image_sizes, workers, hold_seconds):
+    """
+    执行模拟工作负载
+    
+    Returns:
+        (吞吐量（图片/秒）, 峰值常驻内存增量（字节）, 预算统计)
+    """
+    def process_image(nbytes):
+        budget.acquire(nbytes)
+        try:
+            # 写入每一页使内存真正驻留
+            data = bytearray(nbytes)
+            for offset in range(0, nbytes, 4096):
+                data[offset] = 1
+            time.sleep(hold_seconds)
+            del data
+        finally:
+            budget.release(nbytes)
+    
+    baseline_rss = psutil.Process().memory_info().rss
+    with PeakRSSSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process_image, image_sizes))
+        elapsed = time.perf_counter() - started
+    return len(image_sizes) / elapsed, sampler.peak - baseline_rss, budget.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200, help='模拟的图片数')
+    parser.add_argument('--workers', type=int, default=32, help='工作线程数')
+    parser.add_argument('--min-mb', type=float, default=1, help='图片最小大小（MB）')
+    parser.add_argument('--max-mb', type=float, default=8, help='图片最大大小（MB）')
+    parser.add_argument('--hold-seconds', type=float, default=0.05, help='每张图片持有内存的时间（秒）')
+    parser.add_argument('--budget-mb', type=float, default=64, help='内存预算上限（MB）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    image_sizes = [int(rng.uniform(args.min_mb, args.max_mb) * 1024 * 1024) for _ in range(args.images)]
+    mb = 1024 * 1024
+    
+    print(f"{args.images} 张图片，{args.workers} 个线程，图片总大小 {sum(image_sizes) / mb:.0f} MB")
+    print(f"{'配置':<16}{'吞吐量(图片/秒)':>16}{'峰值RSS增量(MB)':>18}{'峰值预留(MB)':>16}{'等待次数':>10}")
+    for name, budget in (
+        ('不限制', MemoryBudget(0)),
+        (f'预算 {args.budget_mb:.0f} MB', MemoryBudget(int(args.budget_mb * mb)))
+    ):
+        throughput, peak_rss, stats = run_workload(budget, image_sizes, args.workers, args.hold_seconds)
+        print(f"{name:<16}{throughput:>16.1f}{peak_rss / mb:>18.1f}"
+              f"{stats['peak_reserved_bytes'] / mb:>16.1f}{stats['waits']:>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+测试公共配置，与服务运行时一致地将各模块目录加入导入路径
+"""
+
+import os
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _path in (_ROOT, os.path.join(_ROOT, 'aws'), os.path.join(_ROOT, 'markdown'), os.path.join(_ROOT, 'services')):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
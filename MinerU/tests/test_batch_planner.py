@@ -0,0 +1,76 @@
+"""
+图片批次规划测试，验证段落拆分、按图片数量和令牌预算装箱、调用内标签改写以及结果映射回各段落
+"""
+
+from aws.bedrock_utils import estimate_input_tokens
+from batch_planner import ImageBatchPlanner, split_analysis_task, build_batch_request, remap_batch_results
+
+def make_section(paragraph_idx, image_count, context_text='上下文'):
+    images = [(idx, f'https://cdn/{paragraph_idx}/{idx}.jpg', f'img-{paragraph_idx}-{idx}') for idx in range(1, image_count + 1)]
+    return (paragraph_idx, context_text, images)
+
+def test_split_analysis_task_skips_missing_images_and_chunks():
+    image_url_to_index = {'u1': 1, 'u2': 2, 'u3': 3, 'u4': 4}
+    # 第二张图片下载失败
+    task = ('上下文', ['b1', None, 'b3', 'b4'], image_url_to_index, 7)
+    
+    assert split_analysis_task(task, 2) == [
+        (7, '上下文', [(1, 'u1', 'b1'), (3, 'u3', 'b3')]),
+        (7, '上下文', [(4, 'u4', 'b4')])
+    ]
+
+def test_planner_packs_adjacent_sections_up_to_image_limit():
+    planner = ImageBatchPlanner(max_images=4, max_input_tokens=10 ** 6)
+    sections = [make_section(0, 1), make_section(1, 2), make_section(2, 2), make_section(3, 1)]
+    
+    completed = [batch for batch in (planner.add(section) for section in sections) if batch]
+    completed.append(planner.flush())
+    
+    assert [[section[0] for section in batch] for batch in completed] == [[0, 1], [2, 3]]
+    assert not planner.pending
+    assert planner.flush() is None
+
+def test_planner_respects_input_token_budget():
+    section_tokens = estimate_input_tokens(len('上下文'), 1)
+    planner = ImageBatchPlanner(max_images=100, max_input_tokens=section_tokens * 2)
+    
+    assert planner.add(make_section(0, 1)) is None
+    assert planner.add(make_section(1, 1)) is None
+    completed = planner.add(make_section(2, 1))
+    assert [section[0] for section in completed] == [0, 1]
+    assert planner.pending
+
+def test_oversized_section_forms_its_own_batch():
+    planner = ImageBatchPlanner(max_images=2, max_input_tokens=1)
+    # 单个片段超出令牌预算时仍单独成批，不会被丢弃
+    assert planner.add(make_section(0, 2)) is None
+    assert [section[0] for section in planner.add(make_section(1, 1))] == [0]
+    assert [section[0] for section in planner.flush()] == [1]
+
+def test_build_batch_request_relabels_images_per_call():
+    batch = [
+        (0, '见[image1]和[image2]', [(1, 'a1', 'A1'), (2, 'a2', 'A2')]),
+        # 第二个段落的image1已拆分到其他调用，只发送image2
+        (1, '见[image1]与[image2]', [(2, 'b2', 'B2')])
+    ]
+    
+    sections, label_map = build_batch_request(batch)
+    
+    assert sections == [
+        ('见[image1]和[image2]', [('image1', 'A1'), ('image2', 'A2')]),
+        ('见[图片]与[image3]', [('image3', 'B2')])
+    ]
+    assert label_map == {'image1': (0, 'a1', 1), 'image2': (0, 'a2', 2), 'image3': (1, 'b2', 2)}
+
+def test_remap_batch_results_restores_paragraph_labels():
+    label_map = {'image1': (0, 'a1', 1), 'image2': (0, 'a2', 2), 'image3': (1, 'b2', 2)}
+    
+    results = remap_batch_results({'image1': '图A1', 'image3': '图B2'}, label_map)
+    assert results == [
+        (0, {'a1': 1, 'a2': 2}, {'image1': '图A1'}),
+        (1, {'b2': 2}, {'image2': '图B2'})
+    ]
+    
+    # 调用失败时每个段落的结果为空字符串
+    failed = remap_batch_results('', label_map)
+    assert [(paragraph_idx, result) for paragraph_idx, _, result in failed] == [(0, ''), (1, '')]
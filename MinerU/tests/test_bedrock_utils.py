@@ -0,0 +1,151 @@
+"""
+Bedrock请求构建和s3Location回退测试，使用记录调用的桩客户端代替Bedrock
+"""
+
+import io
+import pytest
+from PIL import Image
+from botocore.exceptions import ClientError
+from config import IMAGE_CONFIG
+from image import processor
+from utils.memory_utils import MemoryBudget
+from aws import bedrock_utils
+from aws.bedrock_utils import S3ImageSource, build_image_analysis_request, analyze_image_sections_with_bedrock
+
+class StubBedrockClient:
+    """记录converse调用的桩客户端，包含s3Location图片的请求按需抛出错误"""
+    
+    def __init__(self, reject_s3_location=False, truncate_first=False):
+        self.reject_s3_location = reject_s3_location
+        self.truncate_first = truncate_first
+        self.requests = []
+    
+    def converse(self, modelId, messages, system, inferenceConfig):
+        self.requests.append(messages)
+        image_sources = [
+            block['image']['source']
+            for block in messages[0]['content']
+            if 'image' in block
+        ]
+        if self.reject_s3_location and any('s3Location' in source for source in image_sources):
+            raise ClientError(
+                {'Error': {'Code': 'AccessDeniedException', 'Message': 'Bedrock cannot read the S3 object'}},
+                'Converse'
+            )
+        labels = [block['text'] for block in messages[0]['content'][1:] if 'text' in block]
+        body = ', '.join(f'"{label}": "desc of {label}"' for label in labels)
+        if self.truncate_first and len(self.requests) == 1:
+            # 只完整输出第一张图片的条目，第二张图片的条目在中途被截断
+            return {
+                'output': {'message': {'content': [{'text': body[:body.index('", "') + 1] + ', "image2": "des'}]}},
+                'stopReason': 'max_tokens',
+                'usage': {'totalTokens': 10}
+            }
+        return {
+            'output': {'message': {'content': [{'text': body + '}'}]}},
+            'stopReason': 'end_turn',
+            'usage': {'totalTokens': 10}
+        }
+
+@pytest.fixture
+def stub_client(monkeypatch):
+    def install(**kwargs):
+        client = StubBedrockClient(**kwargs)
+        monkeypatch.setattr(bedrock_utils, 'get_bedrock_client', lambda: client)
+        return client
+    yield install
+    bedrock_utils._s3_image_source_disabled.clear()
+
+def test_build_image_analysis_request_keeps_labels_and_sources():
+    sections = [
+        ('第一段', [('image1', S3ImageSource('s3://bucket/a.png', 'png'))]),
+        ('第二段', [('image2', (b'jpeg-bytes', 'jpeg')), ('image3', b'png-bytes')])
+    ]
+    messages, system, valid_images = build_image_analysis_request(sections)
+    
+    assert valid_images == 3
+    content = messages[0]['content']
+    assert '[段落1]\n第一段' in content[0]['text'] and '[段落2]\n第二段' in content[0]['text']
+    assert [block['text'] for block in content[1::2]] == ['image1', 'image2', 'image3']
+    assert content[2]['image'] == {'format': 'png', 'source': {'s3Location': {'uri': 's3://bucket/a.png'}}}
+    assert content[4]['image'] == {'format': 'jpeg', 'source': {'bytes': b'jpeg-bytes'}}
+    assert content[6]['image'] == {'format': 'png', 'source': {'bytes': b'png-bytes'}}
+    # 助手消息以'{'预填，响应从JSON对象内部开始
+    assert messages[1] == {'role': 'assistant', 'content': [{'text': '{'}]}
+    assert system[0]['text']
+
+def make_png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def test_s3_location_rejection_retries_batch_with_prepared_image_bytes(stub_client, monkeypatch):
+    client = stub_client(reject_s3_location=True)
+    # 超过最长边上限的图片，回退路径与直接下载一样缩放并转为JPEG
+    oversize_png = make_png(IMAGE_CONFIG['MAX_DIMENSION'] * 2, 64)
+    downloads = []
+    monkeypatch.setattr(
+        processor, 'download_s3_object',
+        lambda bucket, key: downloads.append((bucket, key)) or oversize_png
+    )
+    monkeypatch.setattr(bedrock_utils, 'get_object_size', lambda bucket, key: len(oversize_png))
+    budget = MemoryBudget(0)
+    monkeypatch.setattr(bedrock_utils, 'get_memory_budget', lambda: budget)
+    monkeypatch.setitem(bedrock_utils.AWS_CONFIG, 'BEDROCK_MODEL_ID', 'amazon.nova-pro-v1:0')
+    assert bedrock_utils.supports_s3_image_source()
+    
+    sections = [('上下文', [
+        ('image1', S3ImageSource('s3://bucket/images/a.png', 'png')),
+        ('image2', (b'inline', 'jpeg'))
+    ])]
+    result = analyze_image_sections_with_bedrock(sections)
+    
+    assert result == {'image1': 'desc of image1', 'image2': 'desc of image2'}
+    assert downloads == [('bucket', 'images/a.png')]
+    assert len(client.requests) == 2
+    retried_images = [block['image'] for block in client.requests[1][0]['content'] if 'image' in block]
+    assert retried_images[0]['format'] == 'jpeg'
+    with Image.open(io.BytesIO(retried_images[0]['source']['bytes'])) as img:
+        assert max(img.size) == IMAGE_CONFIG['MAX_DIMENSION']
+    # 下载的图片数据在分析期间计入内存预算，结束后全部归还
+    stats = budget.stats()
+    assert stats['peak_reserved_bytes'] >= len(oversize_png)
+    assert stats['reserved_bytes'] == 0
+    # 本进程后续请求不再使用s3Location
+    assert not bedrock_utils.supports_s3_image_source()
+    assert bedrock_utils.get_s3_image_source('bucket', 'images/b.png') is None
+
+def test_unreadable_image_is_dropped_from_fallback_request(stub_client, monkeypatch):
+    client = stub_client(reject_s3_location=True)
+    monkeypatch.setattr(processor, 'download_s3_object', lambda bucket, key: b'not an image')
+    monkeypatch.setattr(bedrock_utils, 'get_object_size', lambda bucket, key: 12)
+    budget = MemoryBudget(0)
+    monkeypatch.setattr(bedrock_utils, 'get_memory_budget', lambda: budget)
+    
+    sections = [('上下文', [
+        ('image1', S3ImageSource('s3://bucket/images/a.png', 'png')),
+        ('image2', (b'inline', 'jpeg'))
+    ])]
+    result = analyze_image_sections_with_bedrock(sections)
+    
+    assert result == {'image2': 'desc of image2'}
+    retried_labels = [block['text'] for block in client.requests[1][0]['content'][1:] if 'text' in block]
+    assert retried_labels == ['image2']
+    assert budget.stats()['reserved_bytes'] == 0
+
+def test_accepted_s3_location_is_sent_without_download(stub_client):
+    stub_client()
+    result = analyze_image_sections_with_bedrock([('上下文', [('image1', S3ImageSource('s3://bucket/a.png', 'png'))])])
+    
+    assert result == {'image1': 'desc of image1'}
+    assert not bedrock_utils._s3_image_source_disabled.is_set()
+
+def test_truncated_response_requests_only_missing_images(stub_client):
+    client = stub_client(truncate_first=True)
+    sections = [('上下文', [('image1', (b'one', 'png')), ('image2', (b'two', 'png'))])]
+    result = analyze_image_sections_with_bedrock(sections)
+    
+    assert result == {'image1': 'desc of image1', 'image2': 'desc of image2'}
+    assert len(client.requests) == 2
+    follow_up_labels = [block['text'] for block in client.requests[1][0]['content'][1:] if 'text' in block]
+    assert follow_up_labels == ['image2']
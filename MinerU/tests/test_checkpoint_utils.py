@@ -0,0 +1,74 @@
+"""
+图片分析检查点测试，使用SQLite存储验证按文档保存、读取和删除检查点，以及重新运行时只分析没有记录结果的图片
+"""
+
+import pytest
+from aws import checkpoint_utils
+from aws.checkpoint_utils import SQLiteCheckpointStore, build_checkpoint_entry_id, load_checkpoint, save_checkpoint, clear_checkpoint
+from enhancer import MarkdownImageEnhancer
+
+MD_S3_URL = 's3://bucket/ProcessingFile/doc/doc.md'
+CONTEXT = '季度营收如[image1]所示，成本如[image2]所示'
+
+@pytest.fixture
+def sqlite_store(monkeypatch, tmp_path):
+    monkeypatch.setitem(checkpoint_utils.CHECKPOINT_CONFIG, 'BACKEND', 'sqlite')
+    monkeypatch.setitem(checkpoint_utils.CHECKPOINT_CONFIG, 'SQLITE_PATH', str(tmp_path / 'state' / 'checkpoints.db'))
+    checkpoint_utils.get_checkpoint_store.cache_clear()
+    yield checkpoint_utils.get_checkpoint_store()
+    checkpoint_utils.get_checkpoint_store.cache_clear()
+
+def test_entry_id_depends_on_url_and_context():
+    entry_id = build_checkpoint_entry_id('https://cdn/a.jpg', CONTEXT)
+    assert entry_id == build_checkpoint_entry_id('https://cdn/a.jpg', CONTEXT)
+    assert entry_id != build_checkpoint_entry_id('https://cdn/b.jpg', CONTEXT)
+    assert entry_id != build_checkpoint_entry_id('https://cdn/a.jpg', '其他上下文')
+
+def test_store_keeps_documents_separate(sqlite_store):
+    assert isinstance(sqlite_store, SQLiteCheckpointStore)
+    assert save_checkpoint('doc-a', {'e1': '营收柱状图', 'e2': ''})
+    assert save_checkpoint('doc-b', {'e1': '组织结构图'})
+    # 同一条目再次写入时覆盖
+    assert save_checkpoint('doc-a', {'e1': '营收柱状图（更新）'})
+    
+    assert load_checkpoint('doc-a') == {'e1': '营收柱状图（更新）', 'e2': ''}
+    assert clear_checkpoint('doc-a')
+    assert load_checkpoint('doc-a') == {}
+    assert load_checkpoint('doc-b') == {'e1': '组织结构图'}
+
+def test_disabled_backend_is_noop(monkeypatch):
+    monkeypatch.setitem(checkpoint_utils.CHECKPOINT_CONFIG, 'BACKEND', None)
+    checkpoint_utils.get_checkpoint_store.cache_clear()
+    try:
+        assert save_checkpoint('doc-a', {'e1': 'x'})
+        assert load_checkpoint('doc-a') == {}
+        assert clear_checkpoint('doc-a')
+    finally:
+        checkpoint_utils.get_checkpoint_store.cache_clear()
+
+def build_paragraphs():
+    image_info_list = [(None, None, 'https://cdn/a.jpg', 1), (None, None, 'https://cdn/b.jpg', 2)]
+    return [(CONTEXT, image_info_list, 0)]
+
+def test_rerun_only_analyzes_images_without_checkpoint(sqlite_store):
+    progress = []
+    first = MarkdownImageEnhancer('', MD_S3_URL, progress_callback=lambda done, total: progress.append((done, total)))
+    first.image_progress['total'] = 2
+    restored, pending = first.restore_checkpoint(build_paragraphs())
+    assert restored == [] and len(pending[0][1]) == 2
+    
+    # 第一次运行只完成了第一张图片的分析，随后失败
+    first.checkpoint_results([(0, {'https://cdn/a.jpg': 1}, {'image1': '营收柱状图'})])
+    assert progress == [(1, 2)]
+    
+    second = MarkdownImageEnhancer('', MD_S3_URL)
+    restored, pending = second.restore_checkpoint(build_paragraphs())
+    assert restored == [(0, {'https://cdn/a.jpg': 1}, {'image1': '营收柱状图'})]
+    assert pending == [(CONTEXT, [(None, None, 'https://cdn/b.jpg', 2)], 0)]
+
+def test_failed_calls_are_not_checkpointed(sqlite_store):
+    enhancer = MarkdownImageEnhancer('', MD_S3_URL)
+    enhancer.restore_checkpoint(build_paragraphs())
+    enhancer.checkpoint_results([(0, {'https://cdn/a.jpg': 1, 'https://cdn/b.jpg': 2}, '')])
+    
+    assert load_checkpoint(MD_S3_URL) == {}
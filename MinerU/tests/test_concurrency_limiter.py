@@ -0,0 +1,90 @@
+"""
+Bedrock自适应并发限制器测试，验证无限流时加性增长、限流时乘性衰减、延迟超阈值时停止增长，以及Converse调用的限流信号识别
+"""
+
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from aws import bedrock_utils
+from aws.bedrock_utils import AdaptiveConcurrencyLimiter
+
+# 等待线程进入阻塞状态的时间
+SETTLE_SECONDS = 0.1
+
+def complete_requests(limiter, count, throttled=False, latency=0.1):
+    for _ in range(count):
+        limiter.acquire()
+        limiter.release(throttled, latency)
+
+def test_limit_increases_additively_up_to_max():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=4)
+    # 每个成功请求增加 1/limit，约一轮（limit个请求）增加一个并发：2 -> 2.5 -> 2.9 -> 3.24
+    complete_requests(limiter, 2)
+    assert limiter.limit == 2
+    complete_requests(limiter, 1)
+    assert limiter.limit == 3
+    
+    complete_requests(limiter, 50)
+    assert limiter.limit == 4
+
+def test_throttle_decreases_once_per_round():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, min_limit=1, max_limit=16)
+    # 同一轮内的多个限流只衰减一次
+    complete_requests(limiter, 3, throttled=True)
+    assert limiter.limit == 4
+    
+    metrics = limiter.metrics()
+    assert metrics['total_requests'] == 3 and metrics['total_throttles'] == 3
+    assert metrics['throttle_rate'] == 1.0
+    assert metrics['in_flight'] == 0
+
+def test_limit_never_drops_below_min():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=2, max_limit=8)
+    complete_requests(limiter, 1, throttled=True)
+    assert limiter.limit == 2
+
+def test_high_latency_stops_growth():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=8, latency_threshold=1.0)
+    complete_requests(limiter, 20, latency=5.0)
+    assert limiter.limit == 2
+    assert limiter.metrics()['avg_latency'] == 5.0
+
+def test_acquire_blocks_at_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1)
+    limiter.acquire()
+    
+    acquired = threading.Event()
+    
+    def run():
+        limiter.acquire()
+        acquired.set()
+    
+    threading.Thread(target=run, daemon=True).start()
+    assert not acquired.wait(SETTLE_SECONDS)
+    limiter.release()
+    assert acquired.wait(1)
+    assert limiter.metrics()['in_flight'] == 1
+
+class ThrottlingClient:
+    def converse(self, modelId, messages, system, inferenceConfig):
+        raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'Converse')
+
+class FailingClient:
+    def converse(self, modelId, messages, system, inferenceConfig):
+        raise ClientError({'Error': {'Code': 'ValidationException', 'Message': 'bad request'}}, 'Converse')
+
+@pytest.mark.parametrize('client, throttles', [(ThrottlingClient(), 1), (FailingClient(), 0)])
+def test_converse_reports_throttling_to_limiter(monkeypatch, client, throttles):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, min_limit=1, max_limit=8)
+    monkeypatch.setattr(bedrock_utils, '_bedrock_limiter', limiter)
+    monkeypatch.setattr(bedrock_utils, 'get_bedrock_client', lambda: client)
+    
+    messages = [{'role': 'user', 'content': [{'text': 'hello'}]}]
+    with pytest.raises(ClientError):
+        bedrock_utils._converse(messages, [{'text': 'system'}], {'maxTokens': 10})
+    
+    metrics = limiter.metrics()
+    assert metrics['in_flight'] == 0
+    assert metrics['total_requests'] == 1
+    assert metrics['total_throttles'] == throttles
+    assert limiter.limit == (2 if throttles else 4)
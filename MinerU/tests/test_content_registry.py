@@ -0,0 +1,96 @@
+"""
+内容哈希登记测试，使用桩S3客户端验证相同内容在不同键下得到相同哈希，以及SQLite登记表的登记和查询
+"""
+
+import io
+import hashlib
+import pytest
+from aws import s3_utils, content_registry_utils
+from aws.s3_utils import get_content_hash
+from aws.content_registry_utils import SQLiteContentRegistry, lookup_processed_content, register_processed_content
+
+PDF_BYTES = b'%PDF-1.7 ' + b'x' * 1000
+
+class StubS3Client:
+    """按对象键返回预设HEAD响应和内容的桩客户端，记录get_object调用"""
+    
+    def __init__(self, objects):
+        self.objects = objects
+        self.get_calls = []
+    
+    def head_object(self, Bucket, Key):
+        return self.objects[Key]['head']
+    
+    def get_object(self, Bucket, Key):
+        self.get_calls.append(Key)
+        return {'Body': io.BytesIO(self.objects[Key]['body'])}
+
+@pytest.fixture
+def s3_objects(monkeypatch):
+    md5 = hashlib.md5(PDF_BYTES).hexdigest()
+    client = StubS3Client({
+        'SourceFile/dept-a/report.pdf': {'head': {'ETag': f'"{md5}"'}, 'body': PDF_BYTES},
+        'SourceFile/dept-b/report.pdf': {'head': {'ETag': f'"{md5}"'}, 'body': PDF_BYTES},
+        # 分段上传的ETag带分段数后缀，不是内容的MD5
+        'SourceFile/dept-c/report.pdf': {'head': {'ETag': '"0123abcd-3"'}, 'body': PDF_BYTES},
+        'SourceFile/dept-d/report.pdf': {'head': {'ETag': '"0123abcd-2"'}, 'body': PDF_BYTES},
+        # KMS加密对象的ETag不是内容的MD5
+        'SourceFile/dept-e/report.pdf': {
+            'head': {'ETag': f'"{md5}"', 'ServerSideEncryption': 'aws:kms'},
+            'body': PDF_BYTES
+        }
+    })
+    monkeypatch.setattr(s3_utils, 'get_s3_client', lambda: client)
+    return client
+
+def test_single_part_upload_uses_etag(s3_objects):
+    content_hash = get_content_hash('bucket', 'SourceFile/dept-a/report.pdf')
+    assert content_hash == f"md5:{hashlib.md5(PDF_BYTES).hexdigest()}"
+    assert get_content_hash('bucket', 'SourceFile/dept-b/report.pdf') == content_hash
+    assert s3_objects.get_calls == []
+
+def test_other_uploads_stream_sha256(s3_objects):
+    expected = f"sha256:{hashlib.sha256(PDF_BYTES).hexdigest()}"
+    # 分段方式不同的相同内容得到相同的哈希
+    assert get_content_hash('bucket', 'SourceFile/dept-c/report.pdf', chunk_size=100) == expected
+    assert get_content_hash('bucket', 'SourceFile/dept-d/report.pdf', chunk_size=333) == expected
+    assert get_content_hash('bucket', 'SourceFile/dept-e/report.pdf') == expected
+    assert len(s3_objects.get_calls) == 3
+
+def test_hash_failure_returns_none(s3_objects):
+    assert get_content_hash('bucket', 'SourceFile/missing.pdf') is None
+
+@pytest.fixture
+def sqlite_registry(monkeypatch, tmp_path):
+    monkeypatch.setitem(content_registry_utils.CONTENT_REGISTRY_CONFIG, 'BACKEND', 'sqlite')
+    monkeypatch.setitem(content_registry_utils.CONTENT_REGISTRY_CONFIG, 'SQLITE_PATH', str(tmp_path / 'state' / 'registry.db'))
+    content_registry_utils.get_content_registry.cache_clear()
+    yield content_registry_utils.get_content_registry()
+    content_registry_utils.get_content_registry.cache_clear()
+
+def test_registry_records_latest_outputs(sqlite_registry):
+    assert isinstance(sqlite_registry, SQLiteContentRegistry)
+    assert lookup_processed_content('md5:abc') is None
+    
+    assert register_processed_content('md5:abc', 'bucket', 'SourceFile/dept-a/report.pdf', 'ProcessingFile/dept-a/report.md')
+    assert lookup_processed_content('md5:abc') == {
+        'bucket': 'bucket',
+        'source_key': 'SourceFile/dept-a/report.pdf',
+        'md_file_path': 'ProcessingFile/dept-a/report.md'
+    }
+    
+    # 再次处理相同内容后以最近一次的输出为准
+    register_processed_content('md5:abc', 'bucket', 'SourceFile/dept-b/report.pdf', 'ProcessingFile/dept-b/report.md')
+    assert lookup_processed_content('md5:abc')['source_key'] == 'SourceFile/dept-b/report.pdf'
+    # 哈希获取失败时不登记也不查询
+    assert register_processed_content(None, 'bucket', 'SourceFile/x.pdf', 'ProcessingFile/x.md')
+    assert lookup_processed_content(None) is None
+
+def test_disabled_registry_is_noop(monkeypatch):
+    monkeypatch.setitem(content_registry_utils.CONTENT_REGISTRY_CONFIG, 'BACKEND', None)
+    content_registry_utils.get_content_registry.cache_clear()
+    try:
+        assert register_processed_content('md5:abc', 'bucket', 'SourceFile/a.pdf', 'ProcessingFile/a.md')
+        assert lookup_processed_content('md5:abc') is None
+    finally:
+        content_registry_utils.get_content_registry.cache_clear()
@@ -0,0 +1,88 @@
+"""
+感知哈希去重测试，验证跨文档索引只记录非空结果，且只在上下文相同时复用理解内容
+"""
+
+import io
+import pytest
+from PIL import Image
+import enhancer as enhancer_module
+from enhancer import MarkdownImageEnhancer
+from image.dedup import PerceptualHashIndex, compute_dhash, DocumentImageClusters
+
+CONTEXT = '季度营收如[image1]所示'
+
+def make_gradient_png(width=64, height=48, shift=0):
+    img = Image.new('L', (width, height))
+    img.putdata([min(255, (x * 4 + shift) % 256) for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def make_checker_png(width=64, height=48):
+    img = Image.new('L', (width, height))
+    img.putdata([255 if (x // 8 + y // 8) % 2 else 0 for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def test_index_skips_empty_results_and_matches_context():
+    index = PerceptualHashIndex(max_entries=10, max_distance=5)
+    image_hash = compute_dhash(make_gradient_png())
+    
+    index.add(image_hash, CONTEXT, '')
+    assert index.lookup(image_hash, CONTEXT) is None
+    
+    index.add(image_hash, CONTEXT, '营收柱状图')
+    assert index.lookup(image_hash, CONTEXT) == '营收柱状图'
+    # 近似重复图片在相同上下文中命中
+    assert index.lookup(image_hash ^ 0b11, CONTEXT) == '营收柱状图'
+    # 上下文不同时不复用
+    assert index.lookup(image_hash, '公司组织结构如[image1]所示') is None
+
+def test_index_evicts_least_recently_used():
+    index = PerceptualHashIndex(max_entries=2, max_distance=0)
+    index.add(1, CONTEXT, 'a')
+    index.add(2, CONTEXT, 'b')
+    assert index.lookup(1, CONTEXT) == 'a'
+    index.add(4, CONTEXT, 'c')
+    assert index.lookup(2, CONTEXT) is None
+    assert index.lookup(1, CONTEXT) == 'a'
+
+@pytest.fixture
+def shared_index(monkeypatch):
+    index = PerceptualHashIndex(max_entries=10, max_distance=5)
+    monkeypatch.setattr(enhancer_module, 'get_perceptual_hash_index', lambda: index)
+    return index
+
+def analyze_document(image_bytes, context_text, understanding):
+    """模拟一个文档的去重流程：下载后判断是否分析，分析完成后分发结果"""
+    enhancer = MarkdownImageEnhancer('', 's3://bucket/ProcessingFile/doc/doc.md')
+    url = 'https://cdn/images/a.jpg'
+    needs_analysis = enhancer._should_analyze_image((url, 1, (image_bytes, 'png'), 0), context_text)
+    analyzed_by_url = {url: understanding} if needs_analysis else {}
+    enhancer.resolve_duplicate_understanding(analyzed_by_url, 1)
+    return needs_analysis, analyzed_by_url.get(url)
+
+def test_failed_analysis_does_not_blank_later_documents(shared_index):
+    image_bytes = make_gradient_png()
+    
+    assert analyze_document(image_bytes, CONTEXT, '') == (True, '')
+    # 上一个文档分析失败，后续文档仍重新分析
+    assert analyze_document(image_bytes, CONTEXT, '营收柱状图') == (True, '营收柱状图')
+    assert analyze_document(image_bytes, CONTEXT, 'unused') == (False, '营收柱状图')
+
+def test_understanding_is_not_reused_in_other_context(shared_index):
+    image_bytes = make_gradient_png()
+    analyze_document(image_bytes, CONTEXT, '营收柱状图')
+    
+    assert analyze_document(image_bytes, '公司组织结构如[image1]所示', '组织结构图') == (True, '组织结构图')
+
+def test_duplicates_within_document_share_representative():
+    clusters = DocumentImageClusters(max_distance=5)
+    gradient = compute_dhash(make_gradient_png())
+    checker = compute_dhash(make_checker_png())
+    
+    assert clusters.assign(gradient, 'a', 0) is None
+    assert clusters.assign(gradient, 'b', 1) == 'a'
+    assert clusters.assign(checker, 'c', 2) is None
+    assert [url for _, url in clusters.representative_hashes()] == ['a', 'c']
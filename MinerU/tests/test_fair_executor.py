@@ -0,0 +1,74 @@
+"""
+公平调度线程池测试，验证按文档轮转调度、单个文档的在途任务上限、任务异常和取消，以及指标统计
+"""
+
+import threading
+import time
+import pytest
+from utils.fair_executor import FairShareExecutor
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError("等待条件超时")
+
+def test_small_document_is_not_starved_by_large_one():
+    executor = FairShareExecutor('test-rr', workers=1, max_in_flight_per_key=0)
+    gate = threading.Event()
+    order = []
+    
+    # 先占住唯一的工作线程，使两个文档的任务都进入等待队列
+    blocker = executor.submit('blocker', gate.wait)
+    large = [executor.submit('large', order.append, f'large-{i}') for i in range(8)]
+    small = [executor.submit('small', order.append, f'small-{i}') for i in range(2)]
+    gate.set()
+    
+    for future in [blocker] + large + small:
+        future.result(timeout=5)
+    # 大文档先提交，小文档的任务仍与其轮转执行
+    assert order[:4] == ['large-0', 'small-0', 'large-1', 'small-1']
+    assert order[4:] == [f'large-{i}' for i in range(2, 8)]
+
+def test_per_document_in_flight_limit():
+    executor = FairShareExecutor('test-limit', workers=4, max_in_flight_per_key=2)
+    gate = threading.Event()
+    try:
+        futures = [executor.submit('manual', gate.wait) for _ in range(4)]
+        wait_until(lambda: executor.metrics()['busy'] == 2)
+        time.sleep(0.05)
+        metrics = executor.metrics()
+        assert metrics['busy'] == 2 and metrics['queued'] == 2
+        
+        # 达到上限的文档不影响其他文档使用空闲线程
+        assert executor.submit('memo', lambda: 'done').result(timeout=5) == 'done'
+        wait_until(lambda: executor.metrics()['busy'] == 2)
+        assert executor.metrics()['queued'] == 2
+    finally:
+        gate.set()
+    
+    for future in futures:
+        future.result(timeout=5)
+    wait_until(lambda: executor.metrics()['documents'] == 0)
+    metrics = executor.metrics()
+    assert metrics['completed'] == 5 and metrics['busy'] == 0 and metrics['queued'] == 0
+
+def test_exceptions_and_cancellation():
+    executor = FairShareExecutor('test-errors', workers=1, max_in_flight_per_key=0)
+    gate = threading.Event()
+    ran = []
+    
+    blocker = executor.submit('doc', gate.wait)
+    failing = executor.submit('doc', int, 'not a number')
+    cancelled = executor.submit('doc', ran.append, 'cancelled')
+    assert cancelled.cancel()
+    gate.set()
+    
+    blocker.result(timeout=5)
+    with pytest.raises(ValueError):
+        failing.result(timeout=5)
+    # 工作线程在任务异常后继续执行后续任务，已取消的任务不执行
+    assert executor.submit('doc', lambda: 'next').result(timeout=5) == 'next'
+    assert ran == []
@@ -0,0 +1,86 @@
+"""
+图片清单测试，使用记录调用的桩S3客户端确认每个文档只发起一次分页LIST，不再逐个HEAD图片
+"""
+
+import pytest
+from aws import s3_utils
+from image.processor import ImageManifest
+from enhancer import MarkdownImageEnhancer
+
+MD_S3_URL = 's3://bucket/ProcessingFile/doc/doc.md'
+IMAGE_PREFIX = 'ProcessingFile/doc/images/'
+
+class StubPaginator:
+    """按页大小切分对象列表的list_objects_v2分页器"""
+    
+    def __init__(self, client):
+        self.client = client
+    
+    def paginate(self, Bucket, Prefix):
+        self.client.list_calls.append((Bucket, Prefix))
+        keys = sorted(key for key in self.client.objects if key.startswith(Prefix))
+        for start in range(0, len(keys), self.client.page_size):
+            page_keys = keys[start:start + self.client.page_size]
+            yield {'Contents': [{'Key': key, 'Size': self.client.objects[key]} for key in page_keys]}
+
+class StubS3Client:
+    """记录list_objects_v2分页和head_object调用的桩客户端"""
+    
+    def __init__(self, objects, page_size=2):
+        self.objects = objects
+        self.page_size = page_size
+        self.list_calls = []
+        self.head_calls = []
+    
+    def get_paginator(self, operation_name):
+        assert operation_name == 'list_objects_v2'
+        return StubPaginator(self)
+    
+    def head_object(self, Bucket, Key):
+        self.head_calls.append((Bucket, Key))
+        return {'ContentLength': self.objects.get(Key, 0)}
+
+@pytest.fixture
+def stub_s3(monkeypatch):
+    def install(objects, **kwargs):
+        client = StubS3Client(objects, **kwargs)
+        monkeypatch.setattr(s3_utils, 'get_s3_client', lambda: client)
+        return client
+    return install
+
+def test_manifest_lists_prefix_once_and_serves_sizes(stub_s3):
+    client = stub_s3({
+        f'{IMAGE_PREFIX}a.jpg': 100,
+        f'{IMAGE_PREFIX}b.jpg': 200,
+        f'{IMAGE_PREFIX}c.jpg': 300,
+        'ProcessingFile/other/images/d.jpg': 400
+    })
+    manifest = ImageManifest('bucket', IMAGE_PREFIX)
+    
+    assert manifest.get_size('bucket', f'{IMAGE_PREFIX}a.jpg') == 100
+    assert manifest.get_size('bucket', f'{IMAGE_PREFIX}c.jpg') == 300
+    # 前缀内不存在的对象视为大小0，不再发起HEAD
+    assert manifest.get_size('bucket', f'{IMAGE_PREFIX}missing.jpg') == 0
+    assert client.list_calls == [('bucket', IMAGE_PREFIX)]
+    assert client.head_calls == []
+    
+    # 清单范围外的对象回退到HEAD请求
+    assert manifest.get_size('bucket', 'ProcessingFile/other/images/d.jpg') == 400
+    assert client.head_calls == [('bucket', 'ProcessingFile/other/images/d.jpg')]
+
+def test_enhancer_uses_one_paginated_list_per_document(stub_s3):
+    image_count = 7
+    objects = {f'{IMAGE_PREFIX}img{i}.jpg': 8192 for i in range(image_count)}
+    objects[f'{IMAGE_PREFIX}tiny.jpg'] = 10
+    client = stub_s3(objects, page_size=3)
+    
+    md_content = '\n\n'.join(f'![图{i}](images/img{i}.jpg)' for i in range(image_count))
+    md_content += '\n\n![小图](images/tiny.jpg)'
+    enhancer = MarkdownImageEnhancer(md_content, MD_S3_URL)
+    result = enhancer.update_image_references()
+    
+    assert client.list_calls == [('bucket', IMAGE_PREFIX)]
+    assert client.head_calls == []
+    assert all(f'ProcessingFile/doc/images/img{i}.jpg)' in result for i in range(image_count))
+    # 小于最小尺寸的图片引用被删除
+    assert 'tiny.jpg' not in result
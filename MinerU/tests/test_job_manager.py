@@ -0,0 +1,300 @@
+"""
+异步任务管理测试，使用轻量阶段处理函数验证不同文档的阶段重叠执行与阶段间背压、按估算成本分配车道和车道内最短任务优先、任务持久化不保存访问凭证，以及服务重启后的任务恢复
+"""
+
+import sqlite3
+import threading
+import time
+from services import job_manager
+from services.job_manager import JobManager, _LaneQueue, STAGE_COMPLETED, JOB_QUEUED, JOB_AWAITING_CREDENTIALS, JOB_SUCCEEDED, JOB_FAILED
+
+SECRET_KEY = 'secret-access-key'
+
+def wait_for_status(manager, job_id, status, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job and job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"任务 {job_id} 未进入 {status} 状态: {manager.get(job_id)}")
+
+def build_manager(state_path, handler):
+    return JobManager(
+        handlers={'pdf': [('parse', handler)]},
+        stages={'parse': ({'default': 1}, 0)},
+        queue_size=10,
+        max_finished_jobs=10,
+        state_path=str(state_path)
+    )
+
+def test_persisted_params_exclude_credentials(tmp_path):
+    state_path = tmp_path / 'jobs.db'
+    gate = threading.Event()
+    started = threading.Event()
+    
+    def handler(params, context, progress_callback):
+        started.set()
+        gate.wait()
+        return True
+    
+    manager = build_manager(state_path, handler)
+    try:
+        manager.submit('pdf', {'bucket_name': 'bucket', 'key': 'a.pdf', 'ak': 'AKIAEXAMPLE', 'sk': SECRET_KEY})
+        assert started.wait(5)
+        
+        with sqlite3.connect(str(state_path)) as conn:
+            rows = conn.execute("SELECT params, record FROM jobs").fetchall()
+        assert rows
+        for params, record in rows:
+            assert SECRET_KEY not in params and 'AKIAEXAMPLE' not in params
+            assert SECRET_KEY not in record
+    finally:
+        gate.set()
+
+def test_recovered_job_waits_for_credentials(tmp_path):
+    state_path = tmp_path / 'jobs.db'
+    gate = threading.Event()
+    started = threading.Event()
+    
+    def blocking_handler(params, context, progress_callback):
+        started.set()
+        gate.wait()
+        return True
+    
+    first = build_manager(state_path, blocking_handler)
+    job_id = first.submit('pdf', {'bucket_name': 'bucket', 'key': 'a.pdf', 'ak': 'AKIAEXAMPLE', 'sk': SECRET_KEY})
+    assert started.wait(5)
+    
+    # 模拟服务重启：新的管理器从同一状态文件恢复未结束的任务
+    seen_params = []
+    
+    def recording_handler(params, context, progress_callback):
+        seen_params.append(dict(params))
+        return True
+    
+    try:
+        second = build_manager(state_path, recording_handler)
+        job = wait_for_status(second, job_id, JOB_AWAITING_CREDENTIALS)
+        assert job['stage'] == JOB_AWAITING_CREDENTIALS
+        assert not seen_params
+        
+        # 凭证不完整时不恢复
+        assert not second.resume(job_id, {'ak': 'AKIAEXAMPLE'})
+        assert not second.resume('missing', {'ak': 'AKIAEXAMPLE', 'sk': SECRET_KEY})
+        assert second.get(job_id)['status'] == JOB_AWAITING_CREDENTIALS
+        
+        assert second.resume(job_id, {'ak': 'AKIAEXAMPLE', 'sk': SECRET_KEY})
+        wait_for_status(second, job_id, JOB_SUCCEEDED)
+        assert seen_params == [{'bucket_name': 'bucket', 'key': 'a.pdf', 'ak': 'AKIAEXAMPLE', 'sk': SECRET_KEY}]
+        # 已在执行的任务不能重复恢复
+        assert not second.resume(job_id, {'ak': 'AKIAEXAMPLE', 'sk': SECRET_KEY})
+    finally:
+        gate.set()
+
+def test_recovered_job_without_credentials_requeues(tmp_path):
+    state_path = tmp_path / 'jobs.db'
+    gate = threading.Event()
+    started = threading.Event()
+    
+    def blocking_handler(params, context, progress_callback):
+        started.set()
+        gate.wait()
+        return True
+    
+    first = build_manager(state_path, blocking_handler)
+    job_id = first.submit('pdf', {'bucket_name': 'bucket', 'key': 'a.md'})
+    assert started.wait(5)
+    
+    try:
+        second = build_manager(state_path, lambda params, context, progress_callback: True)
+        wait_for_status(second, job_id, JOB_SUCCEEDED)
+    finally:
+        gate.set()
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError("等待条件超时")
+
+def test_next_document_parses_while_previous_enhances():
+    gate = threading.Event()
+    enhancing = threading.Event()
+    parsed = []
+    
+    def parse(params, context, progress_callback):
+        parsed.append(params['key'])
+        context['markdown'] = params['key']
+        return True
+    
+    def enhance(params, context, progress_callback):
+        assert context['markdown'] == params['key']
+        enhancing.set()
+        gate.wait()
+        return True
+    
+    manager = JobManager(
+        handlers={'pdf': [('parse', parse), ('enhance', enhance)]},
+        stages={'parse': ({'default': 1}, 0), 'enhance': ({'default': 1}, 0)},
+        queue_size=10,
+        max_finished_jobs=10
+    )
+    try:
+        first = manager.submit('pdf', {'key': 'a.pdf'})
+        assert enhancing.wait(5)
+        second = manager.submit('pdf', {'key': 'b.pdf'})
+        
+        # 文档A占用增强阶段时，文档B的解析阶段照常执行，随后在增强阶段排队
+        wait_until(lambda: parsed == ['a.pdf', 'b.pdf'])
+        wait_until(lambda: manager.get(second)['stage'] == 'enhance')
+        stages = manager.metrics()['stages']
+        assert stages['parse']['busy'] == 0 and stages['parse']['processed'] == 2
+        assert stages['enhance']['busy'] == 1 and stages['enhance']['queued'] == 1
+        assert manager.get(first)['stage'] == 'enhance'
+    finally:
+        gate.set()
+    
+    wait_for_status(manager, first, JOB_SUCCEEDED)
+    job = wait_for_status(manager, second, JOB_SUCCEEDED)
+    assert set(job['timings']) >= {'queue_wait', 'parse', 'enhance', 'enhance_queue_wait', 'total'}
+    assert manager.metrics()['stages']['enhance']['processed'] == 2
+
+def test_handoff_limit_blocks_previous_stage():
+    gate = threading.Event()
+    parsed = []
+    
+    def parse(params, context, progress_callback):
+        parsed.append(params['key'])
+        return True
+    
+    def enhance(params, context, progress_callback):
+        gate.wait()
+        return True
+    
+    manager = JobManager(
+        handlers={'pdf': [('parse', parse), ('enhance', enhance)]},
+        stages={'parse': ({'default': 1}, 0), 'enhance': ({'default': 1}, 1)},
+        queue_size=10,
+        max_finished_jobs=10
+    )
+    try:
+        job_ids = [manager.submit('pdf', {'key': f'{name}.pdf'}) for name in 'abcd']
+        # a在增强，b占用唯一的移交名额，c解析完成后解析线程阻塞在移交上，d仍在解析阶段排队
+        wait_until(lambda: len(parsed) == 3)
+        time.sleep(0.1)
+        assert parsed == ['a.pdf', 'b.pdf', 'c.pdf']
+        stages = manager.metrics()['stages']
+        assert stages['parse']['busy'] == 1 and stages['parse']['queued'] == 1
+        assert stages['enhance']['queued'] == 1
+        assert manager.get(job_ids[3])['status'] == JOB_QUEUED
+    finally:
+        gate.set()
+    
+    for job_id in job_ids:
+        wait_for_status(manager, job_id, JOB_SUCCEEDED)
+
+def test_completed_or_failed_stage_ends_job_and_runs_finalizer():
+    enhanced = []
+    finalized = []
+    
+    def parse(params, context, progress_callback):
+        if params['key'] == 'broken.pdf':
+            raise ValueError('parse failed')
+        return STAGE_COMPLETED if params['key'] == 'copy.pdf' else True
+    
+    def enhance(params, context, progress_callback):
+        enhanced.append(params['key'])
+        progress_callback(2, 2)
+        return True
+    
+    manager = JobManager(
+        handlers={'pdf': [('parse', parse), ('enhance', enhance)]},
+        stages={'parse': ({'default': 1}, 0), 'enhance': ({'default': 1}, 0)},
+        queue_size=10,
+        max_finished_jobs=10,
+        finalizers={'pdf': lambda params: finalized.append(params['key'])}
+    )
+    
+    normal = manager.submit('pdf', {'key': 'a.pdf'})
+    copied = manager.submit('pdf', {'key': 'copy.pdf'})
+    broken = manager.submit('pdf', {'key': 'broken.pdf'})
+    
+    assert wait_for_status(manager, normal, JOB_SUCCEEDED)['progress'] == {'done': 2, 'total': 2}
+    wait_for_status(manager, copied, JOB_SUCCEEDED)
+    assert wait_for_status(manager, broken, JOB_FAILED)['error'] == 'parse failed'
+    # 复用已有输出和解析失败的任务都不进入增强阶段
+    assert enhanced == ['a.pdf']
+    wait_until(lambda: len(finalized) == 3)
+    assert sorted(finalized) == ['a.pdf', 'broken.pdf', 'copy.pdf']
+    assert manager.metrics()['running'] == 0
+
+class FakeClock:
+    """手动推进的时钟，只替换任务管理模块中的time"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def time(self):
+        return self.now
+
+def test_lane_queue_orders_by_cost_and_ages_old_jobs(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(job_manager, 'time', clock)
+    queue = _LaneQueue(aging_seconds=60)
+    queue.put('large', 50, False)
+    clock.now += 1
+    queue.put('small', 5, True)
+    queue.put('medium', 20, False)
+    
+    # 最短任务优先
+    assert queue.get() == ('small', True, 0)
+    # 超过老化时间的任务按入队顺序优先于成本更小的任务
+    clock.now += 60
+    queue.put('tiny', 1, False)
+    assert queue.get()[0] == 'large'
+    assert queue.get()[0] == 'medium'
+    assert queue.get()[0] == 'tiny'
+    assert queue.qsize() == 0
+
+def test_jobs_are_routed_to_lanes_by_estimated_cost():
+    gate = threading.Event()
+    started = []
+    
+    def handler(params, context, progress_callback):
+        started.append(params['key'])
+        if params['key'] == 'large.pdf':
+            gate.wait()
+        return True
+    
+    manager = JobManager(
+        handlers={'pdf': [('parse', handler)]},
+        stages={'parse': ({'fast': 1, 'slow': 1}, 0)},
+        queue_size=10,
+        max_finished_jobs=10,
+        probes={'pdf': lambda params: {'cost': params['cost']} if params['cost'] is not None else None},
+        lanes={'fast': 10, 'slow': None}
+    )
+    try:
+        large = manager.submit('pdf', {'key': 'large.pdf', 'cost': 500})
+        unknown = manager.submit('pdf', {'key': 'unknown.pdf', 'cost': None})
+        small = manager.submit('pdf', {'key': 'small.pdf', 'cost': 3})
+        
+        assert manager.get(large)['lane'] == 'slow'
+        # 成本未知的任务进入最后一个车道
+        assert manager.get(unknown)['lane'] == 'slow'
+        assert manager.get(small)['lane'] == 'fast'
+        
+        # 大文档占用慢车道时，小文档在快车道照常完成
+        wait_for_status(manager, small, JOB_SUCCEEDED)
+        assert manager.get(unknown)['status'] == JOB_QUEUED
+        lanes = manager.metrics()['stages']['parse']['lanes']
+        assert lanes['slow']['busy'] == 1 and lanes['slow']['queued'] == 1
+        assert lanes['fast']['processed'] == 1
+    finally:
+        gate.set()
+    
+    wait_for_status(manager, unknown, JOB_SUCCEEDED)
+    assert started.index('large.pdf') < started.index('unknown.pdf')
@@ -0,0 +1,65 @@
+"""
+文件处理租约测试，在临时SQLite文件上验证获取冲突、过期接管、非持有者续约和过期租约回收
+"""
+
+import pytest
+from aws.lease_utils import SQLiteLeaseStore, LEASE_EXPIRED_STATUS
+
+TTL_SECONDS = 60
+# 负的有效期使租约在写入时即已过期，无需等待
+EXPIRED_TTL_SECONDS = -1
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteLeaseStore(str(tmp_path / 'leases.db'))
+
+def test_acquire_conflicts_while_lease_is_held(store):
+    assert store.acquire('a.pdf', 'server-1', TTL_SECONDS)
+    assert not store.acquire('a.pdf', 'server-2', TTL_SECONDS)
+    # 同一持有者重复获取视为成功
+    assert store.acquire('a.pdf', 'server-1', TTL_SECONDS)
+    assert store.get('a.pdf')['lease_owner'] == 'server-1'
+    
+    # 其他文件不受影响
+    assert store.acquire('b.pdf', 'server-2', TTL_SECONDS)
+
+def test_acquire_takes_over_expired_lease(store):
+    assert store.acquire('a.pdf', 'server-1', EXPIRED_TTL_SECONDS)
+    assert store.acquire('a.pdf', 'server-2', TTL_SECONDS)
+    assert store.get('a.pdf')['lease_owner'] == 'server-2'
+    
+    # 原持有者失去租约后不能续约或释放
+    assert not store.renew('a.pdf', 'server-1', TTL_SECONDS)
+    assert not store.release('a.pdf', 'server-1')
+
+def test_renew_by_non_owner_fails(store):
+    assert store.acquire('a.pdf', 'server-1', TTL_SECONDS)
+    expires_at = store.get('a.pdf')['lease_expires_at']
+    
+    assert not store.renew('a.pdf', 'server-2', TTL_SECONDS)
+    assert not store.renew('missing.pdf', 'server-1', TTL_SECONDS)
+    assert store.get('a.pdf')['lease_expires_at'] == expires_at
+    assert store.renew('a.pdf', 'server-1', TTL_SECONDS)
+
+def test_release_allows_next_acquire(store):
+    assert store.acquire('a.pdf', 'server-1', TTL_SECONDS)
+    assert not store.release('a.pdf', 'server-2')
+    assert store.release('a.pdf', 'server-1')
+    assert 'lease_owner' not in store.get('a.pdf')
+    assert store.acquire('a.pdf', 'server-2', TTL_SECONDS)
+
+def test_sweep_marks_expired_records_interrupted(store):
+    assert store.acquire('expired.pdf', 'server-1', EXPIRED_TTL_SECONDS)
+    assert store.acquire('active.pdf', 'server-2', TTL_SECONDS)
+    
+    assert store.sweep() == ['expired.pdf']
+    
+    expired = store.get('expired.pdf')
+    assert expired['status'] == LEASE_EXPIRED_STATUS
+    assert 'lease_owner' not in expired and 'lease_expires_at' not in expired
+    active = store.get('active.pdf')
+    assert active['lease_owner'] == 'server-2' and 'status' not in active
+    
+    # 已回收的记录不会被重复回收，且可以被重新获取
+    assert store.sweep() == []
+    assert store.acquire('expired.pdf', 'server-3', TTL_SECONDS)
@@ -0,0 +1,100 @@
+"""
+内存预算测试，验证预算耗尽时预留阻塞、释放后恢复、超大预留单独放行，以及并发下峰值预留不超过上限
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.memory_utils import MemoryBudget
+
+# 等待线程进入阻塞状态的时间
+SETTLE_SECONDS = 0.1
+
+def start_acquire(budget, nbytes):
+    """在后台线程中预留内存，返回完成事件"""
+    done = threading.Event()
+    
+    def run():
+        budget.acquire(nbytes)
+        done.set()
+    
+    threading.Thread(target=run, daemon=True).start()
+    return done
+
+def test_acquire_blocks_when_exhausted_and_resumes_after_release():
+    budget = MemoryBudget(100)
+    budget.acquire(80)
+    
+    done = start_acquire(budget, 40)
+    assert not done.wait(SETTLE_SECONDS)
+    assert budget.stats()['reserved_bytes'] == 80
+    
+    budget.release(80)
+    assert done.wait(1)
+    stats = budget.stats()
+    assert stats['reserved_bytes'] == 40
+    assert stats['waits'] == 1 and stats['overcommits'] == 0
+
+def test_oversize_reservation_is_admitted_alone():
+    budget = MemoryBudget(100)
+    # 没有其他预留时，超过上限的请求直接放行
+    budget.acquire(250)
+    assert budget.stats()['reserved_bytes'] == 250
+    
+    # 超大预留持有期间，其他请求等待其释放
+    done = start_acquire(budget, 10)
+    assert not done.wait(SETTLE_SECONDS)
+    budget.release(250)
+    assert done.wait(1)
+    
+    # 有其他预留时，超大请求等待到预算清空后单独放行
+    oversize_done = start_acquire(budget, 250)
+    assert not oversize_done.wait(SETTLE_SECONDS)
+    budget.release(10)
+    assert oversize_done.wait(1)
+    assert budget.stats()['reserved_bytes'] == 250
+
+def test_wait_timeout_overcommits():
+    budget = MemoryBudget(100, wait_timeout=0.05)
+    budget.acquire(80)
+    budget.acquire(40)
+    stats = budget.stats()
+    assert stats['reserved_bytes'] == 120
+    assert stats['overcommits'] == 1
+
+def test_lease_close_returns_unreleased_bytes():
+    budget = MemoryBudget(100)
+    lease = budget.lease()
+    lease.reserve(30)
+    lease.reserve(20)
+    lease.resize(20, 50)
+    lease.release(10)
+    assert budget.stats()['reserved_bytes'] == 70
+    
+    lease.close()
+    assert budget.stats()['reserved_bytes'] == 0
+    # 租约关闭后再次释放不会影响其他预留
+    budget.acquire(5)
+    lease.release(30)
+    assert budget.stats()['reserved_bytes'] == 5
+
+def test_concurrent_peak_stays_within_budget():
+    budget = MemoryBudget(100)
+    
+    def hold(nbytes):
+        budget.acquire(nbytes)
+        time.sleep(0.005)
+        budget.release(nbytes)
+    
+    sizes = [10, 25, 40, 60, 30] * 20
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(hold, sizes))
+    elapsed = time.perf_counter() - started
+    
+    stats = budget.stats()
+    assert stats['reserved_bytes'] == 0
+    assert stats['peak_reserved_bytes'] <= 100
+    assert stats['waits'] > 0 and stats['overcommits'] == 0
+    # 预算内仍有并发：串行执行至少需要 len(sizes) * 5ms
+    assert elapsed < len(sizes) * 0.005
@@ -0,0 +1,87 @@
+"""
+解析进程池测试，使用轻量任务函数验证取消、失败和迟到结果不会影响管理线程
+"""
+
+import os
+import time
+import pytest
+from parse_pool import ParseWorkerPool
+
+def slow_echo(value, seconds):
+    time.sleep(seconds)
+    return value
+
+def touch(path):
+    with open(path, 'w') as f:
+        f.write('ran')
+    return path
+
+def fail(message):
+    raise ValueError(message)
+
+def dispatch_shard(kind, arg):
+    """模拟分片解析：slow执行较久，fail立即失败，touch写入标记文件"""
+    if kind == 'slow':
+        return slow_echo(kind, arg)
+    if kind == 'fail':
+        return fail(arg)
+    return touch(arg)
+
+@pytest.fixture
+def pool():
+    pool = ParseWorkerPool(1)
+    yield pool
+    pool.shutdown()
+
+def test_cancelled_pending_task_is_not_dispatched(pool, tmp_path):
+    marker = tmp_path / 'cancelled'
+    running = pool.submit(slow_echo, 'first', 0.5)
+    cancelled = pool.submit(touch, str(marker))
+    
+    assert cancelled.cancel()
+    assert running.result(timeout=30) == 'first'
+    assert pool.run(slow_echo, 'next', 0) == 'next'
+    assert not marker.exists()
+    assert pool.metrics()['pending'] == 0
+
+def test_dispatched_task_cannot_be_cancelled(pool):
+    future = pool.submit(slow_echo, 'value', 0.5)
+    # 等待任务派发给工作进程
+    deadline = time.time() + 30
+    while not future.running() and time.time() < deadline:
+        time.sleep(0.01)
+    
+    assert not future.cancel()
+    assert future.result(timeout=30) == 'value'
+
+def test_late_result_for_finished_future_keeps_manager_alive(pool):
+    future = pool.submit(slow_echo, 'late', 0.5)
+    deadline = time.time() + 30
+    while not future.running() and time.time() < deadline:
+        time.sleep(0.01)
+    # 调用方在工作进程返回之前已放弃该任务并自行设置了结果
+    future.set_exception(RuntimeError('abandoned'))
+    
+    assert pool.run(slow_echo, 'after', 0) == 'after'
+    assert pool._manager.is_alive()
+
+def test_failed_task_raises_and_pool_keeps_working(pool):
+    with pytest.raises(RuntimeError, match='ValueError: broken'):
+        pool.run(fail, 'broken')
+    assert pool.run(slow_echo, os.getpid(), 0) == os.getpid()
+
+def test_run_all_failure_while_other_shard_in_flight(tmp_path):
+    pool = ParseWorkerPool(2)
+    try:
+        marker = tmp_path / 'not-started'
+        # 第一个分片仍在执行时第二个分片失败，第三个分片尚未派发
+        with pytest.raises(RuntimeError, match='ValueError: shard failed'):
+            pool.run_all(dispatch_shard, [('slow', 1.0), ('fail', 'shard failed'), ('touch', str(marker))])
+        
+        # 执行中的分片结果迟到后，进程池仍可继续解析
+        time.sleep(1.5)
+        assert pool._manager.is_alive()
+        assert pool.run_all(slow_echo, [(1, 0), (2, 0)]) == [1, 2]
+        assert not marker.exists()
+    finally:
+        pool.shutdown()
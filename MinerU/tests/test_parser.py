@@ -0,0 +1,73 @@
+"""
+Markdown拼接测试，验证相邻和重叠编辑区间的处理，以及重建耗时随图片数量线性增长
+"""
+
+import re
+import time
+from parser import splice_markdown
+
+IMAGE_PATTERN = r'!\[(.*?)\]\((.*?)\)'
+
+def build_markdown(image_count):
+    return '\n\n'.join(f'第{i}段文字。\n\n![图{i}](images/img{i}.jpg)' for i in range(image_count))
+
+def enhance_references(md_content):
+    """模拟增强器：替换每个图片引用并在其后插入图片解析"""
+    edits = []
+    for match in re.finditer(IMAGE_PATTERN, md_content):
+        edits.append((match.start(), match.end(), f'![{match.group(1)}](https://cdn/{match.group(2)})'))
+        edits.append((match.end(), match.end(), f'\n\n*图片解析：{match.group(1)}*'))
+    return splice_markdown(md_content, edits)
+
+def test_empty_edits_return_original():
+    assert splice_markdown('abc', []) == 'abc'
+
+def test_adjacent_spans_are_all_applied():
+    content = 'aaabbbccc'
+    edits = [(6, 9, 'Z'), (0, 3, 'X'), (3, 6, 'Y')]
+    assert splice_markdown(content, edits) == 'XYZ'
+
+def test_insertions_at_span_boundaries():
+    content = '![a](x)'
+    edits = [(len(content), len(content), ' after'), (0, len(content), '![a](y)'), (0, 0, 'before ')]
+    assert splice_markdown(content, edits) == 'before ![a](y) after'
+
+def test_multiple_insertions_at_same_position_keep_order():
+    assert splice_markdown('ab', [(1, 1, '1'), (1, 1, '2')]) == 'a12b'
+
+def test_overlapping_span_is_skipped():
+    content = '0123456789'
+    edits = [(2, 6, 'A'), (4, 8, 'B'), (8, 10, 'C')]
+    # (4, 8)与(2, 6)重叠被忽略，其余编辑照常生效
+    assert splice_markdown(content, edits) == '01A67C'
+
+def test_deletion_edits():
+    content = 'keep ![small](s.jpg) keep'
+    match = re.search(IMAGE_PATTERN, content)
+    assert splice_markdown(content, [(match.start(), match.end(), '')]) == 'keep  keep'
+
+def test_enhanced_markdown_matches_sequential_replacement():
+    md_content = build_markdown(50)
+    expected = md_content
+    for i in range(50):
+        expected = expected.replace(
+            f'![图{i}](images/img{i}.jpg)',
+            f'![图{i}](https://cdn/images/img{i}.jpg)\n\n*图片解析：图{i}*'
+        )
+    assert enhance_references(md_content) == expected
+
+def test_splice_time_grows_linearly_with_image_count():
+    def best_time(image_count):
+        md_content = build_markdown(image_count)
+        timings = []
+        for _ in range(3):
+            started = time.perf_counter()
+            enhance_references(md_content)
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+    
+    base_count = 2000
+    small = best_time(base_count)
+    large = best_time(base_count * 4)
+    # 线性实现约为4倍，逐个替换的二次实现约为16倍；留出计时抖动的余量
+    assert large / small < 10
@@ -0,0 +1,63 @@
+"""
+Bedrock速率限制器测试，验证请求数和令牌数令牌桶的突发容量、按实际用量多退少补，以及SQLite状态文件在多个限制器（模拟多个worker进程）之间共享配额
+"""
+
+import time
+from config import BEDROCK_RATE_LIMIT_CONFIG
+from aws.bedrock_utils import TokenBucketRateLimiter, estimate_request_tokens
+
+def timed_acquire(limiter, estimated_tokens):
+    started = time.perf_counter()
+    limiter.acquire(estimated_tokens)
+    return time.perf_counter() - started
+
+def test_unconfigured_limiter_does_not_wait():
+    limiter = TokenBucketRateLimiter(0, 0)
+    assert not limiter.enabled
+    for _ in range(100):
+        limiter.acquire(100000)
+    assert limiter.metrics() == {'enabled': False, 'waited_seconds': 0.0}
+
+def test_requests_bucket_allows_burst_then_waits():
+    # 每秒10个请求，桶容量为2个请求
+    limiter = TokenBucketRateLimiter(requests_per_minute=600, tokens_per_minute=0, burst_seconds=0.2)
+    assert timed_acquire(limiter, 0) < 0.05
+    assert timed_acquire(limiter, 0) < 0.05
+    
+    assert timed_acquire(limiter, 0) >= 0.08
+    assert limiter.metrics()['waited_seconds'] > 0
+
+def test_settle_refunds_overestimated_tokens():
+    # 每秒100个令牌，桶容量为100个令牌
+    limiter = TokenBucketRateLimiter(requests_per_minute=0, tokens_per_minute=6000, burst_seconds=1)
+    limiter.acquire(80)
+    # 实际只用了10个令牌，归还多扣的70个后下一个请求无需等待
+    limiter.settle(80, 10)
+    assert timed_acquire(limiter, 80) < 0.05
+    
+    # 实际用量超过估算时追加扣除，下一个请求需要等待补充
+    limiter.settle(80, 150)
+    assert timed_acquire(limiter, 50) >= 0.5
+
+def test_sqlite_state_is_shared_between_limiters(tmp_path):
+    state_path = str(tmp_path / 'buckets.db')
+    first = TokenBucketRateLimiter(requests_per_minute=600, tokens_per_minute=0, burst_seconds=0.2, state_path=state_path)
+    second = TokenBucketRateLimiter(requests_per_minute=600, tokens_per_minute=0, burst_seconds=0.2, state_path=state_path)
+    
+    first.acquire(0)
+    first.acquire(0)
+    # 另一个进程的限制器看到的是同一个已耗尽的桶
+    assert timed_acquire(second, 0) >= 0.08
+    assert second.metrics()['waited_seconds'] > 0
+    assert first.metrics()['waited_seconds'] == 0
+
+def test_estimate_request_tokens_counts_text_images_and_output():
+    messages = [{'role': 'user', 'content': [
+        {'text': 'a' * 100},
+        {'image': {'format': 'png', 'source': {'bytes': b''}}},
+        {'text': 'b' * 20}
+    ]}]
+    system = [{'text': 'c' * 80}]
+    
+    expected = int(200 / BEDROCK_RATE_LIMIT_CONFIG['CHARS_PER_TOKEN']) + BEDROCK_RATE_LIMIT_CONFIG['TOKENS_PER_IMAGE'] + 500
+    assert estimate_request_tokens(messages, system, {'maxTokens': 500}) == expected
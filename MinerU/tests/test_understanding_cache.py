@@ -0,0 +1,79 @@
+"""
+图片理解缓存测试，验证缓存键的组成、内存LRU与SQLite两级命中、按总大小淘汰最久未访问的条目，以及命中统计
+"""
+
+import json
+import pytest
+from image import understanding_cache
+from image.understanding_cache import UnderstandingCache, build_cache_key
+
+IMAGE_KEY = 'ProcessingFile/doc/images/' + 'ab' * 32 + '.jpg'
+
+class FakeClock:
+    """每次调用前进一秒的时钟，使SQLite中的访问时间严格递增"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def time(self):
+        self.now += 1
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(understanding_cache, 'time', clock)
+    return clock
+
+def test_cache_key_depends_on_image_context_and_model(monkeypatch):
+    key = build_cache_key(IMAGE_KEY, '上下文')
+    assert key == build_cache_key('other/prefix/' + 'AB' * 32 + '.png', '上下文')
+    assert key != build_cache_key(IMAGE_KEY, '其他上下文')
+    # 图片名不是SHA-256时不缓存
+    assert build_cache_key('ProcessingFile/doc/images/figure1.jpg', '上下文') is None
+    
+    monkeypatch.setitem(understanding_cache.AWS_CONFIG, 'BEDROCK_MODEL_ID', 'another-model')
+    assert build_cache_key(IMAGE_KEY, '上下文') != key
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = UnderstandingCache(memory_entries=2)
+    cache.put('a', '图片A')
+    cache.put('b', '图片B')
+    assert cache.get('a') == '图片A'
+    cache.put('c', '图片C')
+    
+    assert cache.get('b') is None
+    assert cache.get('a') == '图片A'
+    stats = cache.stats()
+    assert stats['memory_hits'] == 2 and stats['misses'] == 1 and stats['writes'] == 3
+    assert stats['memory_entries'] == 2
+    assert stats['hit_rate'] == pytest.approx(2 / 3)
+
+def test_disk_tier_survives_restart(tmp_path, clock):
+    db_path = str(tmp_path / 'cache' / 'understanding.db')
+    UnderstandingCache(memory_entries=10, db_path=db_path).put('a', '')
+    
+    # 新进程的缓存从SQLite命中，空字符串（图片无有效信息）也是有效结果
+    cache = UnderstandingCache(memory_entries=10, db_path=db_path)
+    assert cache.get('a') == ''
+    assert cache.get('a') == ''
+    stats = cache.stats()
+    assert stats['disk_hits'] == 1 and stats['memory_hits'] == 1 and stats['misses'] == 0
+
+def test_disk_tier_evicts_by_size(tmp_path, clock):
+    db_path = str(tmp_path / 'understanding.db')
+    value = 'x' * 100
+    entry_size = len(json.dumps(value))
+    cache = UnderstandingCache(memory_entries=1, db_path=db_path, max_db_bytes=entry_size * 2)
+    
+    cache.put('a', value)
+    cache.put('b', value)
+    # 读取a使其成为最近访问的条目，写入c时淘汰b
+    assert cache.get('a') == value
+    cache.put('c', value)
+    
+    reopened = UnderstandingCache(memory_entries=1, db_path=db_path)
+    assert reopened.get('b') is None
+    assert reopened.get('a') == value
+    assert reopened.get('c') == value
+    assert cache.stats()['evictions'] == 1
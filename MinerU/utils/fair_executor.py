@@ -0,0 +1,142 @@
+"""
+公平调度线程池模块，提供进程内共享的S3和Bedrock执行器，按文档轮转调度任务并限制单个文档的在途任务数
+"""
+
+import time
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+from functools import lru_cache
+from config import THREAD_POOL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class FairShareExecutor:
+    """
+    进程内共享的线程池：每个文档有独立的等待队列，空闲线程按轮转顺序从各文档的队列中取任务，
+    单个文档的在途任务数达到上限后跳过该文档，大文档不会占满线程池而使小文档长时间等待
+    """
+    
+    def __init__(self, name, workers, max_in_flight_per_key):
+        """
+        初始化线程池并启动工作线程
+        
+        Args:
+            name: 线程池名称，用于线程名和日志
+            workers: 工作线程数
+            max_in_flight_per_key: 单个文档的在途任务上限，0表示不限制
+        """
+        self.name = name
+        self.workers = workers
+        self.max_in_flight_per_key = max_in_flight_per_key
+        self._queues = {}  # 文档键 -> 等待任务队列
+        self._in_flight = {}  # 文档键 -> 在途任务数
+        self._ring = deque()  # 轮转顺序中的文档键
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._completed = 0
+        self._started_at = time.time()
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, key, func, *args):
+        """
+        提交任务
+        
+        Args:
+            key: 文档键，同一文档的任务共享在途任务上限并按提交顺序执行
+            func: 任务函数
+            *args: 函数参数
+        
+        Returns:
+            concurrent.futures.Future
+        """
+        future = concurrent.futures.Future()
+        with self._cond:
+            if key not in self._queues:
+                self._queues[key] = deque()
+                self._in_flight[key] = 0
+                self._ring.append(key)
+            self._queues[key].append((future, func, args))
+            self._cond.notify()
+        return future
+    
+    def _next_task(self):
+        """按轮转顺序选出下一个可执行任务的文档，调用方需持有锁"""
+        for _ in range(len(self._ring)):
+            key = self._ring[0]
+            self._ring.rotate(-1)
+            if not self._queues[key]:
+                continue
+            if self.max_in_flight_per_key and self._in_flight[key] >= self.max_in_flight_per_key:
+                continue
+            self._in_flight[key] += 1
+            return key, self._queues[key].popleft()
+        return None
+    
+    def _task_done(self, key):
+        """任务结束后更新在途任务数，文档没有剩余任务时移出轮转顺序；调用方需持有锁"""
+        self._in_flight[key] -= 1
+        if not self._queues[key] and not self._in_flight[key]:
+            del self._queues[key]
+            del self._in_flight[key]
+            self._ring.remove(key)
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = self._next_task()
+                while task is None:
+                    self._cond.wait()
+                    task = self._next_task()
+                self._busy += 1
+            
+            key, (future, func, args) = task
+            started = time.time()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            
+            with self._cond:
+                self._busy -= 1
+                self._busy_seconds += time.time() - started
+                self._completed += 1
+                self._task_done(key)
+                # 文档的在途任务数减少后，其等待中的任务可能重新可执行
+                self._cond.notify_all()
+    
+    def metrics(self):
+        """
+        获取线程池指标
+        
+        Returns:
+            包含线程数、忙碌线程数、等待任务数、活跃文档数、已完成任务数和利用率的字典
+        """
+        with self._cond:
+            uptime = time.time() - self._started_at
+            return {
+                'workers': self.workers,
+                'busy': self._busy,
+                'queued': sum(len(tasks) for tasks in self._queues.values()),
+                'documents': len(self._queues),
+                'completed': self._completed,
+                'utilization': self._busy_seconds / (uptime * self.workers) if uptime > 0 else 0.0
+            }
+
+@lru_cache(maxsize=1)
+def get_s3_executor():
+    """获取进程内共享的S3 I/O线程池（图片引用处理、图片信息提取和图片下载）"""
+    return FairShareExecutor('s3-io', THREAD_POOL_CONFIG['S3_WORKERS'], THREAD_POOL_CONFIG['S3_PER_DOCUMENT'])
+
+@lru_cache(maxsize=1)
+def get_bedrock_executor():
+    """获取进程内共享的Bedrock调用线程池，实际并发由自适应并发限制器控制"""
+    return FairShareExecutor('bedrock', THREAD_POOL_CONFIG['BEDROCK_WORKERS'], THREAD_POOL_CONFIG['BEDROCK_PER_DOCUMENT'])
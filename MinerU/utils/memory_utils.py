@@ -1,9 +1,15 @@
 """
-内存管理工具模块，提供内存优化和垃圾回收辅助函数
+内存管理工具模块，提供进程内存预算和垃圾回收辅助函数
 """
 
 import gc
+import time
 import logging
+import threading
+import functools
+from functools import lru_cache
+import psutil
+from config import MEMORY_CONFIG
 
 logger = logging.getLogger(__name__)
 
@@ -39,9 +45,26 @@ def force_garbage_collection():
     logger.debug(f"垃圾回收完成，收集了 {collected} 个对象")
     return collected
 
+def collect_garbage(checkpoint):
+    """
+    在显式检查点（如文档或分片处理结束）执行完整垃圾回收，不在逐张图片的热路径上调用
+    
+    Args:
+        checkpoint: 检查点名称，用于日志
+        
+    Returns:
+        收集的对象数量；未启用检查点垃圾回收时返回0
+    """
+    if not MEMORY_CONFIG['CHECKPOINT_GC']:
+        return 0
+    started = time.time()
+    collected = gc.collect()
+    logger.debug(f"检查点 {checkpoint} 垃圾回收完成，收集了 {collected} 个对象，耗时 {time.time() - started:.3f} 秒")
+    return collected
+
 def memory_optimized(func):
     """
-    内存优化装饰器，在函数执行前后执行垃圾回收
+    内存优化装饰器，函数执行结束后在检查点执行一次垃圾回收
     
     Args:
         func: 要装饰的函数
@@ -49,16 +72,157 @@ def memory_optimized(func):
     Returns:
         装饰后的函数
     """
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # 执行前垃圾回收
-        gc.collect()
-        
         try:
             # 执行函数
-            result = func(*args, **kwargs)
-            return result
+            return func(*args, **kwargs)
         finally:
             # 执行后垃圾回收
-            gc.collect()
+            collect_garbage(func.__name__)
     
     return wrapper
+
+class MemoryBudget:
+    """进程内共享的内存预算：工作线程在持有大块数据（如下载和待分析的图片）前按字节预留，预算不足时等待其他预留释放"""
+    
+    def __init__(self, max_bytes, wait_timeout=None):
+        """
+        初始化内存预算
+        
+        Args:
+            max_bytes: 预算上限（字节），0表示不限制（仍统计预留量）
+            wait_timeout: 预算不足时的最长等待时间（秒），超时后仍放行，None表示一直等待
+        """
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self._reserved = 0
+        self._peak_reserved = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._overcommits = 0
+        self._cond = threading.Condition()
+    
+    def acquire(self, nbytes, wait=True):
+        """
+        预留内存
+        
+        没有其他预留时，超过预算上限的单个请求也会放行，避免大图片永远无法处理
+        
+        Args:
+            nbytes: 预留字节数
+            wait: 预算不足时是否等待，False时直接超额预留
+        """
+        if nbytes <= 0:
+            return
+        with self._cond:
+            if wait and self.max_bytes > 0 and self._reserved > 0 and self._reserved + nbytes > self.max_bytes:
+                started = time.time()
+                deadline = started + self.wait_timeout if self.wait_timeout is not None else None
+                self._waits += 1
+                while self._reserved > 0 and self._reserved + nbytes > self.max_bytes:
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        # 同一段落的图片可能相互等待，超时后超额放行
+                        self._overcommits += 1
+                        logger.warning(f"内存预算等待超时，超额预留 {nbytes} 字节（已预留 {self._reserved} 字节）")
+                        break
+                    self._cond.wait(remaining)
+                self._wait_seconds += time.time() - started
+            self._reserved += nbytes
+            self._peak_reserved = max(self._peak_reserved, self._reserved)
+    
+    def release(self, nbytes):
+        """
+        释放预留的内存并唤醒等待的线程
+        
+        Args:
+            nbytes: 释放字节数
+        """
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self._reserved = max(0, self._reserved - nbytes)
+            self._cond.notify_all()
+    
+    def lease(self):
+        """
+        创建一个记录自身预留量的租约，供单个文档使用，关闭时归还尚未释放的部分
+        
+        Returns:
+            MemoryLease实例
+        """
+        return MemoryLease(self)
+    
+    def stats(self):
+        """
+        获取内存预算统计
+        
+        Returns:
+            包含预算上限、当前和峰值预留量、等待次数和时间、超额放行次数以及进程常驻内存的字典
+        """
+        with self._cond:
+            stats = {
+                'max_bytes': self.max_bytes,
+                'reserved_bytes': self._reserved,
+                'peak_reserved_bytes': self._peak_reserved,
+                'waits': self._waits,
+                'wait_seconds': self._wait_seconds,
+                'overcommits': self._overcommits
+            }
+        stats['rss_bytes'] = psutil.Process().memory_info().rss
+        return stats
+
+class MemoryLease:
+    """文档在内存预算中的预留，按文档累计，处理结束或出错时一次性归还，避免预留泄漏"""
+    
+    def __init__(self, budget):
+        """
+        初始化租约
+        
+        Args:
+            budget: 所属的MemoryBudget
+        """
+        self.budget = budget
+        self._held = 0
+        self._lock = threading.Lock()
+    
+    def reserve(self, nbytes, wait=True):
+        """预留内存，参数同MemoryBudget.acquire"""
+        self.budget.acquire(nbytes, wait)
+        with self._lock:
+            self._held += max(nbytes, 0)
+    
+    def release(self, nbytes):
+        """释放预留的内存，最多释放本租约持有的部分"""
+        with self._lock:
+            nbytes = min(max(nbytes, 0), self._held)
+            self._held -= nbytes
+        self.budget.release(nbytes)
+    
+    def resize(self, old_bytes, new_bytes):
+        """
+        调整一项预留的大小（如图片缩放后），增加部分不等待
+        
+        Args:
+            old_bytes: 原预留字节数
+            new_bytes: 新预留字节数
+        """
+        if new_bytes > old_bytes:
+            self.reserve(new_bytes - old_bytes, wait=False)
+        else:
+            self.release(old_bytes - new_bytes)
+    
+    def close(self):
+        """归还本租约持有的全部预留"""
+        with self._lock:
+            held, self._held = self._held, 0
+        self.budget.release(held)
+
+@lru_cache(maxsize=1)
+def get_memory_budget():
+    """获取进程内共享的内存预算"""
+    return MemoryBudget(
+        max_bytes=MEMORY_CONFIG['BUDGET_MB'] * 1024 * 1024,
+        wait_timeout=MEMORY_CONFIG['WAIT_TIMEOUT_SECONDS']
+    )